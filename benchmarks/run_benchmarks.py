@@ -0,0 +1,228 @@
+"""Benchmarks the main sublayout operations on synthetic boards at several scales, reporting per-phase
+wall time, pcbnew (SWIG wrapper) call counts, and peak Python memory, optionally comparing against a baseline.
+
+Run from the repository root, with KiCad's Python:
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import pcbnew
+
+from sublayout.board_utils import BoardUtils
+from sublayout.hierarchy_namer import HierarchyData
+from sublayout.replicate_sublayout import FootprintCorrespondence, ReplicationPlan
+from sublayout.save_sublayout import HierarchySelector
+
+from .synth_board import SynthParams, generate_file
+
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'TofArray_Unreplicated.kicad_pcb')
+DEFAULT_TEMPLATE_REF = 'U3'
+DEFAULT_SCALES = [
+    SynthParams(instances=4, footprints_per_instance=8, tracks_per_net=4, zone_corners=16),
+    SynthParams(instances=16, footprints_per_instance=8, tracks_per_net=4, zone_corners=16),
+    SynthParams(instances=64, footprints_per_instance=8, tracks_per_net=4, zone_corners=16),
+    SynthParams(instances=16, footprints_per_instance=32, tracks_per_net=16, zone_corners=256),
+]
+
+
+class PhaseResult(NamedTuple):
+    wall_s: float  # minimum over repeats
+    pcbnew_calls: int
+    peak_bytes: int  # peak traced Python allocations, does not include allocations inside pcbnew
+
+    def to_json(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class _CallCounter():
+    """Counts calls into the pcbnew SWIG wrapper module with sys.setprofile"""
+    def __init__(self) -> None:
+        self.count = 0
+        self._pcbnew_file = os.path.normcase(os.path.abspath(pcbnew.__file__))
+
+    def _profile(self, frame: Any, event: str, arg: Any) -> None:
+        if event == 'call' and os.path.normcase(os.path.abspath(frame.f_code.co_filename)) == self._pcbnew_file:
+            self.count += 1
+        elif event == 'c_call' and getattr(arg, '__module__', None) == '_pcbnew':
+            self.count += 1
+
+    def __enter__(self) -> '_CallCounter':
+        sys.setprofile(self._profile)
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        sys.setprofile(None)
+
+
+class BenchBoard(NamedTuple):
+    """Per-phase state, freshly loaded for each measurement so mutating phases start from the same board"""
+    board: pcbnew.BOARD
+    anchor: pcbnew.FOOTPRINT
+    path: Tuple[str, ...]
+
+
+def _load(filename: str, anchor_ref: str) -> BenchBoard:
+    board = pcbnew.LoadBoard(filename)  # type: pcbnew.BOARD
+    anchor = board.FindFootprintByReference(anchor_ref)
+    return BenchBoard(board, anchor, BoardUtils.footprint_path(anchor)[:-1])
+
+
+def _targets(bench: BenchBoard) -> List[Tuple[pcbnew.FOOTPRINT, Tuple[str, ...]]]:
+    namer = HierarchyData(bench.board)
+    sheetfile = namer.sheetfile_of(bench.path)
+    assert sheetfile is not None
+    instance_paths = [path for path in namer.instances_of(sheetfile) if path != bench.path]
+    source = HierarchySelector(bench.board, bench.path).get_elts()
+    anchors = FootprintCorrespondence.probe_by_tstamp(bench.board, source, bench.anchor, bench.board, instance_paths)
+    return [(anchor, path) for anchor, path in zip(anchors, instance_paths) if anchor is not None]
+
+
+def _phases() -> Dict[str, Tuple[Callable[[BenchBoard], Any], Callable[[BenchBoard, Any], None]]]:
+    """Returns phases by name, as (setup, measured) functions; setup is not measured"""
+    def setup_none(bench: BenchBoard) -> Any:
+        return None
+
+    def get_elts(bench: BenchBoard, state: Any) -> None:
+        HierarchySelector(bench.board, bench.path).get_elts()
+
+    def setup_targets(bench: BenchBoard) -> Any:
+        return HierarchySelector(bench.board, bench.path).get_elts(), _targets(bench)
+
+    def correspond(correspondence_fn: Any) -> Callable[[BenchBoard, Any], None]:
+        def run(bench: BenchBoard, state: Any) -> None:
+            source, targets = state
+            for target_anchor, target_path in targets:
+                correspondence_fn(bench.board, source, bench.board, target_path)
+        return run
+
+    def replicate(bench: BenchBoard, state: Any) -> None:
+        source, targets = state
+        ReplicationPlan(bench.board, source).replicate_many(bench.board, targets, FootprintCorrespondence.by_tstamp)
+
+    def create_sublayout(bench: BenchBoard, state: Any) -> None:
+        with tempfile.TemporaryDirectory() as output_dir:
+            HierarchySelector(bench.board, bench.path).create_sublayout(os.path.join(output_dir, 'sublayout.kicad_pcb'))
+
+    return {
+        'get_elts': (setup_none, get_elts),
+        'by_tstamp': (setup_targets, correspond(FootprintCorrespondence.by_tstamp)),
+        'by_refdes': (setup_targets, correspond(FootprintCorrespondence.by_refdes)),
+        'replicate': (setup_targets, replicate),
+        'create_sublayout': (setup_none, create_sublayout),
+    }
+
+
+def measure(filename: str, anchor_ref: str, setup: Callable[[BenchBoard], Any],
+            run: Callable[[BenchBoard, Any], None], repeat: int) -> PhaseResult:
+    """Measures a phase, with time, call counts and memory each measured in separate runs so they do not
+    distort each other"""
+    wall_s = float('inf')
+    for _ in range(repeat):
+        bench = _load(filename, anchor_ref)
+        state = setup(bench)
+        start = time.perf_counter()
+        run(bench, state)
+        wall_s = min(wall_s, time.perf_counter() - start)
+
+    bench = _load(filename, anchor_ref)
+    state = setup(bench)
+    with _CallCounter() as counter:
+        run(bench, state)
+
+    bench = _load(filename, anchor_ref)
+    state = setup(bench)
+    tracemalloc.start()
+    try:
+        run(bench, state)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return PhaseResult(wall_s, counter.count, peak_bytes)
+
+
+def run_benchmarks(template: str, template_ref: str, scales: List[SynthParams], phases: List[str],
+                   repeat: int) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Returns results as {scale name: {phase: PhaseResult json}}"""
+    all_phases = _phases()
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    with tempfile.TemporaryDirectory() as board_dir:
+        for params in scales:
+            filename, anchor_ref = generate_file(template, template_ref, params, board_dir)
+            scale_results = results.setdefault(params.name(), {})
+            for phase in phases:
+                setup, run = all_phases[phase]
+                result = measure(filename, anchor_ref, setup, run, repeat)
+                scale_results[phase] = result.to_json()
+                print(f"{params.name():>24} {phase:>16}: {result.wall_s * 1000:10.1f} ms "
+                      f"{result.pcbnew_calls:10d} calls {result.peak_bytes / 1024:10.0f} KiB", file=sys.stderr)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, Any]]], baseline: Dict[str, Dict[str, Dict[str, Any]]],
+            time_tolerance: float, calls_tolerance: float) -> List[str]:
+    """Returns regressions against the baseline, as human-readable strings. Scales and phases missing from
+    either side are skipped. Call counts are deterministic, so they are the more reliable regression signal."""
+    regressions = []
+    for scale, scale_results in results.items():
+        for phase, result in scale_results.items():
+            base = baseline.get(scale, {}).get(phase)
+            if base is None:
+                continue
+            if result['wall_s'] > base['wall_s'] * (1 + time_tolerance):
+                regressions.append(f"{scale} {phase}: wall time {result['wall_s']:.3f}s vs baseline {base['wall_s']:.3f}s")
+            if result['pcbnew_calls'] > base['pcbnew_calls'] * (1 + calls_tolerance):
+                regressions.append(f"{scale} {phase}: {result['pcbnew_calls']} pcbnew calls "
+                                   f"vs baseline {base['pcbnew_calls']}")
+    return regressions
+
+
+def _parse_scale(scale: str) -> SynthParams:
+    """Parses instances,footprints,tracks_per_net,zone_corners"""
+    instances, footprints, tracks_per_net, zone_corners = [int(value) for value in scale.split(',')]
+    return SynthParams(instances, footprints, tracks_per_net, zone_corners)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sublayout operations on synthetic boards.")
+    parser.add_argument("--template", type=str, default=DEFAULT_TEMPLATE, help="Template .kicad_pcb board")
+    parser.add_argument("--ref", type=str, default=DEFAULT_TEMPLATE_REF,
+                        help="Refdes of a footprint in the template hierarchy block")
+    parser.add_argument("--scale", type=_parse_scale, action='append', default=None,
+                        help="Scale as instances,footprints,tracks_per_net,zone_corners; may be repeated")
+    parser.add_argument("--phase", type=str, action='append', default=None, choices=list(_phases().keys()),
+                        help="Phase to run; may be repeated, defaults to all")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repeats, the minimum is reported")
+    parser.add_argument("--output", type=str, default=None, help="Write results JSON here")
+    parser.add_argument("--save-baseline", type=str, default=None, help="Write results as a new baseline here")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare against this baseline")
+    parser.add_argument("--time-tolerance", type=float, default=0.25,
+                        help="Allowed fractional wall time increase over the baseline")
+    parser.add_argument("--calls-tolerance", type=float, default=0.05,
+                        help="Allowed fractional pcbnew call count increase over the baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.template, args.ref, args.scale or DEFAULT_SCALES,
+                             args.phase or list(_phases().keys()), args.repeat)
+    for output in [args.output, args.save_baseline]:
+        if output is not None:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tolerance, args.calls_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
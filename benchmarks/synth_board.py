@@ -0,0 +1,175 @@
+"""Generates synthetic multi-instance boards from a fixture board, for benchmarking.
+The hierarchy block containing a template footprint is cloned into a number of instances, scaling footprints per
+instance, and the first instance is given a synthetic layout (tracks per net, zones with a number of corners)
+so it can be replicated into the others."""
+import argparse
+import math
+import os
+import uuid
+from typing import Dict, List, NamedTuple, Tuple
+
+import pcbnew
+
+from sublayout.board_utils import BoardUtils, IsKicad10
+from sublayout.save_sublayout import HierarchySelector
+
+
+_NAMESPACE = uuid.UUID('5ab1a10a-0000-4000-8000-000000000000')  # for deterministic generated tstamps
+
+
+class SynthParams(NamedTuple):
+    instances: int  # hierarchy block instances, including the source instance
+    footprints_per_instance: int
+    tracks_per_net: int  # track segments per internal net, in the source instance
+    zone_corners: int  # corners of each zone, in the source instance
+    zones_per_instance: int = 1
+
+    def name(self) -> str:
+        return f"i{self.instances}_f{self.footprints_per_instance}_t{self.tracks_per_net}_z{self.zone_corners}"
+
+
+def _tstamp(*names: object) -> str:
+    return str(uuid.uuid5(_NAMESPACE, '/'.join(str(name) for name in names)))
+
+
+def _duplicate_footprint(footprint: pcbnew.FOOTPRINT) -> pcbnew.FOOTPRINT:
+    if IsKicad10:
+        return footprint.Duplicate(False).Cast()
+    else:
+        return footprint.Duplicate().Cast()
+
+
+def generate_board(template_file: str, template_ref: str, params: SynthParams) -> Tuple[pcbnew.BOARD, str]:
+    """Returns a board with params.instances clones of the hierarchy block containing template_ref,
+    and the refdes of an anchor footprint in the source (first) instance.
+    The original block is replaced by the clones. Nets internal to the block are duplicated per instance,
+    nets shared with the rest of the board (eg, power) are kept."""
+    board = pcbnew.LoadBoard(template_file)  # type: pcbnew.BOARD
+    template_anchor = board.FindFootprintByReference(template_ref)
+    assert template_anchor is not None, f"no template footprint {template_ref}"
+    block_path = BoardUtils.footprint_path(template_anchor)[:-1]
+    selection = HierarchySelector(board, block_path).get_elts()
+    template_footprints = sorted(selection.footprints, key=lambda fp: BoardUtils.split_refdes(fp.GetReference()))
+    internal_netcodes = set(selection.netcodes)
+    nets_by_netcode: Dict[int, pcbnew.NETINFO_ITEM] = board.GetNetsByNetcode()
+
+    # footprints are cycled through if more are requested than the template block has
+    block_footprints = [template_footprints[i % len(template_footprints)]
+                        for i in range(params.footprints_per_instance)]
+    bbox = template_anchor.GetBoundingBox()
+    for footprint in template_footprints:
+        bbox.Merge(footprint.GetBoundingBox())
+    pitch_x = bbox.GetWidth() + pcbnew.FromMM(5)
+    pitch_y = bbox.GetHeight() + pcbnew.FromMM(5)
+    grid_cols = max(1, math.ceil(math.sqrt(params.instances)))
+
+    refdes_counts: Dict[str, int] = {}
+    instance_footprints: List[List[pcbnew.FOOTPRINT]] = []
+    instance_nets: List[Dict[int, pcbnew.NETINFO_ITEM]] = []
+    for instance in range(params.instances):
+        offset = pcbnew.VECTOR2I((instance % grid_cols) * pitch_x, (instance // grid_cols) * pitch_y)
+        sheet_tstamp = _tstamp('sheet', instance)
+        nets: Dict[int, pcbnew.NETINFO_ITEM] = {}
+        footprints = []
+        for index, template_footprint in enumerate(block_footprints):
+            footprint = _duplicate_footprint(template_footprint)
+            refdes_type, _ = BoardUtils.split_refdes(template_footprint.GetReference())
+            refdes_counts[refdes_type] = refdes_counts.get(refdes_type, 0) + 1
+            footprint.SetReference(f"{refdes_type}{refdes_counts[refdes_type]}")
+            # leaf tstamps are shared across instances, so instances match by tstamp
+            footprint.SetPath(pcbnew.KIID_PATH('/' + '/'.join(block_path[:-1] + (sheet_tstamp, _tstamp('leaf', index)))))
+            footprint.SetSheetfile(template_anchor.GetSheetfile())
+            footprint.SetSheetname(f"{template_anchor.GetSheetname()}_{instance}")
+            footprint.SetPosition(footprint.GetPosition() + offset)
+            for pad in footprint.Pads():  # type: pcbnew.PAD
+                netcode = pad.GetNetCode()
+                if netcode not in internal_netcodes:
+                    continue
+                net = nets.get(netcode)
+                if net is None:
+                    net = pcbnew.NETINFO_ITEM(board, f"{nets_by_netcode[netcode].GetNetname()}_synth{instance}")
+                    board.Add(net)
+                    nets[netcode] = net
+                pad.SetNet(net)
+            board.Add(footprint)
+            footprints.append(footprint)
+        instance_footprints.append(footprints)
+        instance_nets.append(nets)
+
+    # remove the template block, including its layout, which is replaced by the synthetic layout below
+    HierarchySelector(board, block_path).delete(())
+
+    _generate_layout(board, instance_footprints[0], instance_nets[0], params)
+    anchor_type, _ = BoardUtils.split_refdes(block_footprints[0].GetReference())
+    return board, f"{anchor_type}1"  # first of its type, so in the first instance
+
+
+def _generate_layout(board: pcbnew.BOARD, footprints: List[pcbnew.FOOTPRINT], nets: Dict[int, pcbnew.NETINFO_ITEM],
+                     params: SynthParams) -> None:
+    """Adds tracks (chained between the pads of each net) and zones to the source instance"""
+    netcodes = {net.GetNetCode() for net in nets.values()}
+    points_by_net: Dict[int, List[Tuple[int, int]]] = {}
+    for footprint in footprints:
+        for pad in footprint.Pads():
+            if pad.GetNetCode() in netcodes:
+                points_by_net.setdefault(pad.GetNetCode(), []).append((pad.GetPosition().x, pad.GetPosition().y))
+
+    def point_along(points: List[Tuple[int, int]], t: float) -> pcbnew.VECTOR2I:
+        """Returns the point at fraction t along the chain of points"""
+        f = t * (len(points) - 1)
+        i = min(int(f), len(points) - 2)
+        (x0, y0), (x1, y1) = points[i], points[i + 1]
+        return pcbnew.VECTOR2I(int(x0 + (x1 - x0) * (f - i)), int(y0 + (y1 - y0) * (f - i)))
+
+    width = pcbnew.FromMM(0.2)
+    for netcode, points in points_by_net.items():
+        if len(points) < 2:
+            points.append((points[0][0] + pcbnew.FromMM(1), points[0][1]))
+        for i in range(params.tracks_per_net):  # subdivide the chain between pads into the requested segments
+            track = pcbnew.PCB_TRACK(board)
+            track.SetStart(point_along(points, i / params.tracks_per_net))
+            track.SetEnd(point_along(points, (i + 1) / params.tracks_per_net))
+            track.SetWidth(width)
+            track.SetLayer(pcbnew.F_Cu)
+            track.SetNetCode(netcode)
+            board.Add(track)
+
+    zone_nets = list(nets.values())
+    center = footprints[0].GetPosition()
+    radius = pcbnew.FromMM(3)
+    for zone_index in range(params.zones_per_instance):
+        zone = pcbnew.ZONE(board)
+        zone.SetLayer(pcbnew.B_Cu)
+        if zone_nets:
+            zone.SetNetCode(zone_nets[zone_index % len(zone_nets)].GetNetCode())
+        outline = zone.Outline()
+        outline.NewOutline()
+        for corner in range(params.zone_corners):
+            angle = 2 * math.pi * corner / params.zone_corners
+            outline.Append(int(center.x + radius * math.cos(angle)), int(center.y + radius * math.sin(angle)))
+        board.Add(zone)
+
+
+def generate_file(template_file: str, template_ref: str, params: SynthParams, output_dir: str) -> Tuple[str, str]:
+    """Generates and saves a synthetic board, returning its filename and the (source instance) anchor refdes"""
+    board, anchor_ref = generate_board(template_file, template_ref, params)
+    output_file = os.path.join(output_dir, f"synth_{params.name()}.kicad_pcb")
+    board.Save(output_file)
+    return output_file, anchor_ref
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-instance board from a fixture board.")
+    parser.add_argument("template", type=str, help="Template .kicad_pcb board")
+    parser.add_argument("ref", type=str, help="Refdes of a footprint in the hierarchy block to clone")
+    parser.add_argument("output_dir", type=str, help="Output directory")
+    parser.add_argument("--instances", type=int, default=16)
+    parser.add_argument("--footprints", type=int, default=8, help="Footprints per instance")
+    parser.add_argument("--tracks-per-net", type=int, default=4)
+    parser.add_argument("--zone-corners", type=int, default=16)
+    args = parser.parse_args()
+
+    filename, anchor_ref = generate_file(args.template, args.ref,
+                                         SynthParams(args.instances, args.footprints, args.tracks_per_net,
+                                                     args.zone_corners), args.output_dir)
+    print(f"{filename} (anchor {anchor_ref})")
@@ -1,17 +1,25 @@
+import bisect
 import os
+import threading
 import traceback
-from typing import List, Callable, Tuple, Optional, cast, Iterable
+from typing import Any, Dict, List, Callable, Tuple, Optional, cast, Iterable
 
 import pcbnew
 import wx  # type: ignore
 
-from .sublayout.replicate_sublayout import ReplicateSublayout, FootprintCorrespondence
+from .sublayout.replicate_sublayout import FootprintCorrespondence, ReplicationPlan, CorrespondenceFn, \
+    AnchorProbeFn
 from .sublayout.hierarchy_namer import HierarchyData
-from .sublayout.save_sublayout import HierarchySelector
+from .sublayout.replication_record import ReplicationRecord
+from .sublayout.sublayout_cache import SublayoutCache
+from .sublayout.sublayout_snapshot import write_snapshot
+from .sublayout.save_sublayout import FilterResult, SelectionCache
 from .sublayout.board_utils import BoardUtils, GroupLike, PcbGroupType, GroupWrapper
+from .sublayout import telemetry
 
 
 class HighlightManager():
+    """Tracks highlighted board items by identity, so changing the highlight only touches the items that differ."""
     @classmethod
     def _highlight_footprint(cls, footprint: pcbnew.FOOTPRINT, bright: bool = True) -> None:
         """Highlight a footprint on the board, including pads."""
@@ -24,35 +32,116 @@ class HighlightManager():
             for pad in footprint.Pads():
                 pad.ClearBrightened()
 
+    @classmethod
+    def _set_brightened(cls, item: pcbnew.EDA_ITEM, bright: bool) -> None:
+        if isinstance(item, pcbnew.FOOTPRINT):
+            cls._highlight_footprint(item, bright)
+        elif bright:
+            item.SetBrightened()
+        else:
+            item.ClearBrightened()
+
     def __init__(self, board: pcbnew.BOARD) -> None:
         self._board = board
-        self._highlighted_items: List[pcbnew.EDA_ITEM] = []
+        self._highlighted_items: Dict[str, pcbnew.EDA_ITEM] = {}  # by item id, groups are flattened to their items
 
-    def highlight(self, items: Iterable[pcbnew.EDA_ITEM]) -> None:
-        """Highlights the given items on the board."""
+    def _flatten(self, items: Iterable[pcbnew.EDA_ITEM]) -> Dict[str, pcbnew.EDA_ITEM]:
+        flattened: Dict[str, pcbnew.EDA_ITEM] = {}
         for item in items:
-            if isinstance(item, pcbnew.FOOTPRINT):
-                self._highlight_footprint(item, True)
-            elif isinstance(item, PcbGroupType):
-                self.highlight(GroupWrapper(self._board, item).items())
-            else:
-                item.SetBrightened()
-        self._highlighted_items.extend(items)
-
-    def clear(self) -> None:
-        """Clears the highlights on the board."""
-        def clear_item(item: pcbnew.EDA_ITEM) -> None:
-            if isinstance(item, pcbnew.FOOTPRINT):
-                self._highlight_footprint(item, False)
-            elif isinstance(item, PcbGroupType):
-                for subitem in GroupWrapper(self._board, item).items():
-                    clear_item(subitem)
+            if isinstance(item, PcbGroupType):
+                for subitem in GroupWrapper(self._board, item).recursive_items():
+                    flattened[BoardUtils.item_id(subitem)] = subitem
             else:
-                item.ClearBrightened()
+                flattened[BoardUtils.item_id(item)] = item
+        return flattened
+
+    def highlight(self, items: Iterable[pcbnew.EDA_ITEM]) -> bool:
+        """Highlights the given items on the board, in addition to those already highlighted.
+        Returns whether any highlight changed."""
+        added = {item_id: item for item_id, item in self._flatten(items).items()
+                 if item_id not in self._highlighted_items}
+        for item in added.values():
+            self._set_brightened(item, True)
+        self._highlighted_items.update(added)
+        return bool(added)
+
+    def set(self, items: Iterable[pcbnew.EDA_ITEM]) -> bool:
+        """Highlights exactly the given items, brightening and clearing only items whose highlight changed.
+        Returns whether any highlight changed."""
+        new_items = self._flatten(items)
+        removed = [item for item_id, item in self._highlighted_items.items() if item_id not in new_items]
+        added = [item for item_id, item in new_items.items() if item_id not in self._highlighted_items]
+        for item in removed:
+            self._set_brightened(item, False)
+        for item in added:
+            self._set_brightened(item, True)
+        self._highlighted_items = new_items
+        return bool(removed or added)
+
+    def clear(self) -> bool:
+        """Clears the highlights on the board. Must be called before highlighted items are deleted.
+        Returns whether any highlight changed."""
+        return self.set([])
+
+
+class RefreshCoalescer():
+    """Coalesces board refresh requests, so at most one redraw happens per UI event loop cycle."""
+    def __init__(self) -> None:
+        self._pending = False
+
+    def request(self) -> None:
+        if not self._pending:
+            self._pending = True
+            wx.CallAfter(self._refresh)
+
+    def _refresh(self) -> None:
+        self._pending = False
+        pcbnew.Refresh()
+
 
-        for item in self._highlighted_items:
-            clear_item(item)
-        self._highlighted_items.clear()
+class BackgroundTask():
+    """Runs a function in a worker thread, which reports back to the UI thread with post() until cancelled.
+    Posted callbacks are run with wx.CallAfter, in order, and dropped if the task has been cancelled by then,
+    so stale work never touches the UI. The function should check cancelled periodically to stop early.
+    If the function raises, on_error is posted with the exception, so the UI can clear the task and report it.
+    The worker starts after the tasks in after have finished, so workers sharing (non thread-safe) state, like the
+    board index, never run concurrently. The UI thread must likewise not use that state, or modify the board,
+    until the task has finished (see wait)."""
+    def __init__(self, fn: Callable[['BackgroundTask'], None], on_error: Callable[[Exception], None],
+                 after: Iterable['BackgroundTask'] = ()) -> None:
+        self._cancelled = threading.Event()
+        self._on_error = on_error
+        self._after = list(after)
+        self._thread = threading.Thread(target=self._run, args=(fn, ), daemon=True)
+        self._thread.start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def wait(self) -> None:
+        """Blocks until the worker finishes, which is soon after cancellation"""
+        self._thread.join()
+
+    def post(self, callback: Callable[..., None], *args: Any) -> None:
+        """Runs the callback with args on the UI thread, unless the task is cancelled by then"""
+        def run_if_current() -> None:
+            if not self.cancelled:
+                callback(*args)
+        wx.CallAfter(run_if_current)
+
+    def _run(self, fn: Callable[['BackgroundTask'], None]) -> None:
+        try:
+            for task in self._after:
+                task.wait()
+            self._after = []
+            if not self.cancelled:
+                fn(self)
+        except Exception as e:
+            self.post(self._on_error, e)
 
 
 class SublayoutInitError(Exception):
@@ -65,6 +154,8 @@ class SublayoutInitError(Exception):
 class SubLayoutFrame(wx.Frame):
     _last_dir: Optional[str] = None  # class variable to persist across plugin runs
     _last_position: Optional[wx.Point] = None
+    _sublayouts = SublayoutCache()  # parsed sublayout boards, persisted across plugin runs
+    _PROBE_CHUNK = 16  # instances per anchor probe in the worker, between cancellation checks and list updates
 
     def __init__(self, parent):
         wx.Frame.__init__(self, parent, title="SubLayout", size=(300, 200))
@@ -72,8 +163,13 @@ class SubLayoutFrame(wx.Frame):
         sizer = wx.BoxSizer(wx.VERTICAL)
 
         self._board = pcbnew.GetBoard()  # type: pcbnew.BOARD
-        self._namer = HierarchyData(self._board)
+        self._selections = SelectionCache()  # must be invalidated after board modifications, used by running tasks
+        self._namer: HierarchyData  # built in the background, set before the hierarchy list is populated
+        self._task: Optional[BackgroundTask] = None  # hierarchy loading or instance discovery, if running
+        self._cancelled_tasks: List[BackgroundTask] = []  # which may still be reading the board
+        self._instance_sort_keys: List[Tuple[str, int]] = []  # of instance list entries, for sorted insertion
         self._highlighter = HighlightManager(self._board)
+        self._refresher = RefreshCoalescer()  # for highlight changes, which can be frequent while browsing
         self.Bind(wx.EVT_CHAR_HOOK, self._on_key)
         self.Bind(wx.EVT_CLOSE, self._on_close)
 
@@ -92,10 +188,34 @@ class SubLayoutFrame(wx.Frame):
         self._instance_list.Bind(wx.EVT_LISTBOX, self._on_select_instances)
         sizer.Add(self._instance_list, 1, wx.EXPAND | wx.ALL)
 
+        self._progress = wx.Gauge(panel, range=1)
+        sizer.Add(self._progress, 0, wx.EXPAND | wx.ALL)
+        self._status = wx.StaticText(panel, label="")
+        sizer.Add(self._status, 0, wx.ALL)
+
         self._purge_restore = wx.CheckBox(panel, label="Clear tracks on restore")
         self._purge_restore.SetValue(True)
         sizer.Add(self._purge_restore, 0, wx.ALL | wx.ALIGN_CENTER)
 
+        self._incremental = wx.CheckBox(panel, label="Incremental update")
+        self._incremental.SetToolTip("Apply only source changes since the last restore / replicate, using the record "
+                                     "saved next to the board. Clearing tracks replicates in full instead.")
+        self._incremental.SetValue(False)
+        sizer.Add(self._incremental, 0, wx.ALL | wx.ALIGN_CENTER)
+
+        self._preserve_fills = wx.CheckBox(panel, label="Keep zone fills")
+        self._preserve_fills.SetToolTip("Transform source zone fills instead of unfilling replicated zones. "
+                                        "Zones with other copper nearby are still unfilled.")
+        self._preserve_fills.SetValue(False)
+        sizer.Add(self._preserve_fills, 0, wx.ALL | wx.ALIGN_CENTER)
+
+        self._include_region = wx.CheckBox(panel, label="Include block area")
+        self._include_region.SetToolTip("Also select tracks, vias, zones, and graphics inside the bounding box of the "
+                                        "block's footprints, such as keepouts and stitching vias.")
+        self._include_region.SetValue(False)
+        self._include_region.Bind(wx.EVT_CHECKBOX, self._on_select_hierarchy)  # changes the selection
+        sizer.Add(self._include_region, 0, wx.ALL | wx.ALIGN_CENTER)
+
         matching_bar = wx.BoxSizer(wx.HORIZONTAL)
         sizer.Add(matching_bar, 0, wx.ALL | wx.ALIGN_CENTER)
         self._match_by_refdes = wx.RadioButton(panel, label="match by relative refdes", style=wx.RB_GROUP)
@@ -105,6 +225,11 @@ class SubLayoutFrame(wx.Frame):
         self._match_by_tstamp = wx.RadioButton(panel, label="match by tstamp")
         self._match_by_tstamp.Bind(wx.EVT_RADIOBUTTON, self._on_select_hierarchy)
         matching_bar.Add(self._match_by_tstamp)
+        self._match_by_topology = wx.RadioButton(panel, label="match by net topology")
+        self._match_by_topology.SetToolTip("Match footprints by how they connect within the hierarchy, "
+                                           "for when tstamps and refdes numbering differ between instances.")
+        self._match_by_topology.Bind(wx.EVT_RADIOBUTTON, self._on_select_hierarchy)
+        matching_bar.Add(self._match_by_topology)
 
         button_bar = wx.BoxSizer(wx.HORIZONTAL)
         sizer.Add(button_bar, 0, wx.ALL | wx.ALIGN_CENTER)
@@ -141,12 +266,56 @@ class SubLayoutFrame(wx.Frame):
         else:
             event.Skip()
 
+    def _start_task(self, fn: Callable[[BackgroundTask], None]) -> None:
+        """Cancels any running task, and starts a new one, which runs once cancelled tasks have stopped"""
+        if self._task is not None:
+            self._task.cancel()
+            self._cancelled_tasks.append(self._task)
+        self._task = BackgroundTask(fn, self._on_task_error, self._cancelled_tasks)
+
+    def _on_task_error(self, e: Exception) -> None:
+        self._task = None
+        self._status.SetLabel("Error")
+        self._progress.SetValue(0)
+        traceback_str = ''.join(traceback.format_exception(None, e, e.__traceback__))
+        wx.MessageBox(f"Error: {e}\n\n{traceback_str}", "Error", wx.OK | wx.ICON_ERROR)
+
+    def _wait_cancelled_tasks(self) -> None:
+        """Waits for cancelled tasks to stop reading the board, before the board is modified"""
+        for task in self._cancelled_tasks:
+            task.wait()
+        self._cancelled_tasks.clear()
+
+    def _wait_tasks(self) -> None:
+        """Waits for the running task to finish (without cancelling it) and for cancelled tasks to stop,
+        before the selection cache is used on the UI thread"""
+        if self._task is not None:
+            with wx.BusyCursor():
+                self._task.wait()
+        self._wait_cancelled_tasks()
+
     def _populate_hierarchy(self) -> None:
         self._hierarchy_list.Clear()
 
         if len(self._footprints) != 1:
             raise SublayoutInitError("Must select exactly one anchor footprint.")
 
+        self._status.SetLabel("Reading hierarchy...")
+        self._progress.Pulse()
+        def load_hierarchy(task: BackgroundTask) -> None:
+            namer = HierarchyData(self._board)
+            board_index = self._selections.index(self._board)  # build the board indices off the UI thread
+            board_index.paths()
+            board_index.nets()
+            task.post(self._on_hierarchy_loaded, namer)
+        self._start_task(load_hierarchy)
+
+    def _on_hierarchy_loaded(self, namer: HierarchyData) -> None:
+        self._task = None
+        self._namer = namer
+        self._status.SetLabel("")
+        self._progress.SetValue(0)
+
         path = BoardUtils.footprint_path(self._footprints[0])
         for i in reversed(range(len(path) - 1)):  # ignore leaf path
             path_comps = path[:i+1]
@@ -157,61 +326,108 @@ class SubLayoutFrame(wx.Frame):
             self._hierarchy_list.SetSelection(0)
             self._on_select_hierarchy(wx.CommandEvent(id=0))
 
-    def _get_correspondence_fn(self) -> Callable[[pcbnew.BOARD, GroupLike, pcbnew.BOARD, Tuple[str, ...]], FootprintCorrespondence]:
+    def _get_correspondence_fn(self) -> CorrespondenceFn:
         if self._match_by_refdes.GetValue():
             return FootprintCorrespondence.by_refdes
         elif self._match_by_tstamp.GetValue():
             return FootprintCorrespondence.by_tstamp
+        elif self._match_by_topology.GetValue():
+            return FootprintCorrespondence.by_topology
+        else:
+            raise ValueError("no footprint matching option selected")
+
+    def _get_probe_fn(self) -> AnchorProbeFn:
+        if self._match_by_refdes.GetValue():
+            return FootprintCorrespondence.probe_by_refdes
+        elif self._match_by_tstamp.GetValue():
+            return FootprintCorrespondence.probe_by_tstamp
+        elif self._match_by_topology.GetValue():
+            return FootprintCorrespondence.probe_by_topology
         else:
             raise ValueError("no footprint matching option selected")
 
     def _on_select_hierarchy(self, event: wx.CommandEvent) -> None:
+        """Starts selecting the hierarchy and discovering its instances in the background, cancelling any previous
+        discovery. Results are streamed into the instance list."""
         try:
+            if self._hierarchy_list.GetSelection() == wx.NOT_FOUND:  # hierarchy still loading
+                return
             selected_path_comps = self._hierarchy_list.GetClientData(self._hierarchy_list.GetSelection())
-            result = HierarchySelector(self._board, selected_path_comps).get_elts()
-            self._highlighter.clear()
-            self._highlighter.highlight(result.ungrouped_elts + result.groups)
-            self._save_button.Enable()
+            self._save_button.Disable()
             self._replicate_button.Disable()
             self._restore_button.Disable()
-            pcbnew.Refresh()
-
-            # generate instance list
             self._instance_list.Clear()
+            self._instance_sort_keys = []
+
             sheetfile = self._namer.sheetfile_of(selected_path_comps)
             assert sheetfile is not None, "internal consistency failure: no sheetfile for selected hierarchy"
-            self_index = None
-            
-            instance_path_anchors = []
-            for instance_path in self._namer.instances_of(sheetfile):
-                src_hierarchy = HierarchySelector(self._board, selected_path_comps).get_elts()
-                correspondence = self._get_correspondence_fn()(self._board, src_hierarchy, self._board, instance_path)
-                instance_anchor = correspondence.get_footprint(self._footprints[0])
-                if instance_anchor is None:
-                    continue
-                instance_path_anchors.append((instance_path, instance_anchor))
-
-            instance_path_anchors = sorted(instance_path_anchors, key=lambda tup: FootprintCorrespondence._split_refdes(tup[1].GetReference()))
-            
-            for index, (instance_path, instance_anchor) in enumerate(instance_path_anchors):
-                if instance_path == selected_path_comps:
-                    self_index = index
-                instance_name = '/'.join(self._namer.name_path(instance_path))
-                self._instance_list.Append(f"{instance_anchor.GetReference()} {instance_name}",
-                                           (instance_path, instance_anchor))
-
-            assert self_index is not None, "internal consistency failure: no instance for selected hierarchy"
-            self._instance_list.SetSelection(self_index)
-            self._on_select_instances(wx.CommandEvent(id=self_index))
+            instance_paths = self._namer.instances_of(sheetfile)
+            self._progress.SetRange(max(len(instance_paths), 1))
+            self._progress.SetValue(0)
+            self._status.SetLabel("Finding instances...")
+
+            probe_fn = self._get_probe_fn()  # read the options on the UI thread
+            include_region = self._include_region.GetValue()
+            anchor = self._footprints[0]
+            def find_instances(task: BackgroundTask) -> None:
+                result = self._selections.get_elts(self._board, selected_path_comps, include_region)
+                task.post(self._on_selection_found, result)
+
+                # only the anchor is matched here, full correspondences are computed for the replicated instances
+                board_index = self._selections.index(self._board)
+                for chunk_start in range(0, len(instance_paths), self._PROBE_CHUNK):
+                    if task.cancelled:
+                        return
+                    chunk_paths = instance_paths[chunk_start:chunk_start + self._PROBE_CHUNK]
+                    chunk_anchors = probe_fn(self._board, result, anchor, self._board, chunk_paths,
+                                             board_index, board_index)
+                    task.post(self._on_instances_found, list(zip(chunk_paths, chunk_anchors)),
+                              chunk_start + len(chunk_paths))
+                task.post(self._on_instances_done, selected_path_comps)
+            self._start_task(find_instances)
         except Exception as e:
             traceback_str = ''.join(traceback.format_exception(None, e, e.__traceback__))
             wx.MessageBox(f"Error: {e}\n\n{traceback_str}", "Error", wx.OK | wx.ICON_ERROR)
 
+    def _on_selection_found(self, result: FilterResult) -> None:
+        if self._highlighter.set(result.ungrouped_elts + result.groups):
+            self._refresher.request()
+        self._save_button.Enable()
+
+    def _on_instances_found(self, instance_anchors: List[Tuple[Tuple[str, ...], Optional[pcbnew.FOOTPRINT]]],
+                            progress: int) -> None:
+        """Inserts the found instances into the instance list, sorted by anchor refdes"""
+        for instance_path, instance_anchor in instance_anchors:
+            if instance_anchor is None:
+                continue
+            sort_key = FootprintCorrespondence._split_refdes(instance_anchor.GetReference())
+            index = bisect.bisect_right(self._instance_sort_keys, sort_key)
+            self._instance_sort_keys.insert(index, sort_key)
+            instance_name = '/'.join(self._namer.name_path(instance_path))
+            self._instance_list.Insert(f"{instance_anchor.GetReference()} {instance_name}", index,
+                                       (instance_path, instance_anchor))
+        self._progress.SetValue(progress)
+
+    def _on_instances_done(self, selected_path_comps: Tuple[str, ...]) -> None:
+        self._task = None
+        self._status.SetLabel(f"{self._instance_list.GetCount()} instances")
+        self_index = None
+        for index in range(self._instance_list.GetCount()):
+            instance_path, instance_anchor = self._instance_list.GetClientData(index)
+            if instance_path == selected_path_comps:
+                self_index = index
+        if self_index is None:
+            wx.MessageBox("Error: internal consistency failure: no instance for selected hierarchy",
+                          "Error", wx.OK | wx.ICON_ERROR)
+            return
+        self._instance_list.SetSelection(self_index)
+        self._on_select_instances(wx.CommandEvent(id=self_index))
+
     def _on_select_instances(self, event: wx.CommandEvent) -> None:
         try:
             selected_instance_anchors = [self._instance_list.GetClientData(index)
                                          for index in self._instance_list.GetSelections()]
-            if len(selected_instance_anchors) == 0:
+            if self._task is not None or len(selected_instance_anchors) == 0:  # no board edits while discovering
                 self._restore_button.Disable()
                 self._replicate_button.Disable()
             elif (len(selected_instance_anchors) == 1 and
@@ -227,6 +443,11 @@ class SubLayoutFrame(wx.Frame):
             wx.MessageBox(f"Error: {e}\n\n{traceback_str}", "Error", wx.OK | wx.ICON_ERROR)
 
     def _on_close(self, event: wx.CommandEvent) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._cancelled_tasks.append(self._task)
+            self._task = None
+        self._wait_cancelled_tasks()  # so no worker reads the board after the dialog is gone
         self.__class__._last_position = self.GetPosition()
         self._highlighter.clear()
         pcbnew.Refresh()
@@ -241,10 +462,25 @@ class SubLayoutFrame(wx.Frame):
             return board_dir
         return os.getcwd()  # fallback
 
+    def _load_record(self, source: str) -> Optional[ReplicationRecord]:
+        """Returns the replication record for this board as it currently is and source,
+        or None if incremental update is not selected or the board has not been saved"""
+        if not self._incremental.GetValue() or not self._board.GetFileName():
+            return None
+        return ReplicationRecord.load_current(self._board.GetFileName(), source,
+                                              lambda item_id: BoardUtils.resolve_item(self._board, item_id) is not None)
+
+    def _save_record(self, record: Optional[ReplicationRecord]) -> None:
+        """Saves the record as pending, since the board is modified but not saved"""
+        if record is not None:
+            record.save(ReplicationRecord.pending_path(self._board.GetFileName()))
+
     def _on_save(self, event: wx.CommandEvent) -> None:
         try:
+            self._wait_tasks()  # save is available while instances are still being found
             selected_path_comps = self._hierarchy_list.GetClientData(self._hierarchy_list.GetSelection())
-            save_sublayout = HierarchySelector(self._board, selected_path_comps)
+            save_sublayout = self._selections.selector(self._board, selected_path_comps,
+                                                       self._include_region.GetValue())
             dlg = wx.FileDialog(self, "Save to", self._get_dialog_directory(),
                                 '_'.join(self._namer.name_path(selected_path_comps)),
                                 "KiCad (sub)board (*.kicad_pcb)|*.kicad_pcb",
@@ -256,6 +492,15 @@ class SubLayoutFrame(wx.Frame):
 
             sublayout_board = save_sublayout.create_sublayout(dlg.GetPath())
             sublayout_board.Save(dlg.GetPath())
+            write_snapshot(sublayout_board, dlg.GetPath())
+
+            all_errors = self._selections.get_elts(self._board, selected_path_comps,
+                                                   self._include_region.GetValue()).get_error_strs()
+            if all_errors:
+                NEWLINE = '\n'
+                wx.MessageBox(f"Save succeeded with warnings:\n{NEWLINE.join(all_errors)}",
+                              "Warning",
+                              wx.OK | wx.ICON_WARNING)
 
             self.Close()
         except Exception as e:
@@ -264,23 +509,27 @@ class SubLayoutFrame(wx.Frame):
 
     def _on_replicate(self, event: wx.CommandEvent) -> None:
         try:
+            self._wait_cancelled_tasks()
             selected_instance_anchors = [self._instance_list.GetClientData(index)
                                          for index in self._instance_list.GetSelections()]
             all_errors = []
             source_instance_path = self._hierarchy_list.GetClientData(self._hierarchy_list.GetSelection())
-            source_sublayout = HierarchySelector(self._board, source_instance_path).get_elts()
+            source_sublayout = self._selections.get_elts(self._board, source_instance_path,
+                                                         self._include_region.GetValue())
 
             self._highlighter.clear()  # clear highlights so they don't get replicated
 
-            for instance_path, instance_anchor in selected_instance_anchors:
-                if instance_path == source_instance_path:
-                    continue  # skip self-replication
-
-                restore = ReplicateSublayout(self._board, source_sublayout, self._board, instance_anchor, instance_path,
-                                             self._get_correspondence_fn())
-                if self._purge_restore.GetValue():
-                    restore.purge_lca()
-                result = restore.replicate()
+            targets = [(instance_anchor, instance_path) for instance_path, instance_anchor in selected_instance_anchors
+                       if instance_path != source_instance_path]  # skip self-replication
+            plan = ReplicationPlan(self._board, source_sublayout, self._selections.index(self._board),
+                                   include_region=self._include_region.GetValue())
+            record = self._load_record('/'.join(source_instance_path))
+            results = plan.replicate_many(self._board, targets, self._get_correspondence_fn(),
+                                          purge=self._purge_restore.GetValue(), record=record,
+                                          preserve_fills=self._preserve_fills.GetValue())
+            self._save_record(record)
+            self._selections.invalidate(self._board)
+            for result in results:
                 all_errors.extend(result.get_error_strs())
 
             pcbnew.Refresh()
@@ -297,6 +546,7 @@ class SubLayoutFrame(wx.Frame):
 
     def _on_restore(self, event: wx.CommandEvent) -> None:
         try:
+            self._wait_cancelled_tasks()
             selected_path_comps = self._hierarchy_list.GetClientData(self._hierarchy_list.GetSelection())
             dlg = wx.FileDialog(self, "Restore sublayout from", self._get_dialog_directory(),
                                 '_'.join(self._namer.name_path(selected_path_comps)),
@@ -307,20 +557,27 @@ class SubLayoutFrame(wx.Frame):
             if res != wx.ID_OK:
                 return
 
-            sublayout_board = pcbnew.PCB_IO_MGR.Load(pcbnew.PCB_IO_MGR.KICAD_SEXP, dlg.GetPath())  # type: pcbnew.BOARD
-            if not sublayout_board:
+            try:
+                sublayout = self._sublayouts.get(dlg.GetPath())
+            except (OSError, ValueError):
                 wx.MessageBox("Failed to load sublayout board.", "Error", wx.OK | wx.ICON_ERROR)
                 return
 
             selected_instance_anchors = [self._instance_list.GetClientData(index)
                                          for index in self._instance_list.GetSelections()]
+            targets = [(instance_anchor, instance_path) for instance_path, instance_anchor in selected_instance_anchors]
+            self._highlighter.clear()  # clear highlights since restore (with purge) may delete highlighted items
+            plan = ReplicationPlan(sublayout.board, sublayout.board, sublayout.index, sublayout.stable_ids,
+                                   include_region=self._include_region.GetValue())
+            record = self._load_record(os.path.abspath(dlg.GetPath()))
+            results = plan.replicate_many(self._board, targets, self._get_correspondence_fn(),
+                                          purge=self._purge_restore.GetValue(),
+                                          target_index=self._selections.index(self._board), record=record,
+                                          preserve_fills=self._preserve_fills.GetValue())
+            self._save_record(record)
+            self._selections.invalidate(self._board)
             all_errors = []
-            for instance_path, instance_anchor in selected_instance_anchors:
-                restore = ReplicateSublayout(sublayout_board, sublayout_board, self._board, instance_anchor, instance_path,
-                                             self._get_correspondence_fn())
-                if self._purge_restore.GetValue():
-                    restore.purge_lca()
-                result = restore.replicate()
+            for result in results:
                 all_errors.extend(result.get_error_strs())
 
             pcbnew.Refresh()
@@ -346,6 +603,7 @@ class SubLayout(pcbnew.ActionPlugin):
 
     def Run(self):
         try:
+            telemetry.enable_from_env()
             try:
                 editor = wx.FindWindowByName("PcbFrame")
                 self.frame = SubLayoutFrame(editor)
@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pcbnew
+
+from .board_index import BoardIndex
+from .board_utils import BoardUtils, IsKicad10, PcbGroupType, group_id
+
+
+class BoardBatch():
+    """Batches the mutations of one operation on a board, which may span many instances.
+    Mutations are applied to the board immediately, but items are added in bulk mode where supported, skipping
+    per-item connectivity updates, and the bulk add is finalized and connectivity rebuilt once in finalize().
+    This does not create an undo entry. Duplicate signatures, which differ across KiCad versions, are resolved
+    once per type. Can be used as a context manager, which finalizes on exit.
+    If a board index is given, it is kept up to date with the mutations, so it can be shared across them."""
+    def __init__(self, board: pcbnew.BOARD, index: Optional[BoardIndex] = None) -> None:
+        self._board = board
+        self._index = index
+        self._duplicate_args: Dict[type, Tuple[bool, ...]] = {}
+        self._bulk_mode = getattr(pcbnew, 'ADD_MODE_BULK_APPEND', None)
+        self._bulk_added: List[pcbnew.BOARD_ITEM] = []  # items added in bulk mode since the last finalize
+        self._dirty = False  # whether connectivity needs to be rebuilt on finalize
+        self.added = 0
+        self.removed = 0
+
+    def __enter__(self) -> 'BoardBatch':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.finalize()
+
+    @staticmethod
+    def _item_key(item: pcbnew.BOARD_ITEM) -> str:
+        return group_id(item) if isinstance(item, PcbGroupType) else BoardUtils.item_id(item)
+
+    def clone(self, item: pcbnew.BOARD_ITEM) -> pcbnew.BOARD_ITEM:
+        """Duplicates the item (without adding the duplicate to the item's group) and adds it to the board"""
+        duplicate_args = self._duplicate_args.get(type(item))
+        if duplicate_args is not None:
+            cloned = item.Duplicate(*duplicate_args)
+        elif IsKicad10 and isinstance(item, pcbnew.FOOTPRINT):
+            duplicate_args = (False, )
+            cloned = item.Duplicate(*duplicate_args)
+        else:
+            try:
+                duplicate_args = ()
+                cloned = item.Duplicate()
+            except TypeError:  # newer KiCad versions require addToParentGroup
+                duplicate_args = (False, )
+                cloned = item.Duplicate(*duplicate_args)
+        self._duplicate_args[type(item)] = duplicate_args
+        self.add(cloned)
+        return cloned
+
+    def add(self, item: pcbnew.BOARD_ITEM) -> None:
+        if self._bulk_mode is not None:
+            self._board.Add(item, self._bulk_mode, True)  # skip per-item connectivity updates
+            self._bulk_added.append(item)
+        else:
+            self._board.Add(item)
+        if self._index is not None:
+            self._index.item_added(item)
+        self._dirty = True
+        self.added += 1
+
+    def remove(self, item: pcbnew.BOARD_ITEM) -> None:
+        """Deletes the item from the board"""
+        if self._index is not None:
+            self._index.items_removed({self._item_key(item): item})
+        self._board.Delete(item)
+        self._dirty = True
+        self.removed += 1
+
+    def remove_all(self, items: Iterable[pcbnew.BOARD_ITEM]) -> int:
+        """Deletes the items from the board as one batch, returning the number of items deleted.
+        Items are collected (deduplicated by id) before anything is deleted, so items may be a lazy traversal.
+        Groups among the items are emptied first, detaching all their members at once instead of per deleted item;
+        members not in items stay on the board, ungrouped. Then items are deleted, and finally the groups."""
+        doomed: Dict[str, pcbnew.BOARD_ITEM] = {}
+        for item in items:
+            doomed.setdefault(self._item_key(item), item)
+        if self._index is not None:
+            self._index.items_removed(doomed)
+        groups = [item for item in doomed.values() if isinstance(item, PcbGroupType)]
+        for group in groups:
+            group.RemoveAll()
+        for item in doomed.values():
+            if not isinstance(item, PcbGroupType):
+                self._board.Delete(item)
+        for group in groups:
+            self._board.Delete(group)
+        if doomed:
+            self._dirty = True
+        self.removed += len(doomed)
+        return len(doomed)
+
+    def modify(self, item: pcbnew.BOARD_ITEM) -> None:
+        """Marks an item (eg, a footprint being moved) as modified, so connectivity is rebuilt on finalize,
+        and the item is re-indexed on next use of the index"""
+        if self._index is not None:
+            self._index.item_modified(item)
+        self._dirty = True
+
+    def _finalize_bulk_add(self) -> None:
+        """Notifies the board of the items added in bulk mode, as BOARD::FinalizeBulkAdd"""
+        if not self._bulk_added or not hasattr(self._board, 'FinalizeBulkAdd'):
+            self._bulk_added = []
+            return
+        try:
+            self._board.FinalizeBulkAdd(self._bulk_added)  # takes the added items in newer KiCad versions
+        except TypeError:  # older KiCad versions take no arguments, or the item list can't be passed from Python
+            try:
+                self._board.FinalizeBulkAdd()
+            except TypeError:
+                pass
+        self._bulk_added = []
+
+    def finalize(self) -> None:
+        """Finalizes bulk adds and rebuilds connectivity, once for all mutations since the last finalize"""
+        self._finalize_bulk_add()
+        if self._dirty:
+            self._board.BuildConnectivity()
+            self._dirty = False
@@ -0,0 +1,426 @@
+from typing import Dict, Iterable, List, Set, Tuple, Optional, Union, Iterator, Any, cast
+
+import pcbnew
+
+from .board_utils import BoardUtils, PcbGroupType, group_parent, group_id
+
+
+class _PathTrieNode():
+    """A node in the PathIndex trie, holding the footprints whose path ends exactly at this node"""
+    def __init__(self) -> None:
+        self.children: Dict[int, '_PathTrieNode'] = {}
+        self.footprints: List[Tuple[Tuple[str, ...], pcbnew.FOOTPRINT]] = []
+
+
+class PathIndex():
+    """Board-wide index of footprint hierarchy paths, built once per board.
+    Path components (KIIDs) are interned to small ints, and footprints are stored in a trie by path,
+    so hierarchy prefix queries cost O(result size) instead of O(board) and paths are parsed only once."""
+    def __init__(self, board: pcbnew.BOARD) -> None:
+        self._component_ids: Dict[str, int] = {}
+        self._root = _PathTrieNode()
+        self._paths_by_footprint: Dict[str, Tuple[str, ...]] = {}  # by footprint id
+        # path prefix -> refdes type -> footprints sorted by refdes number, built on first use per prefix
+        self._refdes_ranks: Dict[Tuple[str, ...], Dict[str, List[pcbnew.FOOTPRINT]]] = {}
+
+        for footprint in board.GetFootprints():  # type: pcbnew.FOOTPRINT
+            path = BoardUtils.footprint_path(footprint)
+            self._paths_by_footprint[BoardUtils.item_id(footprint)] = path
+            node = self._root
+            for component in path:
+                component_id = self._component_ids.setdefault(component, len(self._component_ids))
+                node = node.children.setdefault(component_id, _PathTrieNode())
+            node.footprints.append((path, footprint))
+
+    def _find_node(self, path_prefix: Tuple[str, ...]) -> Optional[_PathTrieNode]:
+        node = self._root
+        for component in path_prefix:
+            component_id = self._component_ids.get(component)
+            if component_id is None:
+                return None
+            next_node = node.children.get(component_id)
+            if next_node is None:
+                return None
+            node = next_node
+        return node
+
+    def path_of(self, footprint: pcbnew.FOOTPRINT) -> Tuple[str, ...]:
+        """Returns the path of the footprint, without re-parsing it if the footprint is indexed"""
+        path = self._paths_by_footprint.get(BoardUtils.item_id(footprint))
+        if path is None:  # not on the indexed board
+            path = BoardUtils.footprint_path(footprint)
+        return path
+
+    def path_startswith(self, footprint: pcbnew.FOOTPRINT, path_prefix: Tuple[str, ...]) -> bool:
+        """Returns true if the footprint path starts with the given prefix, as BoardUtils.footprint_path_startswith"""
+        return self.path_of(footprint)[:len(path_prefix)] == path_prefix
+
+    def entries_under(self, path_prefix: Tuple[str, ...]) -> List[Tuple[Tuple[str, ...], pcbnew.FOOTPRINT]]:
+        """Returns all (path, footprint) whose path starts with the given prefix (is part of the path_prefix hierarchy)"""
+        node = self._find_node(path_prefix)
+        if node is None:
+            return []
+        entries: List[Tuple[Tuple[str, ...], pcbnew.FOOTPRINT]] = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            entries.extend(node.footprints)
+            stack.extend(reversed(list(node.children.values())))  # preserve insertion order
+        return entries
+
+    def footprints_under(self, path_prefix: Tuple[str, ...]) -> List[pcbnew.FOOTPRINT]:
+        """Returns all footprints whose path starts with the given prefix"""
+        return [footprint for path, footprint in self.entries_under(path_prefix)]
+
+    def refdes_ranks(self, path_prefix: Tuple[str, ...]) -> Dict[str, List[pcbnew.FOOTPRINT]]:
+        """Returns footprints under the prefix by refdes type (eg, R), each sorted by refdes number,
+        so the n-th R in a hierarchy instance is a single lookup. Cached per prefix."""
+        ranks = self._refdes_ranks.get(path_prefix)
+        if ranks is None:
+            num_footprints_by_type: Dict[str, List[Tuple[int, pcbnew.FOOTPRINT]]] = {}
+            for footprint in self.footprints_under(path_prefix):
+                refdes_type, refdes_num = BoardUtils.split_refdes(footprint.GetReferenceAsString())
+                num_footprints_by_type.setdefault(refdes_type, []).append((refdes_num, footprint))
+            ranks = {refdes_type: [footprint for num, footprint in sorted(num_footprints, key=lambda x: x[0])]
+                     for refdes_type, num_footprints in num_footprints_by_type.items()}
+            self._refdes_ranks[path_prefix] = ranks
+        return ranks
+
+    def footprint_at(self, path: Tuple[str, ...]) -> Optional[pcbnew.FOOTPRINT]:
+        """Returns the footprint with exactly the given path, or None"""
+        node = self._find_node(path)
+        if node is None or not node.footprints:
+            return None
+        return node.footprints[0][1]
+
+
+class NetIndex():
+    """Board-wide index of pads by netcode and pad netcodes by footprint, built once per board
+    so net resolution does not need to walk every footprint and pad per item."""
+    def __init__(self, board: pcbnew.BOARD) -> None:
+        self._board = board
+        # netcode -> item id -> tracks and zones, in board order, built on first use and updated on board edits
+        # through BoardIndex (see BoardIndex.item_added)
+        self._items_by_netcode: Optional[Dict[int, Dict[str, Union[pcbnew.PCB_TRACK, pcbnew.ZONE]]]] = None
+        self._item_netcodes: Dict[str, int] = {}  # item id -> netcode it is indexed under
+        # netcode -> [(footprint id, pad number), ...]
+        self._pads_by_netcode: Dict[int, List[Tuple[str, str]]] = {}
+        # footprint id -> [(pad number, netcode), ...], for all pads including duplicate numbers
+        self._pads_by_footprint: Dict[str, List[Tuple[str, int]]] = {}
+        # footprint id -> pad number -> netcode, only the first pad of a number is recorded (as FindPadByNumber)
+        self._pad_netcodes_by_footprint: Dict[str, Dict[str, int]] = {}
+
+        for footprint in board.GetFootprints():  # type: pcbnew.FOOTPRINT
+            footprint_id = BoardUtils.item_id(footprint)
+            footprint_pads = self._pads_by_footprint.setdefault(footprint_id, [])
+            pad_netcodes = self._pad_netcodes_by_footprint.setdefault(footprint_id, {})
+            for pad in footprint.Pads():  # type: pcbnew.PAD
+                pad_number = cast(str, pad.GetNumber())
+                netcode = cast(int, pad.GetNetCode())
+                self._pads_by_netcode.setdefault(netcode, []).append((footprint_id, pad_number))
+                footprint_pads.append((pad_number, netcode))
+                pad_netcodes.setdefault(pad_number, netcode)
+
+    def netcode_pads(self, netcode: int) -> List[Tuple[str, str]]:
+        """Returns all pads (as footprint id, pad number) with the given netcode"""
+        return self._pads_by_netcode.get(netcode, [])
+
+    def footprint_pads(self, footprint: pcbnew.FOOTPRINT) -> List[Tuple[str, int]]:
+        """Returns all pads (as pad number, netcode) of the footprint"""
+        return self._pads_by_footprint.get(BoardUtils.item_id(footprint), [])
+
+    def pad_netcode(self, footprint: pcbnew.FOOTPRINT, pad_number: str) -> Optional[int]:
+        """Returns the netcode of the footprint pad with the given number, or None if there is no such pad"""
+        return self._pad_netcodes_by_footprint.get(BoardUtils.item_id(footprint), {}).get(pad_number)
+
+    def netcode_items(self, netcode: int) -> List[Union[pcbnew.PCB_TRACK, pcbnew.ZONE]]:
+        """Returns all tracks and zones with the given netcode"""
+        if self._items_by_netcode is None:
+            self._items_by_netcode = {}
+            for track in self._board.GetTracks():  # type: pcbnew.PCB_TRACK
+                self._add_item(track)
+            for zone_id in range(self._board.GetAreaCount()):
+                self._add_item(self._board.GetArea(zone_id))
+        return list(self._items_by_netcode.get(netcode, {}).values())
+
+    def _add_item(self, item: Union[pcbnew.PCB_TRACK, pcbnew.ZONE]) -> None:
+        assert self._items_by_netcode is not None
+        item_id = BoardUtils.item_id(item)
+        netcode = cast(int, item.GetNetCode())
+        self._items_by_netcode.setdefault(netcode, {})[item_id] = item
+        self._item_netcodes[item_id] = netcode
+
+    def item_added(self, item: pcbnew.BOARD_ITEM) -> None:
+        """Indexes a track or zone added to the board, if the per-net items are built"""
+        if self._items_by_netcode is not None and isinstance(item, (pcbnew.PCB_TRACK, pcbnew.ZONE)):
+            self._add_item(item)
+
+    def item_removed(self, item_id: str) -> None:
+        """Drops a track or zone removed from the board, if indexed"""
+        netcode = self._item_netcodes.pop(item_id, None)
+        if netcode is not None and self._items_by_netcode is not None:
+            self._items_by_netcode[netcode].pop(item_id, None)
+
+
+class GroupTreeIndex():
+    """Board-wide index of the group tree (parent, children, depth) by group KIID, built once per board
+    so ancestor queries do not need to walk the group API. Groups not on the board when the index was built
+    (eg, created by replication) are indexed on first use through index_group."""
+    def __init__(self, board: Optional[pcbnew.BOARD]) -> None:
+        self._groups: Dict[str, PcbGroupType] = {}
+        self._parents: Dict[str, Optional[str]] = {}
+        self._children: Dict[Optional[str], List[str]] = {}  # None is the board (root)
+        self._depths: Dict[str, int] = {}  # top-level groups have depth 1
+
+        if board is not None:
+            for group in board.Groups():
+                self.index_group(group)
+
+    def index_group(self, group: Any) -> str:  # pcbnew.EDA_GROUP in newer KiCad versions
+        """Returns the id of the group, indexing it and its ancestors if not already indexed"""
+        this_id = group_id(group)
+        if this_id in self._parents:
+            return this_id
+        parent = group_parent(group)
+        parent_id = self.index_group(parent) if parent is not None else None
+        self._groups[this_id] = group
+        self._parents[this_id] = parent_id
+        self._children.setdefault(parent_id, []).append(this_id)
+        self._depths[this_id] = self.depth(parent_id) + 1
+        return this_id
+
+    def group(self, this_id: str) -> PcbGroupType:
+        return self._groups[this_id]
+
+    def parent_id(self, this_id: str) -> Optional[str]:
+        """Returns the id of the parent group, or None if the group is top-level"""
+        return self._parents[this_id]
+
+    def children_ids(self, this_id: Optional[str]) -> List[str]:
+        """Returns the ids of the direct child groups, or of the top-level groups if None"""
+        return self._children.get(this_id, [])
+
+    def depth(self, this_id: Optional[str]) -> int:
+        """Returns the nesting depth of the group, where the board (None) is 0"""
+        if this_id is None:
+            return 0
+        return self._depths[this_id]
+
+    def ancestor_ids(self, this_id: str) -> Iterator[str]:
+        """Yields the ids of all ancestor groups, innermost first, excluding the group itself and the board"""
+        parent_id = self._parents[this_id]
+        while parent_id is not None:
+            yield parent_id
+            parent_id = self._parents[parent_id]
+
+    def lowest_common_ancestor_id(self, id1: Optional[str], id2: Optional[str]) -> Optional[str]:
+        """Returns the id of the deepest group containing (or equal to) both groups, or None if that is the board.
+        Runs in O(depth)."""
+        depth1, depth2 = self.depth(id1), self.depth(id2)
+        while depth1 > depth2:
+            assert id1 is not None
+            id1, depth1 = self._parents[id1], depth1 - 1
+        while depth2 > depth1:
+            assert id2 is not None
+            id2, depth2 = self._parents[id2], depth2 - 1
+        while id1 != id2:
+            assert id1 is not None and id2 is not None
+            id1, id2 = self._parents[id1], self._parents[id2]
+        return id1
+
+
+BoundingBox = Tuple[int, int, int, int]  # left, top, right, bottom
+
+
+def item_bbox(item: pcbnew.BOARD_ITEM) -> BoundingBox:
+    """Returns the bounding box of a board item"""
+    bbox = item.GetBoundingBox()  # type: pcbnew.BOX2I
+    return (bbox.GetLeft(), bbox.GetTop(), bbox.GetRight(), bbox.GetBottom())
+
+
+def layout_items(board: pcbnew.BOARD) -> Iterator[Union[pcbnew.PCB_TRACK, pcbnew.ZONE, pcbnew.PCB_SHAPE]]:
+    """Yields the board's tracks (including vias), zones, and graphic shapes, which are the items selectable by
+    location, not including footprints and their contents"""
+    yield from board.GetTracks()
+    yield from board.Zones()
+    for drawing in board.GetDrawings():
+        if isinstance(drawing, pcbnew.PCB_SHAPE):
+            yield drawing
+
+
+class SpatialIndex():
+    """Uniform grid index of items by bounding box, so region queries cost O(cells covered + result size) instead of
+    O(items). Items spanning more than MAX_ITEM_CELLS cells (eg, ground pours) are kept in a separate list that is
+    checked on every query, so large items do not flood the grid.
+    Items are identified by id (KIID), so removed (or moved, by removing and inserting again) items can be dropped
+    without rebuilding the grid."""
+    CELL_SIZE = 5000000  # nm, on the order of a small block's footprint
+    MAX_ITEM_CELLS = 64
+
+    def __init__(self, items: Iterable[pcbnew.BOARD_ITEM] = (), cell_size: int = CELL_SIZE) -> None:
+        self._cell_size = cell_size
+        self._entries: List[Tuple[BoundingBox, pcbnew.BOARD_ITEM]] = []
+        self._cells: Dict[Tuple[int, int], List[int]] = {}  # cell -> entry indices
+        self._large: List[int] = []  # entry indices of items spanning too many cells
+        self._entries_by_id: Dict[str, int] = {}  # item id -> entry index, of items not removed
+        self._removed: Set[int] = set()  # entry indices of removed items, skipped by queries
+        for item in items:
+            self.insert(item)
+
+    def __len__(self) -> int:
+        return len(self._entries) - len(self._removed)
+
+    def _cell_range(self, bbox: BoundingBox) -> Tuple[range, range]:
+        left, top, right, bottom = bbox
+        return (range(left // self._cell_size, right // self._cell_size + 1),
+                range(top // self._cell_size, bottom // self._cell_size + 1))
+
+    def insert(self, item: pcbnew.BOARD_ITEM, bbox: Optional[BoundingBox] = None) -> None:
+        """Indexes the item, by its bounding box unless one is given. An item already indexed is replaced."""
+        if bbox is None:
+            bbox = item_bbox(item)
+        item_id = BoardUtils.item_id(item)
+        self.remove(item_id)
+        entry = len(self._entries)
+        self._entries.append((bbox, item))
+        self._entries_by_id[item_id] = entry
+        xs, ys = self._cell_range(bbox)
+        if len(xs) * len(ys) > self.MAX_ITEM_CELLS:
+            self._large.append(entry)
+            return
+        for x in xs:
+            for y in ys:
+                self._cells.setdefault((x, y), []).append(entry)
+
+    def remove(self, item_id: str) -> None:
+        """Drops the item with the id, if indexed"""
+        entry = self._entries_by_id.pop(item_id, None)
+        if entry is not None:
+            self._removed.add(entry)
+
+    def _query(self, bbox: BoundingBox, contained: bool) -> List[pcbnew.BOARD_ITEM]:
+        left, top, right, bottom = bbox
+        xs, ys = self._cell_range(bbox)
+        candidates: Set[int] = set(self._large)
+        if len(xs) * len(ys) > len(self._cells):  # query larger than the occupied grid, visit occupied cells instead
+            for cell in self._cells.values():
+                candidates.update(cell)
+        else:
+            for x in xs:
+                for y in ys:
+                    candidates.update(self._cells.get((x, y), []))
+        items = []
+        for entry in sorted(candidates - self._removed):
+            (item_left, item_top, item_right, item_bottom), item = self._entries[entry]
+            if contained:
+                if left <= item_left and item_right <= right and top <= item_top and item_bottom <= bottom:
+                    items.append(item)
+            elif item_left <= right and left <= item_right and item_top <= bottom and top <= item_bottom:
+                items.append(item)
+        return items
+
+    def query(self, bbox: BoundingBox) -> List[pcbnew.BOARD_ITEM]:
+        """Returns items whose bounding box intersects the bounding box, in insertion order"""
+        return self._query(bbox, contained=False)
+
+    def query_contained(self, bbox: BoundingBox) -> List[pcbnew.BOARD_ITEM]:
+        """Returns items whose bounding box lies wholly inside the bounding box, in insertion order"""
+        return self._query(bbox, contained=True)
+
+
+class BoardIndex():
+    """Indices over a board, each built on first use, to be shared across operations on the same board.
+    Board edits must be reported through item_added, item_modified, and items_removed (as BoardBatch does) to keep
+    the indices valid, otherwise a new BoardIndex should be created after modifying the board.
+    Added and modified items are indexed on next use, since they are typically placed after being added."""
+    def __init__(self, board: pcbnew.BOARD) -> None:
+        self._board = board
+        self._nets: Optional[NetIndex] = None
+        self._paths: Optional[PathIndex] = None
+        self._groups: Optional[GroupTreeIndex] = None
+        self._spatial: Optional[SpatialIndex] = None
+        self._pads: Optional[SpatialIndex] = None
+        self._pending: List[pcbnew.BOARD_ITEM] = []  # added or modified items, not yet in the built indices
+
+    def item_added(self, item: pcbnew.BOARD_ITEM) -> None:
+        """Updates the indices for an item added to the board"""
+        if isinstance(item, pcbnew.FOOTPRINT):  # rare (eg, building a sublayout board), rebuild on next use
+            self._nets = None
+            self._paths = None
+            if self._pads is not None:
+                self._pending.append(item)
+        elif isinstance(item, PcbGroupType):  # groups are few, rebuild on next use
+            self._groups = None
+        elif self._nets is not None or self._spatial is not None:
+            self._pending.append(item)
+
+    def item_modified(self, item: pcbnew.BOARD_ITEM) -> None:
+        """Updates the indices for an item (eg, a moved track or footprint) modified on the board"""
+        if isinstance(item, pcbnew.FOOTPRINT):  # moves its pads, without changing nets or paths
+            if self._pads is not None:
+                self._pending.append(item)  # pads are replaced on insert
+        elif isinstance(item, (pcbnew.PCB_TRACK, pcbnew.ZONE, pcbnew.PCB_SHAPE)):
+            self.items_removed({BoardUtils.item_id(item): item})
+            self.item_added(item)
+
+    def items_removed(self, items: Dict[str, pcbnew.BOARD_ITEM]) -> None:
+        """Updates the indices for items (by id) about to be removed from the board"""
+        self._flush()
+        for item_id, item in items.items():
+            if isinstance(item, pcbnew.FOOTPRINT):
+                self._nets = None
+                self._paths = None
+                if self._pads is not None:
+                    for pad in item.Pads():
+                        self._pads.remove(BoardUtils.item_id(pad))
+            elif isinstance(item, PcbGroupType):
+                self._groups = None
+            else:
+                if self._nets is not None:
+                    self._nets.item_removed(item_id)
+                if self._spatial is not None:
+                    self._spatial.remove(item_id)
+
+    def _flush(self) -> None:
+        """Indexes pending items into the built indices"""
+        pending, self._pending = self._pending, []
+        for item in pending:
+            if isinstance(item, pcbnew.FOOTPRINT):
+                if self._pads is not None:
+                    for pad in item.Pads():
+                        self._pads.insert(pad)
+                continue
+            if self._nets is not None:
+                self._nets.item_added(item)
+            if self._spatial is not None:
+                self._spatial.insert(item)
+
+    def nets(self) -> NetIndex:
+        if self._nets is None:
+            self._nets = NetIndex(self._board)
+        self._flush()
+        return self._nets
+
+    def paths(self) -> PathIndex:
+        if self._paths is None:
+            self._paths = PathIndex(self._board)
+        return self._paths
+
+    def groups(self) -> GroupTreeIndex:
+        if self._groups is None:
+            self._groups = GroupTreeIndex(self._board)
+        return self._groups
+
+    def spatial(self) -> SpatialIndex:
+        """Returns a spatial index of the board's tracks (including vias), zones, and graphic shapes"""
+        if self._spatial is None:
+            self._spatial = SpatialIndex(layout_items(self._board))
+        self._flush()
+        return self._spatial
+
+    def pads(self) -> SpatialIndex:
+        """Returns a spatial index of the pads of the board's footprints"""
+        if self._pads is None:
+            self._pads = SpatialIndex(pad for footprint in self._board.GetFootprints() for pad in footprint.Pads())
+        self._flush()
+        return self._pads
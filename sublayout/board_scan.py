@@ -0,0 +1,233 @@
+"""Streaming reader for hierarchy metadata in .kicad_pcb files, without loading the board (or importing pcbnew).
+Scans the memory-mapped file for footprint paths, sheetfiles / sheetnames, references, and pad nets, skipping
+everything else (eg, tracks and zone fills) without tokenizing it, for fleet-wide audits over many boards."""
+import concurrent.futures
+import mmap
+import multiprocessing
+import os
+import re
+import traceback
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+# a token is an open or close paren, a quoted string (with escapes), or a bare atom
+_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))', re.DOTALL)
+# when skipping a list, only parens and strings (which may contain parens) matter
+_SKIP = re.compile(rb'[^()"]*(?:(\()|(\))|"(?:[^"\\]|\\.)*")', re.DOTALL)
+_ESCAPE = re.compile(rb'\\(.)', re.DOTALL)
+
+
+class ScannedFootprint(NamedTuple):
+    reference: str
+    path: Tuple[str, ...]  # as BoardUtils.footprint_path
+    sheetfile: str
+    sheetname: str
+    pads: List[Tuple[str, str]]  # (pad number, net name), net name is empty if unconnected
+
+
+class ScannedBoard(NamedTuple):
+    filename: str
+    footprints: List[ScannedFootprint]
+
+    def sheetfile_names(self) -> Dict[Tuple[str, ...], Tuple[str, str]]:
+        """Returns hierarchy path -> (sheetfile, sheetname), as HierarchyData"""
+        return build_sheetfile_names((footprint.path, footprint.sheetfile, footprint.sheetname)
+                                     for footprint in self.footprints)
+
+    def instances_of(self, target_sheetfile: str) -> List[Tuple[str, ...]]:
+        """Returns all hierarchy paths that are instances of the sheetfile"""
+        return [path for path, (sheetfile, _) in self.sheetfile_names().items() if sheetfile == target_sheetfile]
+
+
+def build_sheetfile_names(footprints: Iterable[Tuple[Tuple[str, ...], str, str]]) \
+        -> Dict[Tuple[str, ...], Tuple[str, str]]:
+    """Given footprints as (path, sheetfile, sheetname), returns the sheetfile and sheetname
+    associated with each hierarchy path."""
+    path_sheetfile_names: Dict[Tuple[str, ...], Tuple[str, str]] = {}
+    for fp_path_comps, sheetfile, sheetname in footprints:
+        if len(fp_path_comps) < 2:  # ignore root components
+            continue
+        fp_path_comps = fp_path_comps[:-1]  # remove the last component (leaf footprint)
+        sheetfile_name = (sheetfile, sheetname)
+        if not sheetfile_name[0] or not sheetfile_name[1]:
+            continue
+        if fp_path_comps in path_sheetfile_names:
+            assert path_sheetfile_names[fp_path_comps] == sheetfile_name
+        else:
+            path_sheetfile_names[fp_path_comps] = sheetfile_name
+    return path_sheetfile_names
+
+
+class _Scanner():
+    """Cursor over the s-expression buffer"""
+    def __init__(self, data: mmap.mmap) -> None:
+        self._data = data
+        self._pos = 0
+
+    def token(self) -> Tuple[int, Optional[str]]:
+        """Returns the next token, as (kind, value): kind 0 is '(', 1 is ')', 2 is a string or atom, -1 is the end"""
+        match = _TOKEN.match(self._data, self._pos)
+        if match is None:
+            return -1, None
+        self._pos = match.end()
+        if match.group(1) is not None:
+            return 0, None
+        elif match.group(2) is not None:
+            return 1, None
+        elif match.group(3) is not None:
+            return 2, _ESCAPE.sub(rb'\1', match.group(3)).decode('utf-8')
+        else:
+            return 2, match.group(4).decode('utf-8')
+
+    def skip_list(self) -> None:
+        """Skips to after the close of the current list"""
+        depth = 1
+        while depth > 0:
+            match = _SKIP.match(self._data, self._pos)
+            if match is None:
+                raise ValueError("unterminated list")
+            self._pos = match.end()
+            if match.group(1) is not None:
+                depth += 1
+            elif match.group(2) is not None:
+                depth -= 1
+
+    def values(self) -> List[str]:
+        """Returns the leading string and atom values of the current list, and skips the rest of it"""
+        values = []
+        while True:
+            kind, value = self.token()
+            if kind == 2:
+                assert value is not None
+                values.append(value)
+            elif kind == 1:
+                return values
+            elif kind == 0:
+                self.skip_list()
+                self.skip_list()
+                return values
+            else:
+                raise ValueError("unterminated list")
+
+    def list_head(self) -> Optional[str]:
+        """After an open paren, returns the head atom of the list"""
+        kind, value = self.token()
+        if kind != 2:
+            raise ValueError("list without a head")
+        return value
+
+
+def _scan_pad(scanner: _Scanner) -> Tuple[str, str]:
+    kind, number = scanner.token()
+    if kind != 2 or number is None:
+        raise ValueError("pad without a number")
+    net_name = ''
+    while True:
+        kind, value = scanner.token()
+        if kind == 0:
+            if scanner.list_head() == 'net':
+                values = scanner.values()  # (net code name) in older versions, (net name) in newer ones
+                net_name = values[-1] if values else ''
+            else:
+                scanner.skip_list()
+        elif kind == 1:
+            return number, net_name
+        elif kind == -1:
+            raise ValueError("unterminated pad")
+
+
+def _scan_footprint(scanner: _Scanner) -> ScannedFootprint:
+    reference = ''
+    path: Tuple[str, ...] = ()
+    sheetfile = ''
+    sheetname = ''
+    pads: List[Tuple[str, str]] = []
+    while True:
+        kind, value = scanner.token()
+        if kind == 0:
+            head = scanner.list_head()
+            if head == 'path':
+                values = scanner.values()
+                path = tuple(values[0].strip('/').split('/')) if values else ()
+            elif head == 'sheetfile':  # KiCad 8+
+                values = scanner.values()
+                sheetfile = values[0] if values else ''
+            elif head == 'sheetname':
+                values = scanner.values()
+                sheetname = values[0] if values else ''
+            elif head == 'property':  # references, and sheetfile / sheetname before KiCad 8
+                values = scanner.values()
+                if len(values) >= 2:
+                    if values[0] == 'Reference':
+                        reference = values[1]
+                    elif values[0] == 'Sheetfile':
+                        sheetfile = values[1]
+                    elif values[0] == 'Sheetname':
+                        sheetname = values[1]
+            elif head == 'fp_text':  # references before KiCad 8
+                values = scanner.values()
+                if len(values) >= 2 and values[0] == 'reference':
+                    reference = values[1]
+            elif head == 'pad':
+                pads.append(_scan_pad(scanner))
+            else:
+                scanner.skip_list()
+        elif kind == 1:
+            return ScannedFootprint(reference, path, sheetfile, sheetname, pads)
+        elif kind == -1:
+            raise ValueError("unterminated footprint")
+
+
+def scan_board(filename: str) -> ScannedBoard:
+    """Scans a .kicad_pcb file for footprint hierarchy metadata. Raises ValueError if it is not a board file."""
+    footprints: List[ScannedFootprint] = []
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"empty board file {filename}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            scanner = _Scanner(data)
+            if scanner.token()[0] != 0 or scanner.list_head() != 'kicad_pcb':
+                raise ValueError(f"not a board file {filename}")
+            while True:
+                kind, value = scanner.token()
+                if kind == 0:
+                    if scanner.list_head() in ('footprint', 'module'):  # module before KiCad 6
+                        scanner.token()  # footprint library name
+                        footprints.append(_scan_footprint(scanner))
+                    else:
+                        scanner.skip_list()
+                elif kind == 1 or kind == -1:
+                    break
+    return ScannedBoard(filename, footprints)
+
+
+def find_boards(paths: Iterable[str]) -> List[str]:
+    """Expands directories (recursively) into the .kicad_pcb files they contain, sorted"""
+    boards = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                boards.extend(os.path.join(dirpath, filename) for filename in filenames
+                              if filename.endswith('.kicad_pcb'))
+        else:
+            boards.append(path)
+    return sorted(boards)
+
+
+def _scan_or_error(filename: str) -> Tuple[str, Optional[ScannedBoard], Optional[str]]:
+    """Scans the board, capturing any exception (as a traceback) as the error, as the CLI reports job failures"""
+    try:
+        return filename, scan_board(filename), None
+    except Exception as e:
+        return filename, None, ''.join(traceback.format_exception(None, e, e.__traceback__))
+
+
+def scan_boards(filenames: List[str], max_workers: Optional[int] = None) \
+        -> List[Tuple[str, Optional[ScannedBoard], Optional[str]]]:
+    """Scans boards in a process pool, returning (filename, scanned board or None, error or None) in order.
+    Workers are spawned (not forked), as for CLI jobs. With one worker, boards are scanned in-process."""
+    if max_workers == 1 or len(filenames) <= 1:
+        return [_scan_or_error(filename) for filename in filenames]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(_scan_or_error, filenames, chunksize=4))
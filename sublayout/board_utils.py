@@ -1,9 +1,11 @@
-from typing import Tuple, cast, Optional, List, Hashable, Any, Iterable, Union, TYPE_CHECKING
+from typing import Tuple, cast, Optional, List, Set, Any, Iterable, Union, TYPE_CHECKING
 
 import pcbnew
 
 if TYPE_CHECKING:
     from .save_sublayout import FilterResult
+    from .replicate_sublayout import ReplicationPlan
+    from .board_index import GroupTreeIndex
 
 try:
     from pcbnew import EDA_GROUP
@@ -21,9 +23,34 @@ def group_parent(group: Any) -> Any:  # pcbnew.EDA_GROUP in newer KiCad versions
         return group.GetParentGroup()
     except AttributeError:
         return group.AsEdaItem().GetParentGroup()
+
+
+def group_id(group: Any) -> str:  # pcbnew.EDA_GROUP in newer KiCad versions
+    """Returns the KIID of a group, newer KiCad versions keep it on the group's board item"""
+    try:
+        return cast(str, group.m_Uuid.AsString())
+    except AttributeError:
+        return cast(str, group.AsEdaItem().m_Uuid.AsString())
         
 
 class BoardUtils():
+    @classmethod
+    def item_id(cls, item: pcbnew.BOARD_ITEM) -> str:
+        """Returns a stable identity (the KIID) for a board item, since SWIG proxies are not stable across calls"""
+        return cast(str, item.m_Uuid.AsString())
+
+    @classmethod
+    def resolve_item(cls, board: pcbnew.BOARD, item_id: str) -> Optional[pcbnew.BOARD_ITEM]:
+        """Returns the board item with the id (from item_id), or None if it is not (or no longer) on the board"""
+        kiid = pcbnew.KIID(item_id)
+        if IsKicad10:
+            item = board.ResolveItem(kiid)
+        else:
+            item = board.GetItem(kiid)
+        if item is None or item.m_Uuid.AsString() != item_id:  # not found returns a deleted-item sentinel
+            return None
+        return item.Cast()
+
     @classmethod
     def footprint_path(cls, footprint: pcbnew.FOOTPRINT) -> Tuple[str, ...]:
         fp_path = footprint.GetPath()  # type: pcbnew.KIID_PATH
@@ -35,77 +62,70 @@ class BoardUtils():
         fp_path = cls.footprint_path(footprint)
         return fp_path[:len(path_prefix)] == path_prefix
 
+    @classmethod
+    def split_refdes(cls, refdes: str) -> Tuple[str, int]:
+        """Splits a refdes into an alpha and numeric portion, at the last non-numeric position."""
+        for i in reversed(range(len(refdes))):
+            if refdes[i].isalpha():
+                if i == len(refdes) - 1:
+                    return refdes, -1  # fallback if no numeric portion
+                return refdes[:i+1], int(refdes[i+1:])
+        return "", int(refdes)
+
 
 class GroupWrapper():
     """A wrapper around a PCB group that is hashable and can be used as a dict key / set element.
-    Supports None as a group."""
+    Groups are identified by their KIID. Supports None as a group."""
     @staticmethod
-    def lowest_common_ancestor(groups: List['GroupWrapper']) -> Optional['GroupWrapper']:
+    def _group_tree(groups: List['GroupWrapper'], index: Optional['GroupTreeIndex']) -> 'GroupTreeIndex':
+        from .board_index import GroupTreeIndex
+        if index is not None:
+            return index
+        boards = [group._board for group in groups if group._board is not None]
+        return GroupTreeIndex(boards[0] if boards else None)
+
+    @staticmethod
+    def lowest_common_ancestor(groups: List['GroupWrapper'],
+                               index: Optional['GroupTreeIndex'] = None) -> Optional['GroupWrapper']:
         """Returns the lowest common ancestor (deepest group) of the groups, or None if there is none
-        (LCA is the board)."""
-        # for each group, get the path to the root, including self but not root
-        group_paths: List[List[GroupWrapper]] = []
-        for group in groups:
-            if group._group is None:
+        (LCA is the board). A group tree index may be passed in, otherwise one is built from the board."""
+        if any(group._group is None for group in groups):
+            return None
+        tree = GroupWrapper._group_tree(groups, index)
+        lca_id: Optional[str] = tree.index_group(groups[0]._group)
+        for group in groups[1:]:
+            lca_id = tree.lowest_common_ancestor_id(lca_id, tree.index_group(group._group))
+            if lca_id is None:  # at the root, no common ancestor
                 return None
-            group_path = []
-            while group._group is not None:
-                group_path.append(group)
-                group = GroupWrapper(group._board, group_parent(group._group))
-            group_paths.append(list(reversed(group_path)))
-        # return the deepest group that is common to all paths
-        i = 0  # base case
-        for i in range(min(len(path) for path in group_paths)):
-            group = group_paths[0][i]
-            if all(path[i] == group for path in group_paths):
-                continue
-            else:
-                if i == 0:  # at the root, no common ancestor
-                    return None
-                else:
-                    return group_paths[0][i - 1]
-        return group_paths[0][i]  # iterated through all groups, return the last one
+        assert lca_id is not None
+        return GroupWrapper(groups[0]._board, tree.group(lca_id))
 
     @staticmethod
-    def highest_covering_groups(groups: List['GroupWrapper']) -> List['GroupWrapper']:
-        """Returns the minimal set of groups at the highest level of hierarchy that cover all input groups."""
+    def highest_covering_groups(groups: List['GroupWrapper'],
+                                index: Optional['GroupTreeIndex'] = None) -> List['GroupWrapper']:
+        """Returns the minimal set of groups at the highest level of hierarchy that cover all input groups.
+        A group tree index may be passed in, otherwise one is built from the board."""
+        tree = GroupWrapper._group_tree(groups, index)
+        group_ids = {tree.index_group(group._group) for group in groups if group._group is not None}
         output_groups: List['GroupWrapper'] = []
+        seen_keys: Set[Optional[str]] = set()
         for group in groups:
-            if group in output_groups:  # deduplicate
+            if group._key in seen_keys:  # deduplicate
                 continue
-            test_group = group
-            while test_group._group is not None:
-                test_group = GroupWrapper(test_group._board, group_parent(test_group._group))
-                if test_group in groups:  # is child of a higher element in the group
-                    break
-            if test_group._group is None:  # made it to root
-                output_groups.append(group)
+            seen_keys.add(group._key)
+            if group._key is not None and \
+                    any(ancestor_id in group_ids for ancestor_id in tree.ancestor_ids(group._key)):
+                continue  # is child of a higher element in the group
+            output_groups.append(group)
         return output_groups
 
-    @staticmethod
-    def _elt_to_key(elt: pcbnew.BOARD_ITEM) -> Optional[Hashable]:
-        """Creates a hashable key for some types of BOARD_ITEMs"""
-        if isinstance(elt, pcbnew.FOOTPRINT):
-            x, y = elt.GetPosition()
-            return (elt.GetReference(), x, y)
-        elif isinstance(elt, pcbnew.PCB_TRACK):
-            sx, sy = elt.GetStart()
-            ex, ey = elt.GetEnd()
-            return (sx, sy, ex, ey)
-        elif isinstance(elt, pcbnew.ZONE):
-            return tuple((elt.GetCornerPosition(i)[0], elt.GetCornerPosition(i)[1]) for i in range(elt.GetNumCorners()))
-        elif isinstance(elt, PcbGroupType):
-            return GroupWrapper(elt.GetBoard(), elt)
-        else:
-            return None
-
     def __hash__(self):
         return hash(self._key)
 
     def __eq__(self, other):
         if not isinstance(other, GroupWrapper):
             return NotImplemented
-        return (self._group is None) == (other._group is None) and self._key == other._key
+        return self._key == other._key
 
     @staticmethod
     def empty() -> "GroupWrapper":
@@ -116,10 +136,7 @@ class GroupWrapper():
         assert isinstance(group, PcbGroupType) or group is None
         self._board = board
         self._group = group
-        if self._group is not None:
-            self._key: Optional[frozenset[Any]] = frozenset([self._elt_to_key(item) for item in self.items()])
-        else:
-            self._key = None
+        self._key: Optional[str] = group_id(group) if group is not None else None
 
     def items(self) -> Iterable[pcbnew.BOARD_ITEM]:
         """Yields all items in the group (non-recursive)"""
@@ -160,11 +177,14 @@ class GroupWrapper():
             return f"GroupWrapper({item_count} items: {', '.join(sorted_refs)})"
 
 
-GroupLike = Union[PcbGroupType, pcbnew.BOARD, 'FilterResult']
+GroupLike = Union[PcbGroupType, pcbnew.BOARD, 'FilterResult', 'ReplicationPlan']
 
-def group_like_items(board: pcbnew.BOARD, grouplike: GroupLike) -> Iterable[pcbnew.BOARD_ITEM]:
+def group_like_items(board: pcbnew.BOARD, grouplike: GroupLike, include_shapes: bool = False) \
+        -> Iterable[pcbnew.BOARD_ITEM]:
     """Given a grouplike, returns the items in the group.
-    Straightforward for groups, does some computation for boards and hierarchy selection results"""
+    Straightforward for groups, does some computation for boards and hierarchy selection results.
+    Ungrouped graphic shapes of a board (except the board outline) are only included if include_shapes is set, since
+    they are only part of a sublayout saved with its region."""
     from .save_sublayout import FilterResult
 
     if isinstance(grouplike, PcbGroupType):
@@ -174,11 +194,14 @@ def group_like_items(board: pcbnew.BOARD, grouplike: GroupLike) -> Iterable[pcbn
         footprints = [item for item in grouplike.GetFootprints()]  # type: List[pcbnew.FOOTPRINT]
         tracks = [item for item in grouplike.GetTracks()]  # type: List[pcbnew.PCB_TRACK]
         zones = [grouplike.GetArea(i) for i in range(grouplike.GetAreaCount())]  # type: List[pcbnew.ZONE]
-        return [item for item in groups + footprints + tracks + zones
+        shapes = [item for item in grouplike.GetDrawings()
+                  if include_shapes and isinstance(item, pcbnew.PCB_SHAPE)
+                  and item.GetLayer() != pcbnew.Edge_Cuts]  # type: List[pcbnew.PCB_SHAPE]
+        return [item for item in groups + footprints + tracks + zones + shapes
                 if item.GetParentGroup() is None]
     elif isinstance(grouplike, FilterResult):
         if len(grouplike.groups) == 1 and len(grouplike.ungrouped_elts) == 0:
-            return group_like_items(board, grouplike.groups[0])  # single group, flatten out
+            return group_like_items(board, grouplike.groups[0], include_shapes)  # single group, flatten out
         else:
             return grouplike.groups + grouplike.ungrouped_elts  # return groups and elts
     else:
@@ -186,6 +209,11 @@ def group_like_items(board: pcbnew.BOARD, grouplike: GroupLike) -> Iterable[pcbn
 
 def group_like_recursive_footprints(board: pcbnew.BOARD, grouplike: GroupLike) -> Iterable[pcbnew.FOOTPRINT]:
     """Given a grouplike, returns the footprints in the group, recursively."""
+    from .replicate_sublayout import ReplicationPlan
+
+    if isinstance(grouplike, ReplicationPlan):  # precompiled, don't re-walk the source board
+        yield from grouplike.footprints
+        return
     for item in group_like_items(board, grouplike):
         if isinstance(item, pcbnew.FOOTPRINT):
             yield item
@@ -0,0 +1,358 @@
+"""Headless command-line interface, for running save / restore / replicate on boards without the plugin GUI,
+eg in CI across many board variants. Boards are processed in a process pool, each worker with its own pcbnew.
+
+The library command exports every hierarchical block of a board, one sublayout per sheetfile, into a directory.
+The scan command lists hierarchy instances with the streaming board reader, without pcbnew at all.
+
+pcbnew (and the modules that depend on it) is only imported inside workers, so the parent process stays light."""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+
+MATCH_MODES = ['refdes', 'tstamp', 'topology']
+INCLUDE_REGION_HELP = "Also select tracks, vias, zones, and graphics inside the bounding box of the hierarchy's " \
+    "footprints, which are not on its internal nets (eg, keepouts and stitching vias)"
+
+_sublayouts: Optional[Any] = None  # per-process SublayoutCache, so workers parse each sublayout once across jobs
+
+
+class CliJob(NamedTuple):
+    """One board to process, picklable to send to workers"""
+    command: str  # save, restore, replicate, library
+    board: str  # input board file
+    output_dir: Optional[str]  # output directory, or None for the board's directory (modifying it in-place)
+    anchor_ref: Optional[str]  # anchor footprint refdes, selecting the hierarchy with level
+    level: int  # hierarchy levels above the anchor's deepest hierarchy, 0 is the deepest
+    path: Optional[Tuple[str, ...]]  # explicit hierarchy path, instead of anchor_ref and level
+    sublayout: Optional[str]  # sublayout board file, for restore
+    match: str  # footprint matching mode, one of MATCH_MODES
+    purge: bool  # delete existing tracks and zones in the target before restore / replicate
+    all_instances: bool  # for restore, restore into all instances of the hierarchy's sheetfile
+    incremental: bool = False  # apply only changes since the last restore / replicate, using the record sidecar
+    preserve_fills: bool = False  # transform source zone fills into targets instead of unfilling them
+    force: bool = False  # for library, export even where the library already has an identical sublayout
+    include_region: bool = False  # also select (and purge, replicate) items inside the hierarchy's footprint area
+    telemetry: Optional[str] = None  # telemetry log file, enabling instrumentation in the worker
+
+
+def _resolve_hierarchy(board: Any, index: Any, job: CliJob) -> Tuple[Any, Tuple[str, ...]]:
+    """Returns the anchor footprint and hierarchy path selected by the job"""
+    from .board_utils import BoardUtils
+
+    if job.path is not None:
+        path = job.path
+        if job.anchor_ref is not None:
+            anchor = board.FindFootprintByReference(job.anchor_ref)
+        else:  # any footprint in the hierarchy can be the anchor
+            footprints = index.paths().footprints_under(path)
+            anchor = footprints[0] if footprints else None
+        if anchor is None:
+            raise ValueError(f"no anchor footprint in hierarchy {'/'.join(path)}")
+    else:
+        if job.anchor_ref is None:
+            raise ValueError("one of anchor refdes or hierarchy path must be specified")
+        anchor = board.FindFootprintByReference(job.anchor_ref)
+        if anchor is None:
+            raise ValueError(f"anchor footprint {job.anchor_ref} not found")
+        anchor_path = BoardUtils.footprint_path(anchor)
+        if job.level < 0 or job.level >= len(anchor_path) - 1:
+            raise ValueError(f"hierarchy level {job.level} out of range for {job.anchor_ref}")
+        path = anchor_path[:len(anchor_path) - 1 - job.level]
+    if not index.paths().path_startswith(anchor, path):
+        raise ValueError(f"anchor footprint {anchor.GetReference()} not in hierarchy {'/'.join(path)}")
+    return anchor, path
+
+
+def _instance_reports(namer: Any, targets: List[Tuple[Any, Tuple[str, ...]]],
+                      results: List[Any]) -> List[Dict[str, Any]]:
+    return [{
+        'path': '/'.join(namer.name_path(target_path)),
+        'anchor': target_anchor.GetReference(),
+        'errors': result.get_error_strs(),
+        'timings': result.timings,
+    } for (target_anchor, target_path), result in zip(targets, results)]
+
+
+def _sublayout_cache() -> Any:
+    global _sublayouts
+    if _sublayouts is None:
+        from .sublayout_cache import SublayoutCache
+        _sublayouts = SublayoutCache()
+    return _sublayouts
+
+
+def run_job(job: CliJob) -> Dict[str, Any]:
+    """Runs one job (in a worker), returning its report entry. Exceptions are captured into the report."""
+    report: Dict[str, Any] = {
+        'board': job.board,
+        'command': job.command,
+        'output': None,
+        'instances': [],
+        'warnings': [],  # not specific to an instance, eg from save
+        'error': None,
+    }
+    try:
+        import pcbnew
+        from . import telemetry
+        if job.telemetry is not None:
+            telemetry.enable(job.telemetry)
+        from .board_index import BoardIndex
+        from .board_utils import BoardUtils
+        from .hierarchy_namer import HierarchyData
+        from .replicate_sublayout import FootprintCorrespondence, ReplicationPlan
+        from .replication_record import ReplicationRecord
+        from .save_sublayout import HierarchySelector
+        from .sublayout_snapshot import write_snapshot
+
+        if job.match == 'refdes':
+            correspondence_fn, probe_fn = FootprintCorrespondence.by_refdes, FootprintCorrespondence.probe_by_refdes
+        elif job.match == 'tstamp':
+            correspondence_fn, probe_fn = FootprintCorrespondence.by_tstamp, FootprintCorrespondence.probe_by_tstamp
+        elif job.match == 'topology':
+            correspondence_fn, probe_fn = FootprintCorrespondence.by_topology, FootprintCorrespondence.probe_by_topology
+        else:
+            raise ValueError(f"unknown match mode {job.match}")
+
+        board = pcbnew.LoadBoard(job.board)  # type: pcbnew.BOARD
+        index = BoardIndex(board)
+        if job.command == 'library':
+            from .library_export import export_library
+            output_dir = job.output_dir if job.output_dir is not None else os.path.dirname(os.path.abspath(job.board))
+            entries = export_library(board, output_dir, index, force=job.force)
+            report['sublayouts'] = [dict(entry.to_json(), sheetfile=entry.sheetfile, written=entry.written)
+                                    for entry in entries]
+            report['output'] = output_dir
+            return report
+
+        namer = HierarchyData(board)
+        anchor, path = _resolve_hierarchy(board, index, job)
+
+        if job.command == 'save':
+            output_dir = job.output_dir if job.output_dir is not None else os.path.dirname(os.path.abspath(job.board))
+            output = os.path.join(output_dir, '_'.join(namer.name_path(path)) + '.kicad_pcb')
+            selector = HierarchySelector(board, path, index, job.include_region)
+            sublayout_board = selector.create_sublayout(output)
+            sublayout_board.Save(output)
+            write_snapshot(sublayout_board, output)
+            report['warnings'] = selector.get_elts().get_error_strs()
+            report['output'] = output
+            return report
+
+        # restore and replicate need the other instances of the selected hierarchy
+        source = HierarchySelector(board, path, index, job.include_region).get_elts()
+        if job.command == 'replicate' or job.all_instances:
+            sheetfile = namer.sheetfile_of(path)
+            if sheetfile is None:
+                raise ValueError(f"no sheetfile for hierarchy {'/'.join(path)}")
+            instance_paths = namer.instances_of(sheetfile)
+        else:
+            instance_paths = [path]
+        instance_anchors = probe_fn(board, source, anchor, board, instance_paths, index, index)
+        targets = [(instance_anchor, instance_path)
+                   for instance_path, instance_anchor in zip(instance_paths, instance_anchors)
+                   if instance_anchor is not None]
+
+        output = os.path.join(job.output_dir, os.path.basename(job.board)) if job.output_dir is not None else job.board
+        record = None
+
+        def item_exists(item_id: str) -> bool:
+            return BoardUtils.resolve_item(board, item_id) is not None
+        if job.command == 'replicate':
+            targets = [(target_anchor, target_path) for target_anchor, target_path in targets
+                       if target_path != path]  # skip self-replication
+            if job.incremental:  # the record is read from the input board's sidecar, and written next to the output
+                record = ReplicationRecord.load_current(job.board, '/'.join(path), item_exists)
+            plan = ReplicationPlan(board, source, index, include_region=job.include_region)
+            results = plan.replicate_many(board, targets, correspondence_fn, purge=job.purge, record=record,
+                                          preserve_fills=job.preserve_fills)
+        elif job.command == 'restore':
+            if job.sublayout is None:
+                raise ValueError("restore requires a sublayout board")
+            if job.incremental:
+                record = ReplicationRecord.load_current(job.board, os.path.abspath(job.sublayout), item_exists)
+            sublayout = _sublayout_cache().get(job.sublayout)
+            plan = ReplicationPlan(sublayout.board, sublayout.board, sublayout.index, sublayout.stable_ids,
+                                   include_region=job.include_region)
+            results = plan.replicate_many(board, targets, correspondence_fn, purge=job.purge, target_index=index,
+                                          record=record, preserve_fills=job.preserve_fills)
+        else:
+            raise ValueError(f"unknown command {job.command}")
+        report['instances'] = _instance_reports(namer, targets, results)
+
+        board.Save(output)
+        if record is not None:
+            record.save(ReplicationRecord.sidecar_path(output))
+        report['output'] = output
+    except Exception as e:
+        report['error'] = ''.join(traceback.format_exception(None, e, e.__traceback__))
+    return report
+
+
+def run_jobs(jobs: List[CliJob], max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Runs jobs in a process pool, returning report entries in job order.
+    Workers are spawned (not forked) so each loads its own pcbnew. With one worker, jobs are run in-process."""
+    if max_workers == 1 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def scan_report(paths: List[str], sheetfile: Optional[str] = None,
+                max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Scans boards (and directories of boards) for hierarchy instances without loading them in pcbnew,
+    returning report entries of instances by sheetfile. If sheetfile is given, only boards containing it are
+    reported, with only its instances."""
+    from .board_scan import find_boards, scan_boards
+
+    reports = []
+    for filename, scanned, error in scan_boards(find_boards(paths), max_workers):
+        sheetfiles: Dict[str, List[Dict[str, str]]] = {}
+        if scanned is not None:
+            try:
+                sheetfile_names = scanned.sheetfile_names()
+            except Exception as e:  # eg, inconsistent hierarchy, reported for this board only
+                reports.append({'board': filename, 'sheetfiles': sheetfiles,
+                                'error': ''.join(traceback.format_exception(None, e, e.__traceback__))})
+                continue
+            for path, (path_sheetfile, sheetname) in sheetfile_names.items():
+                if sheetfile is not None and path_sheetfile != sheetfile:
+                    continue
+                names = [sheetfile_names.get(path[:i], ('', '?'))[1] for i in range(1, len(path) + 1)]
+                sheetfiles.setdefault(path_sheetfile, []).append({'path': '/'.join(path), 'name': '/'.join(names)})
+            if sheetfile is not None and not sheetfiles:
+                continue
+        reports.append({'board': filename, 'sheetfiles': sheetfiles, 'error': error})
+    return reports
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m sublayout',
+                                     description="Save, restore, or replicate hierarchical sublayouts without the GUI. "
+                                     "Multiple boards are processed in parallel, and a JSON report is written.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument("boards", type=str, nargs='+', help="Input .kicad_pcb board files")
+        subparser.add_argument("--ref", type=str, default=None,
+                               help="Anchor footprint refdes, selecting the hierarchy containing it")
+        subparser.add_argument("--level", type=int, default=0,
+                               help="Hierarchy levels above the anchor's deepest hierarchy, 0 (default) is the deepest")
+        subparser.add_argument("--path", type=str, default=None,
+                               help="Explicit hierarchy path as /-separated tstamps, instead of --ref and --level")
+        subparser.add_argument("--jobs", "-j", type=int, default=None,
+                               help="Number of worker processes, defaults to the number of CPUs")
+        subparser.add_argument("--report", type=str, default=None, help="Write the JSON report here instead of stdout")
+        subparser.add_argument("--telemetry", type=str, default=None,
+                               help="Enable per-phase timing instrumentation, appending JSONL records to this file")
+
+    def add_replicate_common(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument("--match", type=str, choices=MATCH_MODES, default='refdes',
+                               help="Footprint matching mode, by relative refdes (default), by tstamp, or by net topology")
+        subparser.add_argument("--purge", action='store_true',
+                               help="Delete existing tracks and zones in the target instances first")
+        subparser.add_argument("--output-dir", type=str, default=None,
+                               help="Write modified boards to this directory, instead of modifying them in-place")
+        subparser.add_argument("--strict", action='store_true',
+                               help="Exit with an error if any (nonfatal) warnings are reported")
+        subparser.add_argument("--incremental", action='store_true',
+                               help="Apply only source changes since the last run, as recorded in a sidecar file next "
+                               "to the board; instances without a record are replicated in full")
+        subparser.add_argument("--preserve-fills", action='store_true',
+                               help="Transform source zone fills into the targets instead of unfilling them, except "
+                               "where copper from outside the target instance is within the zone bounds")
+        subparser.add_argument("--include-region", action='store_true', help=INCLUDE_REGION_HELP)
+
+    save_parser = subparsers.add_parser('save', help="Save the selected hierarchy as a sublayout board")
+    add_common(save_parser)
+    save_parser.add_argument("--output-dir", type=str, default=None,
+                             help="Write sublayouts to this directory, defaults to the board's directory")
+    save_parser.add_argument("--include-region", action='store_true', help=INCLUDE_REGION_HELP)
+
+    restore_parser = subparsers.add_parser('restore', help="Restore a sublayout board into the selected hierarchy")
+    add_common(restore_parser)
+    add_replicate_common(restore_parser)
+    restore_parser.add_argument("--sublayout", type=str, required=True, help="Sublayout .kicad_pcb board file")
+    restore_parser.add_argument("--all-instances", action='store_true',
+                                help="Restore into all instances of the hierarchy's sheetfile, not just the selected one")
+
+    replicate_parser = subparsers.add_parser('replicate',
+                                             help="Replicate the selected hierarchy into all other instances of its sheetfile")
+    add_common(replicate_parser)
+    add_replicate_common(replicate_parser)
+
+    library_parser = subparsers.add_parser('library',
+                                           help="Save every hierarchical block as a sublayout, one per sheetfile")
+    library_parser.add_argument("boards", type=str, nargs='+', help="Input .kicad_pcb board files")
+    library_parser.add_argument("--output-dir", type=str, default=None,
+                                help="Write sublayouts to this directory, defaults to the board's directory")
+    library_parser.add_argument("--force", action='store_true',
+                                help="Export all sublayouts, even those identical to the library's")
+    library_parser.add_argument("--jobs", "-j", type=int, default=None,
+                                help="Number of worker processes, defaults to the number of CPUs")
+    library_parser.add_argument("--report", type=str, default=None, help="Write the JSON report here instead of stdout")
+    library_parser.add_argument("--telemetry", type=str, default=None,
+                                help="Enable per-phase timing instrumentation, appending JSONL records to this file")
+
+    scan_parser = subparsers.add_parser('scan', help="List hierarchy instances by sheetfile, without loading boards")
+    scan_parser.add_argument("boards", type=str, nargs='+', help="Input .kicad_pcb board files or directories")
+    scan_parser.add_argument("--sheetfile", type=str, default=None,
+                             help="Only report boards containing this sheetfile, and only its instances")
+    scan_parser.add_argument("--jobs", "-j", type=int, default=None,
+                             help="Number of worker processes, defaults to the number of CPUs")
+    scan_parser.add_argument("--report", type=str, default=None, help="Write the JSON report here instead of stdout")
+
+    return parser
+
+
+def _write_report(report_json: str, report_file: Optional[str]) -> None:
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            f.write(report_json)
+    else:
+        print(report_json)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'scan':
+        reports = scan_report(args.boards, args.sheetfile, args.jobs)
+        failed = any(report['error'] is not None for report in reports)
+        _write_report(json.dumps({'ok': not failed, 'boards': reports}, indent=2), args.report)
+        return 1 if failed else 0
+
+    path = tuple(args.path.strip('/').split('/')) if getattr(args, 'path', None) else None
+    telemetry_path = getattr(args, 'telemetry', None) or os.environ.get('SUBLAYOUT_TELEMETRY')
+
+    jobs = [CliJob(command=args.command, board=board, output_dir=args.output_dir,
+                   anchor_ref=getattr(args, 'ref', None), level=getattr(args, 'level', 0), path=path,
+                   sublayout=getattr(args, 'sublayout', None),
+                   match=getattr(args, 'match', 'refdes'),
+                   purge=getattr(args, 'purge', False),
+                   all_instances=getattr(args, 'all_instances', False),
+                   incremental=getattr(args, 'incremental', False),
+                   preserve_fills=getattr(args, 'preserve_fills', False),
+                   force=getattr(args, 'force', False),
+                   include_region=getattr(args, 'include_region', False),
+                   telemetry=os.path.abspath(telemetry_path) if telemetry_path else None)
+            for board in args.boards]
+
+    reports = run_jobs(jobs, args.jobs)
+    failed = any(report['error'] is not None for report in reports)
+    warned = any(report['warnings'] or any(instance['errors'] for instance in report['instances'])
+                 for report in reports)
+    _write_report(json.dumps({'ok': not failed, 'boards': reports}, indent=2), args.report)
+
+    if failed or (getattr(args, 'strict', False) and warned):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
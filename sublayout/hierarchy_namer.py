@@ -3,6 +3,7 @@ from typing import List, Dict, Tuple, cast, Optional
 import pcbnew
 
 from .board_utils import BoardUtils
+from .board_scan import build_sheetfile_names
 
 
 class HierarchyData:
@@ -11,24 +12,17 @@ class HierarchyData:
     def _build_sheetfile_names(cls, footprints: List[pcbnew.FOOTPRINT]) -> Dict[Tuple[str, ...], Tuple[str, str]]:
         """Iterates through footprints in the board to try to determine the sheetfile and sheetname
         associated with a path."""
-        path_sheetfile_names: Dict[Tuple[str, ...], Tuple[str, str]] = {}
-        for fp in footprints:
-            fp_path_comps = BoardUtils.footprint_path(fp)
-            if len(fp_path_comps) < 2:  # ignore root components
-                continue
-            fp_path_comps = fp_path_comps[:-1]  # remove the last component (leaf footprint)
-            sheetfile_name = (cast(str, fp.GetSheetfile()), cast(str, fp.GetSheetname()))
-            if not sheetfile_name[0] or not sheetfile_name[1]:
-                continue
-            if fp_path_comps in path_sheetfile_names:
-                assert path_sheetfile_names[fp_path_comps] == sheetfile_name
-            else:
-                path_sheetfile_names[fp_path_comps] = sheetfile_name
-        return path_sheetfile_names
+        return build_sheetfile_names((BoardUtils.footprint_path(fp), cast(str, fp.GetSheetfile()),
+                                      cast(str, fp.GetSheetname()))
+                                     for fp in footprints)
 
     def __init__(self, board: pcbnew.BOARD) -> None:
         self._sheetfile_names = self._build_sheetfile_names(board.Footprints())
 
+    def sheetfile_names(self) -> Dict[Tuple[str, ...], Tuple[str, str]]:
+        """Returns hierarchy path -> (sheetfile, sheetname)"""
+        return self._sheetfile_names
+
     def name_path(self, path: Tuple[str, ...], footprint_ref: Optional[str] = None) -> Tuple[str, ...]:
         """Infers a structured name for the given path"""
         names = []
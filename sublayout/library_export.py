@@ -0,0 +1,185 @@
+"""Exports every hierarchical block of a board to a sublayout library directory in one pass, one sublayout per
+distinct sheetfile. Instances are compared by a geometry hash (of their layout in their own anchor frame), so
+identical copies are counted once, and exports that would be identical to the library's are skipped."""
+import hashlib
+import json
+import math
+import os
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import pcbnew
+
+from .board_index import BoardIndex
+from .board_utils import BoardUtils, GroupWrapper, PcbGroupType, group_like_items
+from .hierarchy_namer import HierarchyData
+from .replicate_sublayout import PositionTransform
+from .save_sublayout import FilterResult, HierarchySelector
+from .sublayout_snapshot import write_snapshot
+
+
+MANIFEST_FILENAME = 'sublayouts.json'
+
+
+class InstanceSummary(NamedTuple):
+    path: Tuple[str, ...]
+    geometry_hash: str
+    layout_items: int  # tracks and zones, as a measure of how completely the instance is laid out
+    footprints: int
+
+
+class LibraryEntry(NamedTuple):
+    sheetfile: str
+    filename: str  # relative to the library directory
+    source_path: Tuple[str, ...]  # hierarchy path of the exported instance
+    geometry_hash: str
+    instances: int  # instances of the sheetfile on the board
+    identical_instances: int  # instances with the same geometry as the exported one, including itself
+    written: bool  # False if the library already had an identical export
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'filename': self.filename,
+            'source_path': '/'.join(self.source_path),
+            'geometry_hash': self.geometry_hash,
+            'instances': self.instances,
+            'identical_instances': self.identical_instances,
+        }
+
+
+def sublayout_filename(sheetfile: str) -> str:
+    """Returns the library filename for a sheetfile"""
+    if sheetfile.endswith('.kicad_sch'):
+        sheetfile = sheetfile[:-len('.kicad_sch')]
+    return re.sub(r'[^\w.\-]', '_', sheetfile) + '.kicad_pcb'
+
+
+def sublayout_filenames(sheetfiles: Iterable[str]) -> Dict[str, str]:
+    """Returns the library filename for each sheetfile. Sheetfiles whose filenames would collide (eg, sub/amp and
+    sub_amp, or names differing only in case, for case-insensitive filesystems) get a short hash of the sheetfile
+    appended, so no export overwrites another."""
+    by_filename: Dict[str, List[str]] = {}
+    for sheetfile in sheetfiles:
+        by_filename.setdefault(sublayout_filename(sheetfile).lower(), []).append(sheetfile)
+    filenames = {}
+    for colliding in by_filename.values():
+        for sheetfile in colliding:
+            filename = sublayout_filename(sheetfile)
+            if len(colliding) > 1:
+                suffix = hashlib.sha1(sheetfile.encode('utf-8')).hexdigest()[:8]
+                filename = f"{filename[:-len('.kicad_pcb')]}-{suffix}.kicad_pcb"
+            filenames[sheetfile] = filename
+    return filenames
+
+
+def _selection_items(board: pcbnew.BOARD, result: FilterResult) -> Iterable[pcbnew.BOARD_ITEM]:
+    """Yields all (non-group) items of a selection, recursively"""
+    for item in group_like_items(board, result):
+        if isinstance(item, PcbGroupType):
+            yield from (elt for elt in GroupWrapper(board, item).recursive_items()
+                        if not isinstance(elt, PcbGroupType))
+        else:
+            yield item
+
+
+def geometry_hash(board: pcbnew.BOARD, index: BoardIndex, path: Tuple[str, ...], result: FilterResult) -> str:
+    """Returns a hash of the instance's layout in its own frame, so identical copies (in any placement) hash equal.
+    The frame is that of the footprint with the lowest relative path, footprints are identified by relative path,
+    and nets by the lowest (relative path, pad number) of their pads in the instance."""
+    footprint_rel_paths = {BoardUtils.item_id(footprint): BoardUtils.footprint_path(footprint)[len(path):]
+                           for footprint in result.footprints}
+    if not footprint_rel_paths:
+        return hashlib.sha1(b'').hexdigest()
+    anchor = min(result.footprints, key=lambda footprint: footprint_rel_paths[BoardUtils.item_id(footprint)])
+    frame = PositionTransform.to_anchor_frame(anchor)
+    nets = index.nets()
+
+    net_roles: Dict[int, Any] = {0: None}
+    def net_role(netcode: int) -> Any:
+        role = net_roles.get(netcode)
+        if role is None and netcode not in net_roles:
+            pads = [(footprint_rel_paths[footprint_id], pad_number)
+                    for footprint_id, pad_number in nets.netcode_pads(netcode) if footprint_id in footprint_rel_paths]
+            role = min(pads) if pads else None
+            net_roles[netcode] = role
+        return role
+
+    def layer(layer_id: int) -> int:
+        if layer_id in (pcbnew.F_Cu, pcbnew.B_Cu):
+            return pcbnew.B_Cu if frame.transform_flipped(layer_id == pcbnew.B_Cu) else pcbnew.F_Cu
+        return layer_id
+
+    entries = []
+    for item in _selection_items(board, result):
+        if isinstance(item, pcbnew.FOOTPRINT):
+            pos = frame.transform(item.GetPosition())
+            orientation = round(math.degrees(frame.transform_orientation(item.GetOrientation().AsRadians())), 3) % 360
+            entries.append(('footprint', footprint_rel_paths.get(BoardUtils.item_id(item)), tuple(pos), orientation,
+                            frame.transform_flipped(item.GetSide() != 0)))
+        elif isinstance(item, pcbnew.PCB_TRACK):
+            endpoints = sorted([tuple(frame.transform(item.GetStart())), tuple(frame.transform(item.GetEnd()))])
+            entries.append(('track', item.GetClass(), endpoints, layer(item.GetLayer()), item.GetWidth(),
+                            net_role(item.GetNetCode())))
+        elif isinstance(item, pcbnew.ZONE):
+            corners = [tuple(frame.transform(item.GetCornerPosition(i))) for i in range(item.GetNumCorners())]
+            layers = sorted(layer(layer_id) for layer_id in item.GetLayerSet().Seq())
+            entries.append(('zone', corners, layers, net_role(item.GetNetCode())))
+    entries.sort(key=repr)
+    return hashlib.sha1(repr(entries).encode('utf-8')).hexdigest()
+
+
+def _load_manifest(output_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME), 'r') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def export_library(board: pcbnew.BOARD, output_dir: str, index: Optional[BoardIndex] = None,
+                   force: bool = False) -> List[LibraryEntry]:
+    """Exports one sublayout per distinct sheetfile on the board into output_dir, with a manifest.
+    For each sheetfile, the most completely laid out instance is exported. Exports are skipped (unless forced)
+    where the library already has an export of the same geometry. All selections share one board index."""
+    if index is None:
+        index = BoardIndex(board)
+    namer = HierarchyData(board)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+
+    instances_by_sheetfile: Dict[str, List[Tuple[str, ...]]] = {}
+    for path, (sheetfile, sheetname) in namer.sheetfile_names().items():
+        instances_by_sheetfile.setdefault(sheetfile, []).append(path)
+
+    filenames = sublayout_filenames(instances_by_sheetfile.keys())
+    entries = []
+    for sheetfile, paths in sorted(instances_by_sheetfile.items()):
+        summaries = []
+        selections: Dict[Tuple[str, ...], HierarchySelector] = {}
+        for path in sorted(paths):
+            selector = HierarchySelector(board, path, index)
+            result = selector.get_elts()
+            layout_items = sum(1 for item in _selection_items(board, result)
+                               if isinstance(item, (pcbnew.PCB_TRACK, pcbnew.ZONE)))
+            summaries.append(InstanceSummary(path, geometry_hash(board, index, path, result), layout_items,
+                                             len(result.footprints)))
+            selections[path] = selector
+        best = max(summaries, key=lambda summary: (summary.layout_items, summary.footprints))
+
+        filename = filenames[sheetfile]
+        output = os.path.join(output_dir, filename)
+        previous = manifest.get(sheetfile, {})
+        written = force or previous.get('geometry_hash') != best.geometry_hash or not os.path.exists(output)
+        if written:
+            sublayout_board = selections[best.path].create_sublayout(output)
+            sublayout_board.Save(output)
+            write_snapshot(sublayout_board, output)
+        entry = LibraryEntry(sheetfile, filename, best.path, best.geometry_hash, len(summaries),
+                             sum(1 for summary in summaries if summary.geometry_hash == best.geometry_hash), written)
+        manifest[sheetfile] = entry.to_json()
+        entries.append(entry)
+
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return entries
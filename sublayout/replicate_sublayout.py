@@ -1,71 +1,154 @@
+import hashlib
 import math
-from typing import Tuple, List, Dict, NamedTuple, Set, Optional, Callable
+import time
+from typing import Tuple, List, Dict, NamedTuple, Set, Optional, Callable, Union, Any
 
 import pcbnew
 
+try:
+    import numpy as np  # optional, used to vectorize batch transforms
+except ImportError:
+    np = None
+
 from .board_utils import BoardUtils, GroupWrapper, GroupLike, group_like_items, group_like_recursive_footprints, \
-  PcbGroupType
+  PcbGroupType, group_id
+from .replication_record import InstanceRecord, ReplicationRecord
+from .board_batch import BoardBatch
+from .board_index import BoardIndex, BoundingBox, PathIndex, item_bbox
+from .save_sublayout import HierarchySelector
+from . import telemetry
+
+
+CorrespondenceFn = Callable[[pcbnew.BOARD, GroupLike, pcbnew.BOARD, Tuple[str, ...],
+                             Optional[BoardIndex], Optional[BoardIndex]], 'FootprintCorrespondence']
+# finds the counterparts of one source footprint in each of the target hierarchies, without a full correspondence
+AnchorProbeFn = Callable[[pcbnew.BOARD, GroupLike, pcbnew.FOOTPRINT, pcbnew.BOARD, List[Tuple[str, ...]],
+                          Optional[BoardIndex], Optional[BoardIndex]], List[Optional[pcbnew.FOOTPRINT]]]
 
 
-class FootprintCorrespondence(NamedTuple):
+class FootprintCorrespondence():
     """A footprint correspondence between source board (sublayout) and target board footprints.
-    This interface allows for different mappings between sublayout and target boards."""
-    mapped_footprints: List[Tuple[pcbnew.FOOTPRINT, pcbnew.FOOTPRINT]] = []  # source, target
-    source_only_footprints: List[pcbnew.FOOTPRINT] = []
-    target_only_footprints: List[pcbnew.FOOTPRINT] = []
+    This interface allows for different mappings between sublayout and target boards.
+    Forward (source -> target) and reverse (target -> source) lookups by footprint are built on construction,
+    lookups by path are built on first use."""
+    MAX_TOPOLOGY_ROUNDS = 8  # bounds by_topology labeling, which usually stabilizes in a few rounds
+
+    def __init__(self, mapped_footprints: Optional[List[Tuple[pcbnew.FOOTPRINT, pcbnew.FOOTPRINT]]] = None,
+                 source_only_footprints: Optional[List[pcbnew.FOOTPRINT]] = None,
+                 target_only_footprints: Optional[List[pcbnew.FOOTPRINT]] = None) -> None:
+        self.mapped_footprints: List[Tuple[pcbnew.FOOTPRINT, pcbnew.FOOTPRINT]] = \
+            mapped_footprints if mapped_footprints is not None else []  # source, target
+        self.source_only_footprints: List[pcbnew.FOOTPRINT] = \
+            source_only_footprints if source_only_footprints is not None else []
+        self.target_only_footprints: List[pcbnew.FOOTPRINT] = \
+            target_only_footprints if target_only_footprints is not None else []
+
+        self._target_by_source: Dict[str, pcbnew.FOOTPRINT] = {}  # by footprint id
+        self._source_by_target: Dict[str, pcbnew.FOOTPRINT] = {}
+        for src_footprint, target_footprint in self.mapped_footprints:
+            self._target_by_source[BoardUtils.item_id(src_footprint)] = target_footprint
+            self._source_by_target[BoardUtils.item_id(target_footprint)] = src_footprint
+        self._target_by_source_path: Optional[Dict[Tuple[str, ...], pcbnew.FOOTPRINT]] = None
+        self._source_by_target_path: Optional[Dict[Tuple[str, ...], pcbnew.FOOTPRINT]] = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self.mapped_footprints)} mapped, " \
+               f"{len(self.source_only_footprints)} source only, {len(self.target_only_footprints)} target only)"
 
     def get_footprint(self, src_footprint: pcbnew.FOOTPRINT) -> Optional[pcbnew.FOOTPRINT]:
         """Returns the target footprint corresponding to the source footprint, or None if not found"""
-        # TODO: create and cache a dict for faster lookup
-        for src_fp, target_fp in self.mapped_footprints:
-            if src_fp == src_footprint:
-                return target_fp
-        return None
+        return self._target_by_source.get(BoardUtils.item_id(src_footprint))
+
+    def get_source_footprint(self, target_footprint: pcbnew.FOOTPRINT) -> Optional[pcbnew.FOOTPRINT]:
+        """Returns the source footprint corresponding to the target footprint, or None if not found"""
+        return self._source_by_target.get(BoardUtils.item_id(target_footprint))
+
+    def _build_path_maps(self, src_paths: Optional[PathIndex], target_paths: Optional[PathIndex]) -> None:
+        self._target_by_source_path = {}
+        self._source_by_target_path = {}
+        for src_footprint, target_footprint in self.mapped_footprints:
+            src_path = src_paths.path_of(src_footprint) if src_paths is not None \
+                else BoardUtils.footprint_path(src_footprint)
+            target_path = target_paths.path_of(target_footprint) if target_paths is not None \
+                else BoardUtils.footprint_path(target_footprint)
+            self._target_by_source_path[src_path] = target_footprint
+            self._source_by_target_path[target_path] = src_footprint
+
+    def get_footprint_by_path(self, src_path: Tuple[str, ...], src_paths: Optional[PathIndex] = None,
+                              target_paths: Optional[PathIndex] = None) -> Optional[pcbnew.FOOTPRINT]:
+        """Returns the target footprint corresponding to the source footprint path, or None if not found.
+        Path indices, if provided, are used to build the path lookups on first use."""
+        if self._target_by_source_path is None:
+            self._build_path_maps(src_paths, target_paths)
+        assert self._target_by_source_path is not None
+        return self._target_by_source_path.get(src_path)
+
+    def get_source_footprint_by_path(self, target_path: Tuple[str, ...], src_paths: Optional[PathIndex] = None,
+                                     target_paths: Optional[PathIndex] = None) -> Optional[pcbnew.FOOTPRINT]:
+        """Returns the source footprint corresponding to the target footprint path, or None if not found.
+        Path indices, if provided, are used to build the path lookups on first use."""
+        if self._source_by_target_path is None:
+            self._build_path_maps(src_paths, target_paths)
+        assert self._source_by_target_path is not None
+        return self._source_by_target_path.get(target_path)
 
     @staticmethod
-    def by_tstamp(src_board: pcbnew.BOARD, src: GroupLike, target_board: pcbnew.BOARD, target_path_prefix: Tuple[str, ...])\
+    @telemetry.timed('correspondence.by_tstamp')
+    def by_tstamp(src_board: pcbnew.BOARD, src: GroupLike, target_board: pcbnew.BOARD, target_path_prefix: Tuple[str, ...],
+                  src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None)\
             -> 'FootprintCorrespondence':
-        """Calculates a footprint correspondence using relative-path tstamps."""
+        """Calculates a footprint correspondence using relative-path tstamps.
+        The source prefix (path of the source hierarchy) is resolved from the first matching footprint, after which
+        footprints under that prefix are matched with a single lookup of their postfix.
+        Board indices may be passed in to be shared across calls, otherwise the target index is built here."""
         assert src_board is not None
         assert src is not None
         assert target_board is not None
+        if target_index is None:
+            target_index = BoardIndex(target_board)
 
         mapped_footprints: List[Tuple[pcbnew.FOOTPRINT, pcbnew.FOOTPRINT]] = []
         source_only_footprints: List[pcbnew.FOOTPRINT] = []
 
         # calculate target footprints by postfix, since source prefix is not known
         target_footprint_by_postfix: Dict[Tuple[str, ...], pcbnew.FOOTPRINT] = {}
-        target_footprints = target_board.GetFootprints()  # type: List[pcbnew.FOOTPRINT]
-        for footprint in target_footprints:
-            if not BoardUtils.footprint_path_startswith(footprint, target_path_prefix):
-                continue  # ignore footprints outside the hierarchy
-            footprint_postfix = BoardUtils.footprint_path(footprint)[len(target_path_prefix):]
+        for footprint_path, footprint in target_index.paths().entries_under(target_path_prefix):
+            footprint_postfix = footprint_path[len(target_path_prefix):]
             assert footprint_postfix not in target_footprint_by_postfix, \
                 f'duplicate footprint in hierarchy in target {footprint.GetReference()}'
             target_footprint_by_postfix[footprint_postfix] = footprint
 
-        # iterate through all source footprints and match by postfix, storing the prefix
-        source_prefixes: Set[Tuple[str, ...]] = set()
+        # iterate through all source footprints and match by postfix, resolving the source prefix once
+        source_prefix: Optional[Tuple[str, ...]] = None
         source_footprints = group_like_recursive_footprints(src_board, src)
         for footprint in source_footprints:
-            footprint_path = BoardUtils.footprint_path(footprint)
+            if src_index is not None:
+                footprint_path = src_index.paths().path_of(footprint)
+            else:
+                footprint_path = BoardUtils.footprint_path(footprint)
+
+            if source_prefix is not None and footprint_path[:len(source_prefix)] == source_prefix:  # fast path
+                target_footprint = target_footprint_by_postfix.pop(footprint_path[len(source_prefix):], None)
+                if target_footprint is not None:
+                    mapped_footprints.append((footprint, target_footprint))
+                    continue
+
             matched = False
             for i in range(len(footprint_path)):  # try all postfix lengths to match
                 test_postfix = footprint_path[i:]
                 target_footprint = target_footprint_by_postfix.get(test_postfix)
                 if target_footprint is not None:
+                    if source_prefix is None:
+                        source_prefix = footprint_path[:i]
+                    elif footprint_path[:i] != source_prefix:  # test prefixes for consistency
+                        raise ValueError('multiple source prefixes found, not supported')
                     mapped_footprints.append((footprint, target_footprint))
-                    source_prefixes.add(footprint_path[:i])
                     del target_footprint_by_postfix[test_postfix]
                     matched = True
                     break
             if not matched:
                 source_only_footprints.append(footprint)
 
-        # test prefixes for consistency
-        if len(source_prefixes) > 1:
-            raise ValueError('multiple source prefixes found, not supported')
-
         # calculate source footprints by postfix
         target_only_footprints = list(target_footprint_by_postfix.values())  # all unused source footprints
 
@@ -74,15 +157,12 @@ class FootprintCorrespondence(NamedTuple):
     @staticmethod
     def _split_refdes(refdes: str) -> Tuple[str, int]:
         """Splits a refdes into an alpha and numeric portion, at the last non-numeric position."""
-        for i in reversed(range(len(refdes))):
-            if refdes[i].isalpha():
-                if i == len(refdes) - 1:
-                    return refdes, -1  # fallback if no numeric portion
-                return refdes[:i+1], int(refdes[i+1:])
-        return "", int(refdes)
+        return BoardUtils.split_refdes(refdes)
 
     @classmethod
-    def by_refdes(cls, src_board: pcbnew.BOARD, src: GroupLike, target_board: pcbnew.BOARD, target_path_prefix: Tuple[str, ...]) \
+    @telemetry.timed('correspondence.by_refdes')
+    def by_refdes(cls, src_board: pcbnew.BOARD, src: GroupLike, target_board: pcbnew.BOARD, target_path_prefix: Tuple[str, ...],
+                  src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None) \
         -> 'FootprintCorrespondence':
         """Calculates a footprint correspondence using relative offset refdes, eg src R1, R3, R4 matches
         target R6, R7, R8, assuming those were the only R* parts in both src and target.
@@ -92,14 +172,11 @@ class FootprintCorrespondence(NamedTuple):
         assert src_board is not None
         assert src is not None
         assert target_board is not None
+        if target_index is None:
+            target_index = BoardIndex(target_board)
 
-        target_footprints_by_refdes: Dict[str, List[Tuple[int, pcbnew.FOOTPRINT]]] = {}  # R -> [(1, R1), (3, R3), ...]
-        target_footprints = target_board.GetFootprints()  # type: List[pcbnew.FOOTPRINT]
-        for footprint in target_footprints:
-            if not BoardUtils.footprint_path_startswith(footprint, target_path_prefix):
-                continue  # ignore footprints outside the hierarchy
-            refdes_type, refdes_num = cls._split_refdes(footprint.GetReferenceAsString())
-            target_footprints_by_refdes.setdefault(refdes_type, []).append((refdes_num, footprint))
+        # R -> [R1, R3, ...], sorted by refdes number
+        target_footprints_by_refdes = target_index.paths().refdes_ranks(target_path_prefix)
 
         source_footprints_by_refdes: Dict[str, List[Tuple[int, pcbnew.FOOTPRINT]]] = {}
         source_footprints = group_like_recursive_footprints(src_board, src)
@@ -111,10 +188,9 @@ class FootprintCorrespondence(NamedTuple):
         source_only_footprints: List[pcbnew.FOOTPRINT] = []
         target_only_footprints: List[pcbnew.FOOTPRINT] = []
         for refdes_type in set(target_footprints_by_refdes.keys()).union(source_footprints_by_refdes.keys()):
-            target_num_footprints = target_footprints_by_refdes.get(refdes_type, [])
             source_num_footprints = source_footprints_by_refdes.get(refdes_type, [])
             source_footprints = [footprint for num, footprint in sorted(source_num_footprints, key=lambda x: x[0])]
-            target_footprints = [footprint for num, footprint in sorted(target_num_footprints, key=lambda x: x[0])]
+            target_footprints = target_footprints_by_refdes.get(refdes_type, [])
 
             for source_footprint, target_footprint in zip(source_footprints, target_footprints):
                 mapped_footprints.append((source_footprint, target_footprint))
@@ -125,35 +201,313 @@ class FootprintCorrespondence(NamedTuple):
 
         return FootprintCorrespondence(mapped_footprints, source_only_footprints, target_only_footprints)
 
+    @staticmethod
+    def _footprint_topology(footprints: List[pcbnew.FOOTPRINT], index: Optional[BoardIndex]) \
+            -> Tuple[List[Tuple[str, int]], List[List[Tuple[str, int]]]]:
+        """Returns the initial label data (FPID, pad count) and connected pads (pad number, netcode) of each footprint"""
+        footprint_labels: List[Tuple[str, int]] = []
+        footprint_pads: List[List[Tuple[str, int]]] = []
+        for footprint in footprints:
+            if index is not None:
+                pads = index.nets().footprint_pads(footprint)
+            else:
+                pads = [(pad.GetNumber(), pad.GetNetCode()) for pad in footprint.Pads()]
+            footprint_labels.append((footprint.GetFPIDAsString(), len(pads)))
+            footprint_pads.append([(pad_number, netcode) for pad_number, netcode in pads if netcode != 0])
+        return footprint_labels, footprint_pads
+
+    @classmethod
+    def _topology_labels(cls, footprints: List[pcbnew.FOOTPRINT], index: Optional[BoardIndex],
+                         rounds: Optional[int] = None) -> List[List[int]]:
+        """Computes Weisfeiler-Lehman style labels of footprints in the footprint-pad-net graph of a hierarchy,
+        returning the labels of each footprint for each round, from coarsest to finest.
+        Footprints start labeled by FPID and pad count, and each round relabels nets by their (footprint label,
+        pad number) neighbors and footprints by their (pad number, net label) neighbors. Only nets within the
+        footprints are considered, so netcodes do not need to correspond between hierarchies.
+        If rounds is None, rounds are run until the labels stop refining (or MAX_TOPOLOGY_ROUNDS), otherwise exactly
+        that many rounds are run, so labels are comparable to another hierarchy's labels of the same round.
+        Each round is linear in the number of pads (up to sorting within each footprint and net)."""
+        footprint_labels, footprint_pads = cls._footprint_topology(footprints, index)
+        net_pads: Dict[int, List[Tuple[int, str]]] = {}  # netcode -> [(footprint index, pad number)]
+        for footprint_index, pads in enumerate(footprint_pads):
+            for pad_number, netcode in pads:
+                net_pads.setdefault(netcode, []).append((footprint_index, pad_number))
+
+        labels = [hash(label) for label in footprint_labels]
+        levels = [labels]
+        max_rounds = rounds if rounds is not None else cls.MAX_TOPOLOGY_ROUNDS
+        while len(levels) <= max_rounds:
+            net_labels = {netcode: hash(tuple(sorted((labels[footprint_index], pad_number)
+                                                     for footprint_index, pad_number in pads)))
+                          for netcode, pads in net_pads.items()}
+            new_labels = [hash((labels[footprint_index],
+                                tuple(sorted((pad_number, net_labels[netcode]) for pad_number, netcode in pads))))
+                          for footprint_index, pads in enumerate(footprint_pads)]
+            # labels only ever refine, so once the class count is stable, further rounds do not distinguish more
+            if rounds is None and len(set(new_labels)) == len(set(labels)):
+                break
+            labels = new_labels
+            levels.append(labels)
+        return levels
+
+    @staticmethod
+    def _match_topology(source_footprints: List[pcbnew.FOOTPRINT], source_levels: List[List[int]],
+                        target_footprints: List[pcbnew.FOOTPRINT], target_levels: List[List[int]]) \
+            -> 'FootprintCorrespondence':
+        """Matches footprints with equal labels, from the finest round to the coarsest, so footprints that differ
+        only in some neighborhood (eg, from a changed part elsewhere in the hierarchy) are still matched.
+        Within a label class, footprints are matched in refdes order."""
+        def refdes_key(footprint: pcbnew.FOOTPRINT) -> Tuple[str, int]:
+            return BoardUtils.split_refdes(footprint.GetReferenceAsString())
+
+        mapped_footprints: List[Tuple[pcbnew.FOOTPRINT, pcbnew.FOOTPRINT]] = []
+        source_unmatched = list(range(len(source_footprints)))
+        target_unmatched = list(range(len(target_footprints)))
+        for level in reversed(range(min(len(source_levels), len(target_levels)))):
+            target_by_label: Dict[int, List[int]] = {}
+            for target_i in target_unmatched:
+                target_by_label.setdefault(target_levels[level][target_i], []).append(target_i)
+            source_by_label: Dict[int, List[int]] = {}
+            for source_i in source_unmatched:
+                source_by_label.setdefault(source_levels[level][source_i], []).append(source_i)
+
+            matched_sources: Set[int] = set()
+            matched_targets: Set[int] = set()
+            for label, source_is in source_by_label.items():
+                target_is = target_by_label.get(label)
+                if not target_is:
+                    continue
+                source_is = sorted(source_is, key=lambda i: refdes_key(source_footprints[i]))
+                target_is = sorted(target_is, key=lambda i: refdes_key(target_footprints[i]))
+                for source_i, target_i in zip(source_is, target_is):
+                    mapped_footprints.append((source_footprints[source_i], target_footprints[target_i]))
+                    matched_sources.add(source_i)
+                    matched_targets.add(target_i)
+            source_unmatched = [i for i in source_unmatched if i not in matched_sources]
+            target_unmatched = [i for i in target_unmatched if i not in matched_targets]
+
+        return FootprintCorrespondence(mapped_footprints, [source_footprints[i] for i in source_unmatched],
+                                       [target_footprints[i] for i in target_unmatched])
+
+    @classmethod
+    @telemetry.timed('correspondence.by_topology')
+    def by_topology(cls, src_board: pcbnew.BOARD, src: GroupLike, target_board: pcbnew.BOARD,
+                    target_path_prefix: Tuple[str, ...],
+                    src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None) \
+            -> 'FootprintCorrespondence':
+        """Calculates a footprint correspondence by net topology: footprints are matched by their FPID and how their
+        pads connect to other footprints in the hierarchy, with refdes only breaking ties between equivalent footprints.
+        This is for when neither tstamps nor refdes orders line up, eg after back-annotation renumbered one instance.
+        Runs in near-linear time in the number of pads, see _topology_labels."""
+        assert src_board is not None
+        assert src is not None
+        assert target_board is not None
+        if target_index is None:
+            target_index = BoardIndex(target_board)
+
+        source_footprints = group_like_recursive_footprints(src_board, src)
+        source_levels = cls._topology_labels(source_footprints, src_index)
+        target_footprints = target_index.paths().footprints_under(target_path_prefix)
+        target_levels = cls._topology_labels(target_footprints, target_index, len(source_levels) - 1)
+        return cls._match_topology(source_footprints, source_levels, target_footprints, target_levels)
+
+    @staticmethod
+    def probe_by_tstamp(src_board: pcbnew.BOARD, src: GroupLike, src_footprint: pcbnew.FOOTPRINT,
+                        target_board: pcbnew.BOARD, target_path_prefixes: List[Tuple[str, ...]],
+                        src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None) \
+            -> List[Optional[pcbnew.FOOTPRINT]]:
+        """Returns the counterpart of src_footprint in each target hierarchy, as by_tstamp would map it,
+        or None where there is no counterpart. Only the probed footprint is matched, with a path lookup
+        per postfix length."""
+        assert src_board is not None
+        assert src is not None
+        assert target_board is not None
+        if target_index is None:
+            target_index = BoardIndex(target_board)
+        if src_index is not None:
+            src_path = src_index.paths().path_of(src_footprint)
+        else:
+            src_path = BoardUtils.footprint_path(src_footprint)
+
+        target_paths = target_index.paths()
+        target_footprints: List[Optional[pcbnew.FOOTPRINT]] = []
+        for target_path_prefix in target_path_prefixes:
+            target_footprint = None
+            for i in range(len(src_path)):  # longest postfix first, as by_tstamp
+                target_footprint = target_paths.footprint_at(target_path_prefix + src_path[i:])
+                if target_footprint is not None:
+                    break
+            target_footprints.append(target_footprint)
+        return target_footprints
+
+    @staticmethod
+    def probe_by_refdes(src_board: pcbnew.BOARD, src: GroupLike, src_footprint: pcbnew.FOOTPRINT,
+                        target_board: pcbnew.BOARD, target_path_prefixes: List[Tuple[str, ...]],
+                        src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None) \
+            -> List[Optional[pcbnew.FOOTPRINT]]:
+        """Returns the counterpart of src_footprint in each target hierarchy, as by_refdes would map it,
+        or None where there is no counterpart. The source rank is computed once, and each target is a
+        lookup into the cached per-hierarchy refdes ranks."""
+        assert src_board is not None
+        assert src is not None
+        assert target_board is not None
+        if target_index is None:
+            target_index = BoardIndex(target_board)
+
+        src_refdes_type, _ = BoardUtils.split_refdes(src_footprint.GetReferenceAsString())
+        src_footprint_id = BoardUtils.item_id(src_footprint)
+        source_num_ids: List[Tuple[int, str]] = []
+        for footprint in group_like_recursive_footprints(src_board, src):
+            refdes_type, refdes_num = BoardUtils.split_refdes(footprint.GetReferenceAsString())
+            if refdes_type == src_refdes_type:
+                source_num_ids.append((refdes_num, BoardUtils.item_id(footprint)))
+        source_ids = [footprint_id for num, footprint_id in sorted(source_num_ids, key=lambda x: x[0])]
+        if src_footprint_id not in source_ids:
+            return [None] * len(target_path_prefixes)
+        src_rank = source_ids.index(src_footprint_id)
+
+        target_paths = target_index.paths()
+        target_footprints: List[Optional[pcbnew.FOOTPRINT]] = []
+        for target_path_prefix in target_path_prefixes:
+            ranked_footprints = target_paths.refdes_ranks(target_path_prefix).get(src_refdes_type, [])
+            target_footprints.append(ranked_footprints[src_rank] if src_rank < len(ranked_footprints) else None)
+        return target_footprints
+
+    @classmethod
+    def probe_by_topology(cls, src_board: pcbnew.BOARD, src: GroupLike, src_footprint: pcbnew.FOOTPRINT,
+                          target_board: pcbnew.BOARD, target_path_prefixes: List[Tuple[str, ...]],
+                          src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None) \
+            -> List[Optional[pcbnew.FOOTPRINT]]:
+        """Returns the counterpart of src_footprint in each target hierarchy, as by_topology would map it,
+        or None where there is no counterpart. Labels depend on the whole hierarchy, so each target is fully
+        labeled and matched, but source labels are computed once."""
+        assert src_board is not None
+        assert src is not None
+        assert target_board is not None
+        if target_index is None:
+            target_index = BoardIndex(target_board)
+
+        source_footprints = group_like_recursive_footprints(src_board, src)
+        source_levels = cls._topology_labels(source_footprints, src_index)
+        target_paths = target_index.paths()
+        target_footprints: List[Optional[pcbnew.FOOTPRINT]] = []
+        for target_path_prefix in target_path_prefixes:
+            instance_footprints = target_paths.footprints_under(target_path_prefix)
+            instance_levels = cls._topology_labels(instance_footprints, target_index, len(source_levels) - 1)
+            correspondence = cls._match_topology(source_footprints, source_levels, instance_footprints, instance_levels)
+            target_footprints.append(correspondence.get_footprint(src_footprint))
+        return target_footprints
+
 
 class PositionTransform():
     """A class that represents a position transform from source to target board.
-    The transform is defined by the source and target anchor footprints and the source and target positions."""
+    The transform is defined by the source and target anchor footprints and the source and target positions.
+    Positions are mapped by an affine transform, target = target_anchor + M (src - source_anchor), where M is the
+    2x2 rotation (and mirroring, if the anchors are on opposite sides) in board coordinates.
+    For orthogonal rotations M is integer, so transforms are exact without trig or rounding."""
+    # (cos, sin) for each quarter-turn, exact
+    _QUARTER_TURN_COS_SIN = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
     def __init__(self, src_anchor: pcbnew.FOOTPRINT, target_anchor: pcbnew.FOOTPRINT) -> None:
-        self._source_anchor_pos = src_anchor.GetPosition()
-        self._source_anchor_rot = src_anchor.GetOrientation().AsRadians()
-        self._source_anchor_flipped = src_anchor.GetSide() != 0
-        self._target_anchor_pos = target_anchor.GetPosition()
-        self._target_anchor_rot = target_anchor.GetOrientation().AsRadians()
-        self._target_anchor_flipped = target_anchor.GetSide() != 0
+        src_pos = src_anchor.GetPosition()
+        target_pos = target_anchor.GetPosition()
+        self._init_transform((src_pos[0], src_pos[1]), src_anchor.GetOrientation().AsRadians(), src_anchor.GetSide() != 0,
+                             (target_pos[0], target_pos[1]), target_anchor.GetOrientation().AsRadians(), target_anchor.GetSide() != 0)
+
+    def _init_transform(self, source_pos: Tuple[int, int], source_rot: float, source_flipped: bool,
+                        target_pos: Tuple[int, int], target_rot: float, target_flipped: bool) -> None:
+        self._source_anchor_pos = source_pos
+        self._source_anchor_rot = source_rot
+        self._source_anchor_flipped = source_flipped
+        self._target_anchor_pos = target_pos
+        self._target_anchor_rot = target_rot
+        self._target_anchor_flipped = target_flipped
+
+        # rotation of the source frame into the target frame, mirrored (about the X axis) if relatively flipped
+        if self.relative_flipped():
+            self._rot = target_rot + source_rot
+        else:
+            self._rot = target_rot - source_rot
+        quarter_turns = self._rot / (math.pi / 2)
+        if abs(quarter_turns - round(quarter_turns)) < 1e-9:  # orthogonal, use exact integers
+            cos, sin = self._QUARTER_TURN_COS_SIN[round(quarter_turns) % 4]
+            self._exact = True
+        else:
+            cos, sin = math.cos(self._rot), math.sin(self._rot)
+            self._exact = False
+        # kicad uses computer graphics coordinates, which has Y increasing downwards, opposite of math conventions
+        if self.relative_flipped():
+            self._m: Tuple[Union[int, float], ...] = (cos, -sin, -sin, -cos)
+        else:
+            self._m = (cos, sin, -sin, cos)
+
+    @classmethod
+    def _from_poses(cls, source_pos: Tuple[int, int], source_rot: float, source_flipped: bool,
+                    target_pos: Tuple[int, int], target_rot: float, target_flipped: bool) -> 'PositionTransform':
+        transform = cls.__new__(cls)
+        transform._init_transform(source_pos, source_rot, source_flipped, target_pos, target_rot, target_flipped)
+        return transform
+
+    @classmethod
+    def to_anchor_frame(cls, anchor: pcbnew.FOOTPRINT) -> 'PositionTransform':
+        """Returns the transform from board coordinates into the anchor's frame, where the anchor is at the origin,
+        unrotated, and on the front side"""
+        pos = anchor.GetPosition()
+        return cls._from_poses((pos[0], pos[1]), anchor.GetOrientation().AsRadians(), anchor.GetSide() != 0,
+                               (0, 0), 0.0, False)
+
+    def compose(self, inner: 'PositionTransform') -> 'PositionTransform':
+        """Returns the transform that applies inner, then this transform.
+        Translations are kept as integer nanometers, so composing orthogonal transforms is exact."""
+        (sx, sy), (tx, ty) = self._source_anchor_pos, self._target_anchor_pos
+        inner_tx, inner_ty = inner._target_anchor_pos
+        a, b, c, d = self._m
+        dx, dy = inner_tx - sx, inner_ty - sy
+        target_pos = (tx + round(a * dx + b * dy), ty + round(c * dx + d * dy))
+        # orientation maps src_rot -> rot + (-1 if flipped else 1) * src_rot, compose those
+        if self.relative_flipped():
+            rot = self._rot - inner._rot
+        else:
+            rot = self._rot + inner._rot
+        return self._from_poses(inner._source_anchor_pos, 0.0, False,
+                                target_pos, rot, self.relative_flipped() != inner.relative_flipped())
+
+    def matrix(self) -> Tuple[Tuple[Union[int, float], ...], Tuple[Union[int, float], ...]]:
+        """Returns the 2x3 affine matrix ((a, b, tx), (c, d, ty)) of this transform, mapping (x, y, 1) to the target.
+        Entries are integers for orthogonal rotations."""
+        a, b, c, d = self._m
+        (sx, sy), (tx, ty) = self._source_anchor_pos, self._target_anchor_pos
+        return ((a, b, tx - (a * sx + b * sy)), (c, d, ty - (c * sx + d * sy)))
+
+    def _transform_xy(self, x: int, y: int) -> Tuple[int, int]:
+        a, b, c, d = self._m
+        dx = x - self._source_anchor_pos[0]
+        dy = y - self._source_anchor_pos[1]
+        if self._exact:
+            return (self._target_anchor_pos[0] + a * dx + b * dy,
+                    self._target_anchor_pos[1] + c * dx + d * dy)
+        else:
+            return (self._target_anchor_pos[0] + round(a * dx + b * dy),
+                    self._target_anchor_pos[1] + round(c * dx + d * dy))
 
     def transform(self, src_pos: pcbnew.VECTOR2I) -> pcbnew.VECTOR2I:
         """Given a source position, return its position in the target"""
-        dx = src_pos[0] - self._source_anchor_pos[0]
-        # kicad uses computer graphics coordinates, which has Y increasing downwards, opposite of math conventions
-        dy = -src_pos[1] + self._source_anchor_pos[1]
-        dist = math.sqrt(dx ** 2 + dy ** 2)
-        # angle in radians from anchor's zero orientation
-        dist_angle = math.atan2(dy, dx)
-        rel_dist_angle = dist_angle - self._source_anchor_rot
-        if self._target_anchor_flipped == self._source_anchor_flipped:
-            target_angle = self._target_anchor_rot + rel_dist_angle
+        return pcbnew.VECTOR2I(*self._transform_xy(src_pos[0], src_pos[1]))
+
+    def transform_many(self, src_points: Any) -> Any:
+        """Given an (N, 2) array-like of source (x, y) points, returns their (x, y) positions in the target.
+        Uses numpy when available, returning an (N, 2) int64 array, otherwise returns a list of tuples."""
+        if np is None:
+            return [self._transform_xy(x, y) for x, y in src_points]
+        points = np.asarray(src_points, dtype=np.int64).reshape(-1, 2)
+        deltas = points - np.array(self._source_anchor_pos, dtype=np.int64)
+        if self._exact:
+            linear = np.array(self._m, dtype=np.int64).reshape(2, 2)
+            offsets = deltas @ linear.T
         else:
-            target_angle = self._target_anchor_rot - rel_dist_angle
-        return pcbnew.VECTOR2I(
-            self._target_anchor_pos[0] + round(math.cos(target_angle) * dist),
-            self._target_anchor_pos[1] - round(math.sin(target_angle) * dist)
-        )
+            linear = np.array(self._m, dtype=np.float64).reshape(2, 2)
+            offsets = np.rint(deltas @ linear.T).astype(np.int64)
+        return offsets + np.array(self._target_anchor_pos, dtype=np.int64)
 
     def transform_orientation(self, src_rot: float) -> float:
         """Given a source rotation (as radians), return its rotation (as radians) in the target"""
@@ -175,6 +529,27 @@ class PositionTransform():
     def relative_flipped(self) -> bool:
         return self._source_anchor_flipped != self._target_anchor_flipped
 
+    def apply_to(self, item: pcbnew.BOARD_ITEM) -> None:
+        """Moves a source item into the target in place, with the item's own mirror, rotate, and move operations,
+        for items whose geometry is more than points (eg, arcs and polygons of graphic shapes).
+        Mirroring also swaps the item to the opposite side layer, as for footprints."""
+        origin = pcbnew.VECTOR2I(0, 0)
+        item.Move(pcbnew.VECTOR2I(-self._source_anchor_pos[0], -self._source_anchor_pos[1]))
+        if self.relative_flipped():  # mirrored about the X axis
+            flip_direction = getattr(pcbnew, 'FLIP_DIRECTION_TOP_BOTTOM', None)
+            if flip_direction is not None:
+                item.Flip(origin, flip_direction)
+            else:  # older KiCad versions take aFlipLeftRight
+                item.Flip(origin, False)
+        item.Rotate(origin, pcbnew.EDA_ANGLE(self._rot, pcbnew.RADIANS_T))
+        item.Move(pcbnew.VECTOR2I(*self._target_anchor_pos))
+
+    def signature(self) -> List[Any]:
+        """Returns a JSON-serializable summary of this transform, equal for transforms that map positions,
+        orientations, and flips identically"""
+        (a, b, tx), (c, d, ty) = self.matrix()
+        return [a, b, tx, c, d, ty, self._rot, self.relative_flipped()]
+
 
 class ReplicateResult(NamedTuple):
     """Result of replicate, including nonfatal errors"""
@@ -184,6 +559,17 @@ class ReplicateResult(NamedTuple):
     source_footprints_unused: List[pcbnew.FOOTPRINT]
     zones_missing_netcode: List[pcbnew.ZONE]
     tracks_missing_netcode: List[pcbnew.PCB_TRACK]
+    # target zones whose source fill could not be preserved (with preserve_fills) because of foreign copper nearby,
+    # so were left unfilled; not errors, but these need a refill
+    zones_unfilled: List[pcbnew.ZONE]
+    # (replicated item, item outside the instance) pairs of copper on a shared layer and different nets that overlap,
+    # which would be shorts
+    copper_overlaps: List[Tuple[pcbnew.BOARD_CONNECTED_ITEM, pcbnew.BOARD_CONNECTED_ITEM]]
+    # pairs as above whose bounding boxes overlap, where exact shapes are not available in this KiCad version,
+    # so may or may not touch
+    possible_copper_overlaps: List[Tuple[pcbnew.BOARD_CONNECTED_ITEM, pcbnew.BOARD_CONNECTED_ITEM]]
+
+    timings: Dict[str, float]  # per-phase durations in seconds, empty unless instrumentation is enabled
 
     def get_error_strs(self) -> List[str]:
         """Returns (nonfatal) errors during replication as a list of strings, to propagate to the user.
@@ -201,31 +587,284 @@ class ReplicateResult(NamedTuple):
         if self.tracks_missing_netcode:
             net_names = ', '.join(sorted(list(set([track.GetNet().GetNetname() for track in self.tracks_missing_netcode]))))
             error_strs.append(f"{len(self.tracks_missing_netcode)} tracks failed to replicate nets: {net_names}")
+        if self.copper_overlaps:
+            net_pairs = ', '.join(sorted(set([f"{item.GetNetname() or '(no net)'} / {other.GetNetname() or '(no net)'}"
+                                              for item, other in self.copper_overlaps])))
+            error_strs.append(f"{len(self.copper_overlaps)} replicated items overlap copper of other nets: {net_pairs}")
+        if self.possible_copper_overlaps:
+            net_pairs = ', '.join(sorted(set([f"{item.GetNetname() or '(no net)'} / {other.GetNetname() or '(no net)'}"
+                                              for item, other in self.possible_copper_overlaps])))
+            error_strs.append(f"{len(self.possible_copper_overlaps)} replicated items possibly overlap copper of other "
+                              f"nets (bounding box only): {net_pairs}")
         return error_strs
 
 
+class PlanFootprint(NamedTuple):
+    """A source footprint in a replication plan, with its placement in source board coordinates"""
+    footprint: pcbnew.FOOTPRINT
+    item_id: str
+    reference: str
+    position: Tuple[int, int]
+    orientation: float  # radians
+    flipped: bool
+
+
+class PlanTrack(NamedTuple):
+    """A source track (or via) in a replication plan, with its geometry in source board coordinates"""
+    track: pcbnew.PCB_TRACK
+    item_id: str
+    netcode: int
+    start: Tuple[int, int]
+    end: Tuple[int, int]
+    layer: int
+    properties: Tuple[Any, ...]  # other properties copied by replication (width, via drill, ...), to detect changes
+
+
+class PlanZone(NamedTuple):
+    """A source zone in a replication plan, with its outline in source board coordinates"""
+    zone: pcbnew.ZONE
+    item_id: str
+    netcode: int
+    corners: List[Tuple[int, int]]
+    on_front: bool  # whether the zone is on the outer copper layers, which are flipped as needed
+    on_back: bool
+    properties: Tuple[Any, ...]  # other properties copied by replication (layers, clearance, ...), to detect changes
+
+
+class PlanShape(NamedTuple):
+    """A source graphic shape in a replication plan, with a summary of its geometry in source board coordinates"""
+    shape: pcbnew.PCB_SHAPE
+    item_id: str
+    geometry: Tuple[Any, ...]  # shape type, layer, width, fill, and defining points, to detect changes
+
+
+class PlanGroup(NamedTuple):
+    """A source group (or the top-level grouplike) in a replication plan"""
+    items: List[Union['PlanGroup', PlanFootprint, PlanTrack, PlanZone, PlanShape]]
+    group_id: str  # empty for the top-level grouplike
+
+
+class ReplicationPlan():
+    """Source-side data for replication, compiled once from a source grouplike so it can be applied to
+    many target instances without re-reading the source board.
+    Holds the source group tree, item geometry (relative to the source board, since the source anchor is
+    determined per-instance from the correspondence), and the source board index.
+    Can be used as the source grouplike for FootprintCorrespondence functions.
+    Item ids in the plan may be remapped with stable_ids (live id -> stable id), for source boards rebuilt from
+    snapshots, so records of replication stay valid across rebuilds.
+    Graphic shapes are only part of the plan if include_region is set, as for selections with the region included."""
+    # getters of the track and zone properties copied by replication, besides geometry and net, for fingerprinting.
+    # Getters not applicable to an item (eg, via drill of a track) or not available in the KiCad version are skipped.
+    TRACK_PROPERTIES = ['GetClass', 'GetWidth', 'GetMid', 'GetViaType', 'GetDrillValue', 'TopLayer', 'BottomLayer',
+                        'GetLayerSet', 'GetRemoveUnconnected', 'GetKeepStartEnd', 'IsLocked']
+    ZONE_PROPERTIES = ['GetLayerSet', 'GetZoneName', 'GetAssignedPriority', 'GetPriority', 'GetLocalClearance',
+                       'GetMinThickness', 'GetPadConnection', 'GetThermalReliefGap', 'GetThermalReliefSpokeWidth',
+                       'GetFillMode', 'GetHatchThickness', 'GetHatchGap', 'GetHatchOrientation',
+                       'GetHatchSmoothingLevel', 'GetHatchSmoothingValue', 'GetHatchBorderAlgorithm',
+                       'GetHatchHoleMinArea', 'GetIslandRemovalMode', 'GetMinIslandArea', 'GetCornerSmoothingType',
+                       'GetCornerRadius', 'GetHatchStyle', 'GetBorderHatchPitch', 'GetIsRuleArea',
+                       'GetDoNotAllowCopperPour', 'GetDoNotAllowVias', 'GetDoNotAllowTracks', 'GetDoNotAllowPads',
+                       'GetDoNotAllowFootprints', 'IsLocked']
+
+    def __init__(self, src_board: pcbnew.BOARD, src: GroupLike, index: Optional[BoardIndex] = None,
+                 stable_ids: Optional[Dict[str, str]] = None, include_region: bool = False) -> None:
+        self.src_board = src_board
+        self.include_region = include_region
+        if index is None:
+            index = BoardIndex(src_board)
+        self.index = index
+        self._stable_ids = stable_ids if stable_ids is not None else {}
+        self.footprints: List[pcbnew.FOOTPRINT] = []  # all source footprints, recursively, in group order
+        self._fill_signatures: Dict[str, str] = {}  # by plan item id, computed on first use
+        self.root = self._compile_group(src, '')
+
+    def _item_id(self, live_id: str) -> str:
+        return self._stable_ids.get(live_id, live_id)
+
+    @staticmethod
+    def _property_value(value: Any) -> Any:
+        """Converts a property value to a plain value with a stable repr (SWIG proxies repr with their address)"""
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        elif hasattr(value, 'AsDegrees'):  # EDA_ANGLE
+            return value.AsDegrees()
+        elif hasattr(value, 'Seq'):  # LSET
+            return tuple(value.Seq())
+        elif hasattr(value, 'x') and hasattr(value, 'y'):  # VECTOR2I
+            return (value.x, value.y)
+        else:
+            return type(value).__name__
+
+    @classmethod
+    def _item_properties(cls, item: pcbnew.BOARD_ITEM, getters: List[str]) -> Tuple[Any, ...]:
+        properties = []
+        for getter in getters:
+            try:
+                value = getattr(item, getter)()
+            except (AttributeError, TypeError):  # not applicable to this item, or not available in this KiCad version
+                value = None
+            properties.append(cls._property_value(value))
+        return tuple(properties)
+
+    def fill_signature(self, zone: PlanZone) -> str:
+        """Returns a digest of the source zone fill, so preserved fills are re-replicated when the source is refilled.
+        Cached, since fills are only read once per plan."""
+        signature = self._fill_signatures.get(zone.item_id)
+        if signature is None:
+            digest = hashlib.sha1()
+            for layer in zone.zone.GetLayerSet().Seq():
+                if hasattr(zone.zone, 'HasFilledPolysForLayer') and not zone.zone.HasFilledPolysForLayer(layer):
+                    continue
+                fill = zone.zone.GetFilledPolysList(layer)  # type: pcbnew.SHAPE_POLY_SET
+                digest.update(repr(layer).encode('utf-8'))
+                for outline_index in range(fill.OutlineCount()):
+                    contours = [fill.Outline(outline_index)] + \
+                        [fill.Hole(outline_index, hole_index) for hole_index in range(fill.HoleCount(outline_index))]
+                    for contour in contours:
+                        points = [contour.CPoint(point_index) for point_index in range(contour.PointCount())]
+                        digest.update(repr([(point[0], point[1]) for point in points]).encode('utf-8'))
+            signature = digest.hexdigest()
+            self._fill_signatures[zone.item_id] = signature
+        return signature
+
+    @staticmethod
+    def _shape_geometry(shape: pcbnew.PCB_SHAPE) -> Tuple[Any, ...]:
+        points = [shape.GetStart(), shape.GetEnd()]
+        shape_type = shape.GetShape()
+        if shape_type == pcbnew.SHAPE_T_ARC:
+            points.append(shape.GetArcMid())
+        elif shape_type == pcbnew.SHAPE_T_BEZIER:
+            points.extend([shape.GetBezierC1(), shape.GetBezierC2()])
+        elif shape_type == pcbnew.SHAPE_T_POLY:
+            poly = shape.GetPolyShape()  # type: pcbnew.SHAPE_POLY_SET
+            for outline_index in range(poly.OutlineCount()):
+                outline = poly.COutline(outline_index)
+                points.extend(outline.CPoint(point_index) for point_index in range(outline.PointCount()))
+        return (int(shape_type), shape.GetLayer(), shape.GetWidth(), shape.IsFilled(),
+                tuple((point[0], point[1]) for point in points))
+
+    def _compile_group(self, grouplike: GroupLike, this_group_id: str) -> PlanGroup:
+        items: List[Union[PlanGroup, PlanFootprint, PlanTrack, PlanZone, PlanShape]] = []
+        for item in group_like_items(self.src_board, grouplike, self.include_region):
+            if isinstance(item, PcbGroupType):
+                items.append(self._compile_group(item, self._item_id(group_id(item))))
+            elif isinstance(item, pcbnew.FOOTPRINT):
+                self.footprints.append(item)
+                pos = item.GetPosition()
+                items.append(PlanFootprint(item, self._item_id(BoardUtils.item_id(item)), item.GetReferenceAsString(),
+                                           (pos[0], pos[1]), item.GetOrientation().AsRadians(), item.GetSide() != 0))
+            elif isinstance(item, pcbnew.PCB_TRACK):
+                start = item.GetStart()
+                end = item.GetEnd()
+                items.append(PlanTrack(item, self._item_id(BoardUtils.item_id(item)), item.GetNetCode(),
+                                       (start[0], start[1]), (end[0], end[1]), item.GetLayer(),
+                                       self._item_properties(item, self.TRACK_PROPERTIES)))
+            elif isinstance(item, pcbnew.ZONE):
+                corners = []
+                for i in range(item.GetNumCorners()):
+                    corner = item.GetCornerPosition(i)
+                    corners.append((corner[0], corner[1]))
+                layers = item.GetLayerSet()  # type: pcbnew.LSET
+                items.append(PlanZone(item, self._item_id(BoardUtils.item_id(item)), item.GetNetCode(), corners,
+                                      layers.Contains(pcbnew.F_Cu), layers.Contains(pcbnew.B_Cu),
+                                      self._item_properties(item, self.ZONE_PROPERTIES)))
+            elif isinstance(item, pcbnew.PCB_SHAPE):
+                if not self.include_region:  # graphics in groups, not part of the layout without the region
+                    continue
+                items.append(PlanShape(item, self._item_id(BoardUtils.item_id(item)), self._shape_geometry(item)))
+            else:
+                raise ValueError(f'unsupported item type {type(item)} in group-like {grouplike}')
+        return PlanGroup(items, this_group_id)
+
+    def replicate_many(self, target_board: pcbnew.BOARD, targets: List[Tuple[pcbnew.FOOTPRINT, Tuple[str, ...]]],
+                       correspondence_fn: CorrespondenceFn,
+                       purge: bool = False, target_index: Optional[BoardIndex] = None,
+                       record: Optional[ReplicationRecord] = None,
+                       preserve_fills: bool = False,
+                       batch: Optional[BoardBatch] = None) -> List['ReplicateResult']:
+        """Replicates this plan into each of the targets, as (target anchor, target path prefix).
+        If purge is set, replicate-able items in each target LCA are deleted first, see ReplicateSublayout.purge_lca.
+        If a record is given, targets with a previous record are updated incrementally, unless purge is set, where
+        the previously replicated items are deleted too and the target is replicated in full.
+        The record is updated with this replication.
+        If preserve_fills is set, source zone fills are transformed into the targets, see ReplicateSublayout.replicate.
+        All targets are mutated through one batch, with connectivity rebuilt once at the end. If a batch is given,
+        mutations are made through it instead, to be finalized by the caller.
+        Returns one result per target, in order."""
+        if target_index is None:
+            if target_board is self.src_board:
+                target_index = self.index
+            else:
+                target_index = BoardIndex(target_board)
+
+        own_batch = batch is None
+        if batch is None:
+            batch = BoardBatch(target_board, target_index)
+        results = []
+        for target_anchor, target_path_prefix in targets:
+            replicate = ReplicateSublayout(self.src_board, self, target_board, target_anchor, target_path_prefix,
+                                           correspondence_fn, self.index, target_index, batch)
+            previous = record.instance(target_path_prefix) if record is not None else None
+            if purge:
+                if previous is not None:  # including those outside the LCA (eg, in a group created for them)
+                    replicate.purge_previous(previous)
+                    previous = None
+                replicate.purge_lca()
+            results.append(replicate.replicate(previous, preserve_fills))
+            if record is not None:
+                record.set_instance(target_path_prefix, replicate.record())
+        if own_batch:
+            batch.finalize()
+        return results
+
+
 class ReplicateSublayout():
     """A class that represents a correspondence between a source board and a target board with anchor footprint
     and replication hierarchy level. The source anchor footprint is determined automatically.
-    Computes correspondences on __init__, but replication is done explicitly."""
+    Computes correspondences on __init__, but replication is done explicitly.
+    The source may be a precompiled ReplicationPlan, to share source-side work across instances."""
     def __init__(self,
                  src_board: pcbnew.BOARD,
                  src: GroupLike,
                  target_board: pcbnew.BOARD, target_anchor: pcbnew.FOOTPRINT,
                  target_path_prefix: Tuple[str, ...],
-                 correspondence_fn: Callable[[pcbnew.BOARD, GroupLike, pcbnew.BOARD, Tuple[str, ...]], FootprintCorrespondence]) -> None:
+                 correspondence_fn: CorrespondenceFn,
+                 src_index: Optional[BoardIndex] = None, target_index: Optional[BoardIndex] = None,
+                 batch: Optional[BoardBatch] = None, include_region: bool = False) -> None:
+        """Board indices may be passed in to be shared across instances, otherwise they are built here.
+        include_region is used to compile the source, unless it is a ReplicationPlan, see ReplicationPlan.
+        A batch may be passed in to share target mutations across instances, to be finalized by the caller,
+        otherwise the batch is finalized at the end of replicate. A batch passed in must keep the target index
+        (if given) up to date."""
         self._src_board = src_board
-        self._src = src
         self._target_board = target_board
         self._target_anchor = target_anchor
         self._target_path_prefix = target_path_prefix
+        self._timings = telemetry.Timings()
+        self._record: Optional[InstanceRecord] = None
+        self._owns_batch = batch is None
+        # ids of target copper of this instance, built on first use per replicate, see _instance_copper_ids
+        self._instance_ids: Optional[Set[str]] = None
 
-        self._correspondences = correspondence_fn(self._src_board, self._src, self._target_board, self._target_path_prefix)
-        correspondences_by_tstamp = {  # TODO use FootprintCorrespondence methods to map
-            BoardUtils.footprint_path(target_footprint): src_footprint
-            for src_footprint, target_footprint in self._correspondences.mapped_footprints
-        }
-        self._source_anchor = correspondences_by_tstamp.get(BoardUtils.footprint_path(self._target_anchor))
+        if isinstance(src, ReplicationPlan):
+            self._plan = src
+        else:
+            with telemetry.collecting(self._timings), telemetry.span('plan'):
+                self._plan = ReplicationPlan(src_board, src, src_index, include_region=include_region)
+        self._src_index = self._plan.index
+        if target_index is None:
+            if target_board is src_board:
+                target_index = self._src_index
+            else:
+                target_index = BoardIndex(target_board)
+        self._target_index = target_index
+        self._batch = batch if batch is not None else BoardBatch(target_board, target_index)
+        target_paths = self._target_index.paths()
+
+        with telemetry.collecting(self._timings), telemetry.span('correspondence'):
+            self._correspondences = correspondence_fn(self._src_board, self._plan, self._target_board,
+                                                      self._target_path_prefix, self._src_index, self._target_index)
+        self._source_anchor = self._correspondences.get_source_footprint(self._target_anchor)
         assert self._source_anchor is not None, "could not find source anchor footprint in source board"
         self._transform = PositionTransform(self._source_anchor, target_anchor)
 
@@ -233,50 +872,283 @@ class ReplicateSublayout():
         target_footprints = [target_footprint for src_footprint, target_footprint
                              in self._correspondences.mapped_footprints] \
                             + self._correspondences.target_only_footprints
-        target_groups = [GroupWrapper(target_board, target_footprint.GetParentGroup()) for target_footprint in target_footprints]
-        target_groups_lca = GroupWrapper.lowest_common_ancestor(target_groups)
+        with telemetry.collecting(self._timings), telemetry.span('lca'):
+            target_groups = [GroupWrapper(target_board, target_footprint.GetParentGroup())
+                             for target_footprint in target_footprints]
+            target_groups_lca = GroupWrapper.lowest_common_ancestor(target_groups, self._target_index.groups())
 
         if target_groups_lca is not None and all(
-            [BoardUtils.footprint_path_startswith(item, self._target_path_prefix)
+            [target_paths.path_startswith(item, self._target_path_prefix)
              for item in target_groups_lca.recursive_items() if isinstance(item, pcbnew.FOOTPRINT)]):
             self._target_group: Optional[PcbGroupType] = target_groups_lca._group
         else:
             self._target_group = None
 
-    @staticmethod
-    def _get_netcode_pads(board: pcbnew.BOARD, netcode: int) -> List[Tuple[pcbnew.FOOTPRINT, pcbnew.PAD]]:
-        """Returns all pads in the target board with the given netcode"""
-        pads = []
-        for footprint in board.GetFootprints():
-            for pad in footprint.Pads():
-                if pad.GetNetCode() == netcode:
-                    pads.append((footprint, pad))
-        return pads
+    def _build_net_map(self) -> Dict[int, int]:
+        """Returns the source netcode -> target netcode table for this instance, computed from the pads of
+        corresponding footprints. Source nets that do not resolve to exactly one target net are omitted."""
+        target_netcodes_by_src: Dict[int, Set[int]] = {}
+        for src_footprint, target_footprint in self._correspondences.mapped_footprints:
+            for pad_number, src_netcode in self._src_index.nets().footprint_pads(src_footprint):
+                if src_netcode == 0:
+                    continue
+                target_netcodes = target_netcodes_by_src.setdefault(src_netcode, set())
+                target_netcode = self._target_index.nets().pad_netcode(target_footprint, pad_number)
+                if target_netcode is not None:
+                    target_netcodes.add(target_netcode)
+        return {src_netcode: list(target_netcodes)[0]
+                for src_netcode, target_netcodes in target_netcodes_by_src.items()
+                if len(target_netcodes) == 1}
 
     def target_lca(self) -> Optional[PcbGroupType]:
         """Returns the lowest common ancestor of the target footprints, or None if there is none"""
         return self._target_group
 
-    def purge_lca(self) -> None:
-        """Deletes replicate-able items (excluding footprints) from the LCA"""
-        def recurse_group(group: PcbGroupType) -> None:
-            """Recursively deletes all items in the group."""
-            for item in GroupWrapper(self._target_board, group).items():
-                if isinstance(item, PcbGroupType):
-                    recurse_group(item)
-                if isinstance(item, (pcbnew.PCB_TRACK, pcbnew.ZONE)):
-                    self._target_board.Delete(item)
-        if self._target_group is not None:
-            recurse_group(self._target_group)
-
-    def replicate(self) -> ReplicateResult:
-        if self._target_group is not None:
-            target_group = self._target_group
-        else:  # otherwise, create new group in root
-            target_group = pcbnew.PCB_GROUP(self._target_board)
-            self._target_board.Add(target_group)
-
-        result = ReplicateResult(target_group, [], [], [], [])
+    def purge_lca(self) -> int:
+        """Deletes replicate-able items (excluding footprints) from the LCA, returning the number deleted.
+        Graphic shapes are only deleted if the plan includes the region, and only those in the target region,
+        so graphics that would not be replicated (eg, fab notes grouped with the block) are left in place."""
+        if self._target_group is None:
+            return 0
+        with telemetry.collecting(self._timings), telemetry.span('purge_lca'):
+            region_shape_ids: Set[str] = set()
+            if self._plan.include_region:
+                target_footprints = self._target_index.paths().footprints_under(self._target_path_prefix)
+                selector = HierarchySelector(self._target_board, self._target_path_prefix, self._target_index, True)
+                region_shape_ids = {BoardUtils.item_id(item) for item in selector.region_items(target_footprints, set())
+                                    if isinstance(item, pcbnew.PCB_SHAPE)}
+            return self._batch.remove_all(
+                item for item in GroupWrapper(self._target_board, self._target_group).recursive_items()
+                if isinstance(item, (pcbnew.PCB_TRACK, pcbnew.ZONE))
+                or (isinstance(item, pcbnew.PCB_SHAPE) and BoardUtils.item_id(item) in region_shape_ids))
+
+    def replicate(self, previous: Optional[InstanceRecord] = None, preserve_fills: bool = False) -> ReplicateResult:
+        """Replicates the source into the target. If a previous record of replication into this target is given,
+        only source changes since then are applied: unchanged items are skipped, changed items are replaced,
+        and target items of deleted source items are deleted. If the transform changed, previously replicated
+        items are deleted and everything is replicated again.
+        Replicated zones are unfilled, unless preserve_fills is set, where the source fill is transformed along with
+        the outline and marked valid. Zones with copper from outside the instance on other nets within their bounds
+        (where the source fill would not be valid) are still unfilled, and reported in the result.
+        Replicated tracks, vias, and filled zones are then checked against copper outside the instance, and overlaps
+        on a shared layer with a different net are reported in the result, without needing a full DRC.
+        The record of this replication is available from record() afterwards."""
+        with telemetry.collecting(self._timings), telemetry.span('replicate'):
+            result = self._replicate(previous, preserve_fills)
+            if self._owns_batch:
+                with telemetry.span('replicate.finalize'):
+                    self._batch.finalize()
+        telemetry.record('replicate', self._target_board, self._timings,
+                         mapped_footprints=len(self._correspondences.mapped_footprints),
+                         source_footprints=len(self._plan.footprints),
+                         errors=len(result.get_error_strs()))
+        return result
+
+    def record(self) -> InstanceRecord:
+        """Returns the record of the last replicate, for incremental replication later"""
+        assert self._record is not None, "replicate not run"
+        return self._record
+
+    @staticmethod
+    def _fingerprint(*data: Any) -> str:
+        return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
+
+    def _resolve_previous(self, previous: Optional[InstanceRecord], target_id: Optional[str]) \
+            -> Optional[pcbnew.BOARD_ITEM]:
+        if previous is None or target_id is None:
+            return None
+        return BoardUtils.resolve_item(self._target_board, target_id)
+
+    def _delete_previous(self, previous: InstanceRecord, keep_item_ids: Set[str], keep_group_ids: Set[str]) -> int:
+        """Deletes target items and groups from a previous replication, except those kept.
+        Remaining members of deleted groups (eg, footprints) are left in place."""
+        doomed = [BoardUtils.resolve_item(self._target_board, target_id)
+                  for src_id, (fingerprint, target_id) in previous.items.items() if target_id not in keep_item_ids]
+        doomed.extend(BoardUtils.resolve_item(self._target_board, target_id)
+                      for src_id, target_id in previous.groups.items() if target_id not in keep_group_ids)
+        return self._batch.remove_all(item for item in doomed if item is not None)
+
+    @staticmethod
+    def _target_fingerprint(item: pcbnew.BOARD_ITEM) -> str:
+        """Returns a fingerprint of a target track, zone, or shape as it is on the board (geometry, layers, net,
+        and copied properties), to detect edits in the target since it was written. Zone fills are not included,
+        since refilling is not an edit. Nets are by name, since netcodes are renumbered when the board is loaded."""
+        if isinstance(item, pcbnew.PCB_TRACK):
+            start = item.GetStart()
+            end = item.GetEnd()
+            data: Tuple[Any, ...] = ((start[0], start[1]), (end[0], end[1]), item.GetLayer(), item.GetNetname(),
+                                     ReplicationPlan._item_properties(item, ReplicationPlan.TRACK_PROPERTIES))
+        elif isinstance(item, pcbnew.ZONE):
+            corners = [item.GetCornerPosition(i) for i in range(item.GetNumCorners())]
+            data = (tuple((corner[0], corner[1]) for corner in corners), item.GetNetname(),
+                    ReplicationPlan._item_properties(item, ReplicationPlan.ZONE_PROPERTIES))
+        else:
+            data = ReplicationPlan._shape_geometry(item)
+        return ReplicateSublayout._fingerprint(*data)
+
+    def purge_previous(self, previous: InstanceRecord) -> int:
+        """Deletes the items and groups (except the target LCA) of a previous replication into this target, returning
+        the number deleted. Remaining members of deleted groups (eg, footprints) are left in place."""
+        keep_group_ids = {group_id(self._target_group)} if self._target_group is not None else set()
+        with telemetry.collecting(self._timings), telemetry.span('purge_previous'):
+            return self._delete_previous(previous, set(), keep_group_ids)
+
+    def _reuse_previous(self, previous: Optional[InstanceRecord], src_id: str, fingerprint: str,
+                        record: InstanceRecord) -> bool:
+        """If the source item is unchanged since the previous replication and its target item still exists unedited,
+        records it as replicated and returns True, so it can be skipped"""
+        if previous is None:
+            return False
+        previous_entry = previous.items.get(src_id)
+        if previous_entry is None or previous_entry[0] != fingerprint:
+            return False
+        target_item = self._resolve_previous(previous, previous_entry[1])
+        if target_item is None:  # deleted from the target since
+            return False
+        target_fingerprint = previous.targets.get(previous_entry[1])
+        if target_fingerprint is None or target_fingerprint != self._target_fingerprint(target_item):
+            return False  # edited in the target since (eg, moved or re-netted), replaced by a new clone
+        record.items[src_id] = previous_entry
+        record.targets[previous_entry[1]] = target_fingerprint
+        return True
+
+    def _transform_layer(self, layer: int) -> int:
+        """Returns the target layer of a source layer, flipping the outer copper layers as needed"""
+        if layer in (pcbnew.F_Cu, pcbnew.B_Cu) and self._transform.relative_flipped():
+            return pcbnew.B_Cu if layer == pcbnew.F_Cu else pcbnew.F_Cu
+        return layer
+
+    def _instance_copper_ids(self) -> Set[str]:
+        """Returns the ids of target copper belonging to this instance, which is not foreign copper: pads of the
+        instance's footprints and items in the target group. Computed once per replicate, from the instance only."""
+        if self._instance_ids is None:
+            self._instance_ids = set()
+            if self._target_group is not None:
+                self._instance_ids.update(BoardUtils.item_id(item) for item
+                                          in GroupWrapper(self._target_board, self._target_group).recursive_items()
+                                          if not isinstance(item, PcbGroupType))
+            instance_footprints = [target_footprint for src_footprint, target_footprint
+                                   in self._correspondences.mapped_footprints] \
+                                  + self._correspondences.target_only_footprints
+            for footprint in instance_footprints:
+                self._instance_ids.update(BoardUtils.item_id(pad) for pad in footprint.Pads())
+        return self._instance_ids
+
+    def _foreign_copper(self, bbox: BoundingBox, instance_item_ids: Set[str]) -> List[pcbnew.BOARD_CONNECTED_ITEM]:
+        """Returns copper (pads, tracks, and zones) on the target board outside this instance whose bounding box
+        intersects the bounding box, excluding the instance's own copper and the given items, from the target
+        board's spatial indices (shared across instances, and kept up to date by the batch)"""
+        exclude_ids = self._instance_copper_ids()
+        items: List[pcbnew.BOARD_CONNECTED_ITEM] = [
+            pad for pad in self._target_index.pads().query(bbox) if BoardUtils.item_id(pad) not in exclude_ids]
+        for item in self._target_index.spatial().query(bbox):
+            if isinstance(item, pcbnew.PCB_SHAPE) or (isinstance(item, pcbnew.ZONE) and item.GetIsRuleArea()):
+                continue
+            item_id = BoardUtils.item_id(item)
+            if item_id not in exclude_ids and item_id not in instance_item_ids:
+                items.append(item)
+        return items
+
+    def _has_foreign_copper(self, bbox: BoundingBox, layers: Set[int], netcode: int,
+                            instance_item_ids: Set[str]) -> bool:
+        """Returns whether any copper on the target board outside this instance, on a different net, overlaps the
+        bounding box on any of the layers"""
+        for item in self._foreign_copper(bbox, instance_item_ids):
+            if item.GetNetCode() != netcode and not layers.isdisjoint(item.GetLayerSet().Seq()):
+                return True
+        return False
+
+    @staticmethod
+    def _copper_collides(item: pcbnew.BOARD_CONNECTED_ITEM, other: pcbnew.BOARD_CONNECTED_ITEM,
+                         layers: Set[int]) -> Optional[bool]:
+        """Returns whether the copper of two items (with overlapping bounding boxes) touches on any of the layers,
+        by their exact shapes, or None if the KiCad version does not provide them"""
+        for layer in layers:
+            try:
+                if item.GetEffectiveShape(layer).Collide(other.GetEffectiveShape(layer), 0):
+                    return True
+            except (AttributeError, TypeError):  # shapes not available, only the bounding boxes are known to overlap
+                return None
+        return False
+
+    def _find_copper_overlaps(self, items: List[pcbnew.BOARD_CONNECTED_ITEM], instance_item_ids: Set[str]) \
+            -> Tuple[List[Tuple[pcbnew.BOARD_CONNECTED_ITEM, pcbnew.BOARD_CONNECTED_ITEM]],
+                     List[Tuple[pcbnew.BOARD_CONNECTED_ITEM, pcbnew.BOARD_CONNECTED_ITEM]]]:
+        """Returns (replicated item, foreign item) pairs where replicated tracks, vias, and filled zones overlap copper
+        outside this instance on a shared layer and a different net, and pairs that possibly overlap (by bounding box,
+        where exact shapes are not available). Foreign zones are not checked, since their fill is recomputed around the
+        replicated copper on refill."""
+        overlaps = []
+        possible_overlaps = []
+        for item in items:
+            if isinstance(item, pcbnew.ZONE) and not item.IsFilled():
+                continue
+            layers = set(item.GetLayerSet().Seq())
+            for other in self._foreign_copper(item_bbox(item), instance_item_ids):
+                if isinstance(other, pcbnew.ZONE) or other.GetNetCode() == item.GetNetCode():
+                    continue
+                shared_layers = layers.intersection(other.GetLayerSet().Seq())
+                if not shared_layers:
+                    continue
+                collides = self._copper_collides(item, other, shared_layers)
+                if collides is None:
+                    possible_overlaps.append((item, other))
+                elif collides:
+                    overlaps.append((item, other))
+        return overlaps, possible_overlaps
+
+    def _transform_fill(self, src_zone: pcbnew.ZONE, target_zone: pcbnew.ZONE) -> None:
+        """Sets the target zone fill to the source zone fill, transformed, and marks it as valid"""
+        for layer in src_zone.GetLayerSet().Seq():
+            if hasattr(src_zone, 'HasFilledPolysForLayer') and not src_zone.HasFilledPolysForLayer(layer):
+                continue
+            src_fill = src_zone.GetFilledPolysList(layer)  # type: pcbnew.SHAPE_POLY_SET
+            target_fill = pcbnew.SHAPE_POLY_SET()
+            for outline_index in range(src_fill.OutlineCount()):
+                contours = [(False, src_fill.Outline(outline_index))] + \
+                    [(True, src_fill.Hole(outline_index, hole_index))
+                     for hole_index in range(src_fill.HoleCount(outline_index))]
+                for is_hole, contour in contours:
+                    if is_hole:
+                        target_fill.NewHole()
+                    else:
+                        target_fill.NewOutline()
+                    points = [contour.CPoint(point_index) for point_index in range(contour.PointCount())]
+                    for x, y in self._transform.transform_many([(point[0], point[1]) for point in points]):
+                        target_fill.Append(int(x), int(y))
+            target_layer = self._transform_layer(layer)
+            target_zone.SetFilledPolysList(target_layer, target_fill)
+            try:
+                target_zone.CacheTriangulation(target_layer)  # for rendering, done by the zone filler otherwise
+            except (AttributeError, TypeError):  # not needed or not available in this KiCad version
+                pass
+        target_zone.SetIsFilled(True)
+        target_zone.SetNeedRefill(False)
+
+    def _replicate(self, previous: Optional[InstanceRecord], preserve_fills: bool) -> ReplicateResult:
+        transform_signature = self._transform.signature()
+        if previous is not None and previous.transform != transform_signature:
+            # placement changed, so every item needs to be re-placed: remove what was replicated before,
+            # but keep groups (which have no geometry) for reuse
+            self._delete_previous(previous, set(), set(previous.groups.values()))
+            previous = InstanceRecord.empty(previous.transform)._replace(groups=previous.groups)
+        record = InstanceRecord.empty(transform_signature)
+        self._record = record
+        self._instance_ids = None
+        placed: List[pcbnew.BOARD_CONNECTED_ITEM] = []  # copper placed by this replicate, checked for overlaps
+        written: List[pcbnew.BOARD_ITEM] = []  # all items cloned by this replicate, fingerprinted at the end
+
+        target_group = self._resolve_previous(previous, previous.groups.get('') if previous is not None else None)
+        if target_group is None:
+            if self._target_group is not None:
+                target_group = self._target_group
+            else:  # otherwise, create new group in root
+                target_group = pcbnew.PCB_GROUP(self._target_board)
+                self._batch.add(target_group)
+        record.groups[''] = group_id(target_group)
+
+        # shares this instance's timings, so the enclosing replicate span is included once it completes
+        result = ReplicateResult(target_group, [], [], [], [], [], [], [], self._timings.durations)
         result.target_footprints_missing_source.extend(self._correspondences.target_only_footprints)
 
         # iterate through all elements in source board, by group, replicating tracks and stuff, recursively
@@ -284,82 +1156,155 @@ class ReplicateSublayout():
             src_footprint.GetReferenceAsString(): target_footprint
             for src_footprint, target_footprint in self._correspondences.mapped_footprints
         }
-        def recurse_group(source_group: GroupLike,
-                          target_group: PcbGroupType) -> None:
-            for item in group_like_items(self._src_board, source_group):
-                if isinstance(item, PcbGroupType):
-                    new_group = pcbnew.PCB_GROUP(self._target_board)
-                    self._target_board.Add(new_group)
-                    target_group.AddItem(new_group)
+        with telemetry.span('replicate.net_map'):
+            net_map = self._build_net_map()
+        timing = telemetry.enabled()  # per-item timings, only read the clock if they are recorded
+        def recurse_group(source_group: PlanGroup, target_group: PcbGroupType) -> None:
+            for item in source_group.items:
+                start = time.perf_counter() if timing else 0.0
+                if isinstance(item, PlanGroup):
+                    new_group = self._resolve_previous(previous, previous.groups.get(item.group_id)
+                                                       if previous is not None else None)
+                    if new_group is None:
+                        new_group = pcbnew.PCB_GROUP(self._target_board)
+                        self._batch.add(new_group)
+                        target_group.AddItem(new_group)
+                    record.groups[item.group_id] = group_id(new_group)
                     recurse_group(item, new_group)
-                elif isinstance(item, pcbnew.FOOTPRINT):  # move footprints without replacing
-                    target_footprint = target_footprint_by_src_refdes.get(item.GetReferenceAsString())
+                elif isinstance(item, PlanFootprint):  # move footprints without replacing
+                    target_footprint = target_footprint_by_src_refdes.get(item.reference)
                     if target_footprint is None:
-                        result.source_footprints_unused.append(item)
+                        result.source_footprints_unused.append(item.footprint)
                         continue
+                    target_position = self._transform.transform(item.position)
+                    record_entry = (self._fingerprint(item.position, item.orientation, item.flipped,
+                                                      source_group.group_id),
+                                    BoardUtils.item_id(target_footprint))
+                    record.footprints[item.item_id] = record_entry
+                    if previous is not None and previous.footprints.get(item.item_id) == record_entry \
+                            and target_footprint.GetPosition() == target_position:
+                        continue  # transformed placement unchanged, and the target was not moved since
+                    self._batch.modify(target_footprint)
                     target_group.AddItem(target_footprint)
                     target_footprint.SetParentGroup(target_group)
 
-                    target_footprint.SetPosition(self._transform.transform(item.GetPosition()))
+                    target_footprint.SetPosition(target_position)
                     target_footprint.SetOrientationDegrees(self._transform.transform_orientation(
-                        item.GetOrientation().AsRadians()) * 180 / math.pi)
-                    if self._transform.transform_flipped(item.GetSide() != 0):
+                        item.orientation) * 180 / math.pi)
+                    if self._transform.transform_flipped(item.flipped):
                         target_footprint.SetLayerAndFlip(pcbnew.B_Cu)
                     else:
                         target_footprint.SetLayerAndFlip(pcbnew.F_Cu)
-                elif isinstance(item, (pcbnew.PCB_TRACK, pcbnew.ZONE)):  # duplicate everything else
-                    cloned_item = item.Duplicate()
-                    self._target_board.Add(cloned_item)
-                    target_group.AddItem(cloned_item)
-                    cloned_item.SetParentGroup(target_group)
-
-                    if item.GetNetCode() != 0:  # ignore items without netcodes, eg keepout zones
-                        src_netcode_pads = self._get_netcode_pads(item.GetBoard(), item.GetNetCode())
-                        target_netcodes: Set[int] = set()
-                        for footprint, pad in src_netcode_pads:
-                            target_footprint = target_footprint_by_src_refdes.get(footprint.GetReferenceAsString())
-                            if target_footprint is None:  # ignore
-                                continue
-                            target_pad = target_footprint.FindPadByNumber(pad.GetNumber())  # type: pcbnew.PAD
-                            target_netcodes.add(target_pad.GetNetCode())
-                        if len(target_netcodes) == 1:
-                            cloned_item.SetNetCode(list(target_netcodes)[0])
+                    self._timings.add_since('replicate.footprints', start)
+                elif isinstance(item, PlanTrack):  # duplicate everything else
+                    target_netcode = net_map.get(item.netcode) if item.netcode != 0 else None
+                    if item.netcode != 0 and target_netcode is None:  # ignore items without netcodes
+                        result.tracks_missing_netcode.append(item.track)
+                    fingerprint = self._fingerprint(item.start, item.end, item.layer, item.properties, target_netcode,
+                                                    source_group.group_id)
+                    if self._reuse_previous(previous, item.item_id, fingerprint, record):
+                        continue
+
+                    cloned_track = self._batch.clone(item.track)
+                    target_group.AddItem(cloned_track)
+                    cloned_track.SetParentGroup(target_group)
+                    if target_netcode is not None:
+                        cloned_track.SetNetCode(target_netcode)
+                    record.items[item.item_id] = (fingerprint, BoardUtils.item_id(cloned_track))
+                    written.append(cloned_track)
+
+                    cloned_track.SetStart(self._transform.transform(item.start))
+                    cloned_track.SetEnd(self._transform.transform(item.end))
+                    if item.layer in (pcbnew.F_Cu, pcbnew.B_Cu):  # flip non-internal layers
+                        if self._transform.transform_flipped(item.layer == pcbnew.B_Cu):
+                            cloned_track.SetLayer(pcbnew.B_Cu)
                         else:
-                            if isinstance(item, pcbnew.PCB_TRACK):
-                                result.tracks_missing_netcode.append(item)
-                            elif isinstance(item, pcbnew.ZONE):
-                                result.zones_missing_netcode.append(item)
-                            else:
-                                raise TypeError(f"unknown item type of {item} failed to replicate netcode")
-
-                    # fix coordinates
-                    if isinstance(cloned_item, pcbnew.PCB_TRACK):  # need to explicitly assign zone netcodes
-                        cloned_item.SetStart(self._transform.transform(item.GetStart()))
-                        cloned_item.SetEnd(self._transform.transform(item.GetEnd()))
-                        if item.GetLayer() in (pcbnew.F_Cu, pcbnew.B_Cu):  # flip non-internal layers
-                            if self._transform.transform_flipped(item.GetLayer() == pcbnew.B_Cu):
-                                cloned_item.SetLayer(pcbnew.B_Cu)
+                            cloned_track.SetLayer(pcbnew.F_Cu)
+                    if target_netcode is not None or item.netcode == 0:  # unmapped nets are already reported
+                        placed.append(cloned_track)
+                    self._timings.add_since('replicate.tracks', start)
+                elif isinstance(item, PlanZone):
+                    target_netcode = net_map.get(item.netcode) if item.netcode != 0 else None
+                    if item.netcode != 0 and target_netcode is None:  # ignore items without netcodes, eg keepouts
+                        result.zones_missing_netcode.append(item.zone)
+                    fill_signature = self._plan.fill_signature(item) if preserve_fills and item.zone.IsFilled() else None
+                    fingerprint = self._fingerprint(item.corners, item.on_front, item.on_back, item.properties,
+                                                    target_netcode, source_group.group_id, fill_signature)
+                    if self._reuse_previous(previous, item.item_id, fingerprint, record):
+                        continue
+
+                    cloned_zone = self._batch.clone(item.zone)
+                    target_group.AddItem(cloned_zone)
+                    cloned_zone.SetParentGroup(target_group)
+                    if target_netcode is not None:  # need to explicitly assign zone netcodes
+                        cloned_zone.SetNetCode(target_netcode)
+                    record.items[item.item_id] = (fingerprint, BoardUtils.item_id(cloned_zone))
+                    written.append(cloned_zone)
+
+                    target_corners = [(int(x), int(y)) for x, y in self._transform.transform_many(item.corners)]
+                    for i, (x, y) in enumerate(target_corners):
+                        cloned_zone.SetCornerPosition(i, pcbnew.VECTOR2I(x, y))
+
+                    # flip layers if needed
+                    if (item.on_front or item.on_back) and self._transform.relative_flipped():
+                        cloned_layers = cloned_zone.GetLayerSet()  # type: pcbnew.LSET
+                        cloned_layers.RemoveLayer(pcbnew.F_Cu)
+                        cloned_layers.RemoveLayer(pcbnew.B_Cu)
+                        if item.on_front:
+                            cloned_layers.AddLayer(pcbnew.B_Cu)
+                        if item.on_back:
+                            cloned_layers.AddLayer(pcbnew.F_Cu)
+                        cloned_zone.SetLayerSet(cloned_layers)
+
+                    preserved = False
+                    if preserve_fills and item.zone.IsFilled() and target_corners:
+                        with telemetry.span('replicate.zone_fills'):
+                            xs = [x for x, y in target_corners]
+                            ys = [y for x, y in target_corners]
+                            instance_item_ids = {target_id for fingerprint, target_id in record.items.values()}
+                            if previous is not None:
+                                instance_item_ids.update(target_id for fingerprint, target_id
+                                                         in previous.items.values())
+                            if not self._has_foreign_copper(
+                                    (min(xs), min(ys), max(xs), max(ys)),
+                                    {self._transform_layer(layer) for layer in item.zone.GetLayerSet().Seq()},
+                                    cloned_zone.GetNetCode(), instance_item_ids):
+                                self._transform_fill(item.zone, cloned_zone)
+                                preserved = True
                             else:
-                                cloned_item.SetLayer(pcbnew.F_Cu)
-                    if isinstance(cloned_item, pcbnew.ZONE):  # need to explicitly assign zone netcodes
-                        cloned_item.UnFill()
-                        for i in range(item.GetNumCorners()):
-                            cloned_item.SetCornerPosition(i, self._transform.transform(item.GetCornerPosition(i)))
-
-                        # flip layers if needed
-                        layers = item.GetLayerSet()  # type: pcbnew.LSET
-                        if (layers.Contains(pcbnew.F_Cu) or layers.Contains(pcbnew.B_Cu)) and \
-                            self._transform.relative_flipped():
-                            cloned_layers = cloned_item.GetLayerSet()  # type: pcbnew.LSET
-                            cloned_layers.RemoveLayer(pcbnew.F_Cu)
-                            cloned_layers.RemoveLayer(pcbnew.B_Cu)
-                            if layers.Contains(pcbnew.F_Cu):
-                                cloned_layers.AddLayer(pcbnew.B_Cu)
-                            if layers.Contains(pcbnew.B_Cu):
-                                cloned_layers.AddLayer(pcbnew.F_Cu)
-                            cloned_item.SetLayerSet(cloned_layers)
+                                result.zones_unfilled.append(cloned_zone)
+                    if not preserved:
+                        cloned_zone.UnFill()
+                    if target_netcode is not None or item.netcode == 0:
+                        placed.append(cloned_zone)
+                    self._timings.add_since('replicate.zones', start)
+                elif isinstance(item, PlanShape):
+                    fingerprint = self._fingerprint(item.geometry, source_group.group_id)
+                    if self._reuse_previous(previous, item.item_id, fingerprint, record):
+                        continue
+
+                    cloned_shape = self._batch.clone(item.shape)
+                    target_group.AddItem(cloned_shape)
+                    cloned_shape.SetParentGroup(target_group)
+                    record.items[item.item_id] = (fingerprint, BoardUtils.item_id(cloned_shape))
+                    written.append(cloned_shape)
+                    self._transform.apply_to(cloned_shape)
+                    self._timings.add_since('replicate.shapes', start)
                 else:
-                    raise ValueError(f'unsupported item type {type(item)} in group-like {source_group}')
-        recurse_group(self._src, target_group)
+                    raise TypeError(f'unknown plan item {item}')
+        recurse_group(self._plan.root, target_group)
+
+        for target_item in written:  # as placed
+            record.targets[BoardUtils.item_id(target_item)] = self._target_fingerprint(target_item)
+
+        if previous is not None:  # remove target items of changed or deleted source items, and unused groups
+            self._delete_previous(previous, {target_id for fingerprint, target_id in record.items.values()},
+                                  set(record.groups.values()))
+
+        with telemetry.span('replicate.overlaps'):
+            overlaps, possible_overlaps = self._find_copper_overlaps(
+                placed, {target_id for fingerprint, target_id in record.items.values()})
+            result.copper_overlaps.extend(overlaps)
+            result.possible_copper_overlaps.extend(possible_overlaps)
 
         return result
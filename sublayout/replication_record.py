@@ -0,0 +1,122 @@
+import json
+import os
+from typing import Callable, Dict, NamedTuple, Optional, Set, Tuple, List, Any
+
+
+class InstanceRecord(NamedTuple):
+    """What a replication propagated into one target instance, so a later replication can apply only the changes.
+    Items are keyed by source item id (KIID), with a fingerprint of the source item as replicated
+    (geometry, copied properties, target net, and parent group) and the id of the target item it was replicated to.
+    Target items are also fingerprinted as written, so items edited in the target since are replicated again."""
+    transform: List[Any]  # PositionTransform.signature(), if this changes all items must be re-placed
+    footprints: Dict[str, Tuple[str, str]]  # source footprint id -> (fingerprint, target footprint id)
+    items: Dict[str, Tuple[str, str]]  # source track / zone id -> (fingerprint, target item id)
+    groups: Dict[str, str]  # source group id ('' for the top level) -> target group id
+    targets: Dict[str, str]  # target track / zone id -> fingerprint of the target item as written
+
+    @staticmethod
+    def empty(transform: List[Any]) -> 'InstanceRecord':
+        return InstanceRecord(transform, {}, {}, {}, {})
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'transform': self.transform,
+            'footprints': {src_id: list(entry) for src_id, entry in self.footprints.items()},
+            'items': {src_id: list(entry) for src_id, entry in self.items.items()},
+            'groups': self.groups,
+            'targets': self.targets,
+        }
+
+    def target_ids(self) -> Set[str]:
+        """Returns the ids of all target items and groups in this record"""
+        target_ids = {target_id for fingerprint, target_id in self.footprints.values()}
+        target_ids.update(target_id for fingerprint, target_id in self.items.values())
+        target_ids.update(self.groups.values())
+        return target_ids
+
+    @staticmethod
+    def from_json(data: Dict[str, Any]) -> 'InstanceRecord':
+        return InstanceRecord(list(data['transform']),
+                              {src_id: (entry[0], entry[1]) for src_id, entry in data['footprints'].items()},
+                              {src_id: (entry[0], entry[1]) for src_id, entry in data['items'].items()},
+                              dict(data['groups']),
+                              dict(data.get('targets', {})))  # missing in older records, items are re-replicated
+
+
+class ReplicationRecord():
+    """Records of replications from one source (eg, a source hierarchy on the board, or a sublayout file),
+    by target instance path, persisted as a JSON sidecar next to the board.
+    Records for a different source are discarded on load, since item ids would not correspond.
+    The sidecar must describe the saved board. Where the board is replicated into without being saved (eg, in the
+    plugin), the record is saved as pending instead, and only used once the board has its items, see load_current."""
+    VERSION = 1
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self._instances: Dict[Tuple[str, ...], InstanceRecord] = {}
+
+    @staticmethod
+    def sidecar_path(board_filename: str) -> str:
+        """Returns the record file path for a board file"""
+        return os.path.splitext(board_filename)[0] + '.sublayout.json'
+
+    @staticmethod
+    def pending_path(board_filename: str) -> str:
+        """Returns the file path for a record of replications not yet saved with the board"""
+        return os.path.splitext(board_filename)[0] + '.sublayout.pending.json'
+
+    @classmethod
+    def load_current(cls, board_filename: str, source: str, item_exists: Callable[[str], bool]) -> 'ReplicationRecord':
+        """Loads the record of the board as it currently is, from the sidecar and pending records.
+        A pending instance record is used if the board has the items it added over the sidecar (eg, the board was
+        replicated into this session, or saved since), otherwise the sidecar instance record is used.
+        If the board file was saved since the pending record, the current record is saved as the sidecar."""
+        sidecar_filename = cls.sidecar_path(board_filename)
+        pending_filename = cls.pending_path(board_filename)
+        record = cls.load(sidecar_filename, source)
+        pending = cls.load(pending_filename, source)
+        for path, instance in pending._instances.items():
+            saved_instance = record._instances.get(path)
+            added_ids = instance.target_ids() - (saved_instance.target_ids() if saved_instance is not None else set())
+            if not added_ids or any(item_exists(target_id) for target_id in added_ids):
+                record._instances[path] = instance
+        try:
+            saved_since = os.path.getmtime(board_filename) >= os.path.getmtime(pending_filename)
+        except OSError:
+            saved_since = False
+        if saved_since:
+            record.save(sidecar_filename)
+            os.remove(pending_filename)
+        return record
+
+    @classmethod
+    def load(cls, filename: str, source: str) -> 'ReplicationRecord':
+        """Loads the record from the file, returning an empty record if the file does not exist,
+        is not readable, or is for a different source"""
+        record = cls(source)
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != cls.VERSION or data.get('source') != source:
+                return record
+            for instance in data['instances']:
+                record._instances[tuple(instance['path'])] = InstanceRecord.from_json(instance['record'])
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return cls(source)
+        return record
+
+    def save(self, filename: str) -> None:
+        data = {
+            'version': self.VERSION,
+            'source': self.source,
+            'instances': [{'path': list(path), 'record': instance.to_json()}
+                          for path, instance in self._instances.items()],
+        }
+        with open(filename, 'w') as f:
+            json.dump(data, f)
+
+    def instance(self, target_path: Tuple[str, ...]) -> Optional[InstanceRecord]:
+        return self._instances.get(target_path)
+
+    def set_instance(self, target_path: Tuple[str, ...], instance: InstanceRecord) -> None:
+        self._instances[target_path] = instance
@@ -1,38 +1,65 @@
-from typing import Tuple, List, Dict, Set, NamedTuple, Union, Optional, Type
+from typing import Tuple, List, Dict, Set, NamedTuple, Union, Optional, Type, cast
 
 import pcbnew
 
 from .board_utils import BoardUtils, GroupWrapper, PcbGroupType, IsKicad10
+from .board_index import BoardIndex, BoundingBox, item_bbox
+from .board_batch import BoardBatch
+from . import telemetry
 
 
 class FilterResult(NamedTuple):
-    ungrouped_elts: List[Union[pcbnew.FOOTPRINT, pcbnew.PCB_TRACK, pcbnew.ZONE]]
+    ungrouped_elts: List[Union[pcbnew.FOOTPRINT, pcbnew.PCB_TRACK, pcbnew.ZONE, pcbnew.PCB_SHAPE]]
     groups: List[PcbGroupType]  # groups that are wholly part of the hierarchy
 
     footprints: List[pcbnew.FOOTPRINT]  # all footprints in the target
     netcodes: List[int]  # all netcodes in the target group but not elsewhere
+    # groups with items both in the hierarchy and outside it (footprints of other hierarchies), whose hierarchy items
+    # are selected ungrouped
+    split_groups: List[PcbGroupType]
+
+    def get_error_strs(self) -> List[str]:
+        """Returns (nonfatal) problems with the selection as a list of strings, to propagate to the user.
+        Empty list means no problems encountered."""
+        error_strs = []
+        if self.split_groups:
+            group_names = ', '.join(sorted(group.GetName() or '(unnamed)' for group in self.split_groups))
+            error_strs.append(f"{len(self.split_groups)} groups also contain footprints outside the hierarchy, "
+                              f"so their hierarchy items are saved ungrouped: {group_names}")
+        return error_strs
 
 
 class HierarchySelector():
     def create_sublayout(self, filename: str) -> pcbnew.BOARD:
         """Creates a (copy) board with only the hierarchical elements, preserving group structure."""
+        timings = telemetry.Timings()
+        with telemetry.collecting(timings), telemetry.span('create_sublayout'):
+            board = self._create_sublayout(filename)
+        telemetry.record('create_sublayout', self._board, timings,
+                         footprints=len(board.GetFootprints()), tracks=len(board.GetTracks()),
+                         zones=board.GetAreaCount(), nets=len(self.exported_netnames))
+        return board
+
+    def _create_sublayout(self, filename: str) -> pcbnew.BOARD:
         # board = pcbnew.CreateEmptyBoard()  # this breaks in actual KiCad
         board = pcbnew.NewBoard(filename)  # type: pcbnew.BOARD
         assert board is not None
         result = self.get_elts()
+        batch = BoardBatch(board)
+        netcodes: Set[int] = {0}  # nets referenced by cloned items, the unconnected net is always kept
+        connected_items: List[pcbnew.BOARD_CONNECTED_ITEM] = []  # cloned pads, tracks, and zones, by original net
+        nets = self._index.nets()
 
-        # the new board does not have nets, add the nets so items retain connectivity
-        nets_by_netcode: Dict[int, pcbnew.NETINFO_ITEM] = self._board.GetNetsByNetcode()
-        for netcode, net in nets_by_netcode.items():
-            board.Add(net)
-
-        # clone loose items
-        for elt in result.ungrouped_elts:
-            try:
-                cloned = elt.Duplicate()
-            except TypeError:
-                cloned = elt.Duplicate(True)  # required addToParentGroup in newer KiCad versions
-            board.Add(cloned)
+        def clone_item(item: pcbnew.BOARD_ITEM, target_group: Optional[PcbGroupType]) -> None:
+            cloned_item = batch.clone(item)
+            if target_group is not None:
+                target_group.AddItem(cloned_item)
+            if isinstance(item, pcbnew.FOOTPRINT):
+                netcodes.update(netcode for pad_number, netcode in nets.footprint_pads(item))
+                connected_items.extend(cloned_item.Pads())
+            elif isinstance(item, pcbnew.BOARD_CONNECTED_ITEM):
+                netcodes.add(item.GetNetCode())
+                connected_items.append(cloned_item)
 
         def clone_group(group: PcbGroupType, target_group: Optional[PcbGroupType]) -> None:
             """Recursively clones a group and its contents.
@@ -41,102 +68,218 @@ class HierarchySelector():
             for item in GroupWrapper(self._board, group).items():
                 if isinstance(item, PcbGroupType):
                     new_group = pcbnew.PCB_GROUP(board)
-                    board.Add(new_group)
+                    batch.add(new_group)
                     if target_group is not None:
                         target_group.AddItem(new_group)
                     clone_group(item, new_group)
                 else:
-                    if IsKicad10 and isinstance(item, pcbnew.FOOTPRINT):
-                        cloned_item = item.Duplicate(False)
-                    else:
-                        cloned_item = item.Duplicate()
-                    board.Add(cloned_item)
-                    if target_group is not None:
-                        target_group.AddItem(cloned_item)
+                    clone_item(item, target_group)
 
-        # clone groups
-        for group in result.groups:
-            if len(result.groups) == 1 and not result.ungrouped_elts:  # group is top-level
-                target_group: Optional[PcbGroupType] = None
-            else:
-                target_group = PcbGroupType(board)
-                board.Add(target_group)
-            clone_group(group, target_group)
+        with telemetry.span('create_sublayout.clone'):
+            # clone loose items
+            for elt in result.ungrouped_elts:
+                clone_item(elt, None)
+
+            # clone groups
+            for group in result.groups:
+                if len(result.groups) == 1 and not result.ungrouped_elts:  # group is top-level
+                    target_group: Optional[PcbGroupType] = None
+                else:
+                    target_group = PcbGroupType(board)
+                    batch.add(target_group)
+                clone_group(group, target_group)
+
+        # the new board does not have nets, create the nets used by the cloned items so items retain connectivity.
+        # The parent board's nets can't be shared, since adding them to another board renumbers them in place.
+        nets_by_netcode: Dict[int, pcbnew.NETINFO_ITEM] = self._board.GetNetsByNetcode()
+        new_nets_by_netcode: Dict[int, pcbnew.NETINFO_ITEM] = {0: board.FindNet(0)}  # by original netcode
+        for netcode in sorted(netcodes):
+            if netcode != 0 and netcode in nets_by_netcode:
+                new_net = pcbnew.NETINFO_ITEM(board, nets_by_netcode[netcode].GetNetname())
+                board.Add(new_net)  # assigns the next netcode of the new board
+                new_nets_by_netcode[netcode] = new_net
+        for item in connected_items:  # clones still reference the parent board's nets, re-point them
+            item.SetNet(new_nets_by_netcode.get(item.GetNetCode(), new_nets_by_netcode[0]))
+        self.exported_netnames = {cast(int, net.GetNetCode()): cast(str, net.GetNetname())
+                                  for net in new_nets_by_netcode.values()}
+        batch.finalize()
 
         return board
 
-    def delete(self, exclude_types: Tuple[Type[pcbnew.EDA_ITEM],]) -> None:
-        """Deletes all items in the group, except those of the specified types."""
+    def delete(self, exclude_types: Tuple[Type[pcbnew.EDA_ITEM],], batch: Optional[BoardBatch] = None) -> int:
+        """Deletes all items in the group, except those of the specified types, returning the number deleted.
+        Excluded items are removed from the deleted groups, the selected groups themselves are kept.
+        If a batch is given, deletions are made through it (to be finalized by the caller),
+        otherwise it is finalized here."""
         result = self.get_elts()
+        own_batch = batch is None
+        if batch is None:
+            batch = BoardBatch(self._board, self._index)
 
-        for elt in result.ungrouped_elts:  # delete loose items
-            self._board.Delete(elt)
-
-        def delete_group(group: PcbGroupType) -> None:
-            """Recursively deletes a group and its contents."""
+        doomed: List[pcbnew.BOARD_ITEM] = list(result.ungrouped_elts)  # loose items
+        pending_groups = list(result.groups)
+        while pending_groups:  # collect group contents in one traversal
+            group = pending_groups.pop()
             for item in GroupWrapper(self._board, group).items():
                 if isinstance(item, PcbGroupType):
-                    delete_group(item)
-                if not isinstance(item, exclude_types):
-                    self._board.Delete(item)
-                else:  # if excluded, remove from group
-                    group.RemoveItem(item)
-        for group in result.groups:
-            delete_group(group)
-
-    def __init__(self, board: pcbnew.BOARD, path_prefix: Tuple[str, ...]) -> None:
+                    pending_groups.append(item)
+                    doomed.append(item)
+                elif not isinstance(item, exclude_types):
+                    doomed.append(item)
+        removed = batch.remove_all(doomed)
+        for group in result.groups:  # only excluded items are left, remove them from the group
+            group.RemoveAll()
+        if own_batch:
+            batch.finalize()
+        return removed
+
+    def __init__(self, board: pcbnew.BOARD, path_prefix: Tuple[str, ...], index: Optional[BoardIndex] = None,
+                 include_region: bool = False) -> None:
+        """The board index may be passed in to be shared across selections, otherwise it is built here.
+        If include_region is set, the selection also includes tracks, vias, zones, and graphic shapes lying wholly
+        inside the bounding box of the hierarchy's footprints, which are not connected to the hierarchy by an internal
+        net (eg, keepouts, graphics, and stitching vias), see region_items."""
         self._board = board
         self.path_prefix = path_prefix
+        self.include_region = include_region
+        if index is None:
+            index = BoardIndex(board)
+        self._index = index
+        # sublayout board netcode -> netname of the nets created by the last create_sublayout, which are only those
+        # referenced by the exported pads, tracks, and zones
+        self.exported_netnames: Dict[int, str] = {}
 
+    @telemetry.timed('get_elts')
     def get_elts(self) -> FilterResult:
         """Filters the footprints on the board, returning those that are in scope."""
         include_netcodes: Set[int] = set()  # nets that are part of the hierarchy
         exclude_netcodes: Set[int] = set()  # nets that are part of footprints not part of the hierarchy
 
-        # footprints and tracks / zones of internal netlists, keyed by group
-        target_footprints: List[pcbnew.FOOTPRINT] = []
-        elts_by_group: Dict[GroupWrapper, List[Union[pcbnew.FOOTPRINT, pcbnew.PCB_TRACK, pcbnew.ZONE]]] = {}
-        # groups that are not part of the hierarchy, by footprint
-        exclude_groups: Set[GroupWrapper] = set()
+        # footprints and tracks / zones of internal netlists (and items in the region, if included), keyed by group
+        elts_by_group: Dict[GroupWrapper, List[Union[pcbnew.FOOTPRINT, pcbnew.PCB_TRACK, pcbnew.ZONE,
+                                                     pcbnew.PCB_SHAPE]]] = {}
+        nets = self._index.nets()
 
-        footprints = self._board.GetFootprints()  # type: List[pcbnew.FOOTPRINT]
-        for footprint in footprints:
-            footprint_group = GroupWrapper(self._board, footprint.GetParentGroup())
-            if not BoardUtils.footprint_path_startswith(footprint, self.path_prefix):
-                exclude_groups.add(footprint_group)
-                for pad in footprint.Pads():  # type: pcbnew.PAD
-                    exclude_netcodes.add(pad.GetNetCode())
-            else:
-                target_footprints.append(footprint)
+        # only footprints in the hierarchy are visited, those outside are found through the indices as needed
+        with telemetry.span('get_elts.footprints'):
+            target_footprints = self._index.paths().footprints_under(self.path_prefix)
+            target_footprint_ids = {BoardUtils.item_id(footprint) for footprint in target_footprints}
+            for footprint in target_footprints:
+                footprint_group = GroupWrapper(self._board, footprint.GetParentGroup())
                 elts_by_group.setdefault(footprint_group, []).append(footprint)
-                for pad in footprint.Pads():
-                    include_netcodes.add(pad.GetNetCode())
-
-        include_netcodes = include_netcodes.difference(exclude_netcodes)
-        for track in self._board.GetTracks():  # type: pcbnew.PCB_TRACK
-            if track.GetNetCode() in include_netcodes:
-                track_group = GroupWrapper(self._board, track.GetParentGroup())
-                elts_by_group.setdefault(track_group, []).append(track)
-        for zone_id in range(self._board.GetAreaCount()):
-            zone = self._board.GetArea(zone_id)  # type: pcbnew.ZONE
-            if zone.GetNetCode() in include_netcodes:
-                track_group = GroupWrapper(self._board, zone.GetParentGroup())
-                elts_by_group.setdefault(track_group, []).append(zone)
-
-        # for exclude_groups in elts_by_group, move them to the None group
-        for group in list(elts_by_group.keys()):  # copy keys to avoid modify-on-iteration
-            if group in exclude_groups and group != GroupWrapper.empty():
-                elts_by_group.setdefault(GroupWrapper.empty(), []).extend(elts_by_group[group])
-                # TODO warn on overlap include/exclude groups
-                del elts_by_group[group]
-
-        ungrouped_elts = elts_by_group.pop(GroupWrapper.empty(), [])
-
-        # prune groups with highest covering group
-        covering_groups = GroupWrapper.highest_covering_groups(list(elts_by_group.keys()))
-        for group in list(elts_by_group.keys()):
-            if group not in covering_groups:
-                del elts_by_group[group]
+                for pad_number, netcode in nets.footprint_pads(footprint):
+                    include_netcodes.add(netcode)
+
+        with telemetry.span('get_elts.nets'):
+            for netcode in include_netcodes:  # exclude nets with any pads on footprints not part of the hierarchy
+                if any(footprint_id not in target_footprint_ids for footprint_id, pad_number in nets.netcode_pads(netcode)):
+                    exclude_netcodes.add(netcode)
+            include_netcodes = include_netcodes.difference(exclude_netcodes)
+        with telemetry.span('get_elts.items'):
+            for netcode in include_netcodes:
+                for item in nets.netcode_items(netcode):
+                    item_group = GroupWrapper(self._board, item.GetParentGroup())
+                    elts_by_group.setdefault(item_group, []).append(item)
+        if self.include_region:
+            with telemetry.span('get_elts.region'):
+                for item in self.region_items(target_footprints, include_netcodes | exclude_netcodes):
+                    if not isinstance(item, pcbnew.BOARD_CONNECTED_ITEM) or item.GetNetCode() not in include_netcodes:
+                        item_group = GroupWrapper(self._board, item.GetParentGroup())
+                        elts_by_group.setdefault(item_group, []).append(item)
+
+        # groups that are not part of the hierarchy, since they contain footprints not part of the hierarchy
+        def is_exclude_group(group: GroupWrapper) -> bool:
+            return any(isinstance(item, pcbnew.FOOTPRINT) and BoardUtils.item_id(item) not in target_footprint_ids
+                       for item in group.items())
+
+        with telemetry.span('get_elts.groups'):
+            # for exclude_groups in elts_by_group, move them to the None group, and report them as split
+            split_groups = []
+            for group in list(elts_by_group.keys()):  # copy keys to avoid modify-on-iteration
+                if group != GroupWrapper.empty() and is_exclude_group(group):
+                    elts_by_group.setdefault(GroupWrapper.empty(), []).extend(elts_by_group[group])
+                    split_groups.append(group._group)
+                    del elts_by_group[group]
+
+            ungrouped_elts = elts_by_group.pop(GroupWrapper.empty(), [])
+
+            # prune groups with highest covering group
+            covering_groups = GroupWrapper.highest_covering_groups(list(elts_by_group.keys()), self._index.groups())
+            covering_groups_set = set(covering_groups)
+            for group in list(elts_by_group.keys()):
+                if group not in covering_groups_set:
+                    del elts_by_group[group]
 
         return FilterResult(ungrouped_elts, list([group._group for group in elts_by_group.keys()]),
-                            target_footprints, list(include_netcodes))
+                            target_footprints, list(include_netcodes), split_groups)
+
+
+    def region_items(self, footprints: List[pcbnew.FOOTPRINT], netcodes: Set[int]) \
+            -> List[Union[pcbnew.PCB_TRACK, pcbnew.ZONE, pcbnew.PCB_SHAPE]]:
+        """Returns the tracks, vias, zones, and graphic shapes (except the board outline) lying wholly inside the
+        bounding box of the footprints, from the board's spatial index. Items on a net are only included if the net
+        is one of netcodes (the nets of the hierarchy's pads), so copper of other hierarchies passing through the
+        region is excluded."""
+        region: Optional[BoundingBox] = None
+        for footprint in footprints:
+            left, top, right, bottom = item_bbox(footprint)
+            if region is None:
+                region = (left, top, right, bottom)
+            else:
+                region = (min(region[0], left), min(region[1], top), max(region[2], right), max(region[3], bottom))
+        if region is None:
+            return []
+        items = []
+        for item in self._index.spatial().query_contained(region):
+            if isinstance(item, pcbnew.PCB_SHAPE):
+                if item.GetLayer() == pcbnew.Edge_Cuts:
+                    continue
+            elif item.GetNetCode() != 0 and item.GetNetCode() not in netcodes:
+                continue
+            items.append(item)
+        return items
+
+
+class SelectionCache():
+    """Memoizes HierarchySelector results by (board, path prefix), along with the board index they are computed from,
+    so repeated selections of the same hierarchy return the same FilterResult without re-scanning the board.
+    The cached index is kept up to date by edits made through a BoardBatch with it (replicate, restore, purge, delete),
+    but cached selections are not, so invalidate() must be called after modifying the board, and after edits made
+    outside this module (eg, in the editor while the plugin dialog is open)."""
+    def __init__(self) -> None:
+        # by id(board), holding a reference to the board so the id stays valid
+        self._indices: Dict[int, Tuple[pcbnew.BOARD, BoardIndex]] = {}
+        self._results: Dict[Tuple[int, Tuple[str, ...], bool], FilterResult] = {}
+
+    def index(self, board: pcbnew.BOARD) -> BoardIndex:
+        """Returns the (cached) index for the board"""
+        entry = self._indices.get(id(board))
+        if entry is None:
+            entry = (board, BoardIndex(board))
+            self._indices[id(board)] = entry
+        return entry[1]
+
+    def selector(self, board: pcbnew.BOARD, path_prefix: Tuple[str, ...],
+                 include_region: bool = False) -> HierarchySelector:
+        """Returns a HierarchySelector sharing the cached board index"""
+        return HierarchySelector(board, path_prefix, self.index(board), include_region)
+
+    def get_elts(self, board: pcbnew.BOARD, path_prefix: Tuple[str, ...],
+                 include_region: bool = False) -> FilterResult:
+        """Returns the (cached) HierarchySelector result for the board, path prefix, and selection mode"""
+        key = (id(board), path_prefix, include_region)
+        result = self._results.get(key)
+        if result is None:
+            result = self.selector(board, path_prefix, include_region).get_elts()
+            self._results[key] = result
+        return result
+
+    def invalidate(self, board: Optional[pcbnew.BOARD] = None) -> None:
+        """Discards cached results and indices for the board, or for all boards if not specified"""
+        if board is None:
+            self._indices.clear()
+            self._results.clear()
+        else:
+            self._indices.pop(id(board), None)
+            for key in [key for key in self._results.keys() if key[0] == id(board)]:
+                del self._results[key]
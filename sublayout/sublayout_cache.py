@@ -0,0 +1,94 @@
+import collections
+import os
+import struct
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import pcbnew
+
+from .board_index import BoardIndex
+from .sublayout_snapshot import SublayoutSnapshot, file_hash
+
+
+BoardLoaderFn = Callable[[str], pcbnew.BOARD]
+
+
+def load_sublayout_board(filename: str) -> pcbnew.BOARD:
+    """Loads a board file without making it the current board, so this is safe to use from the plugin"""
+    return pcbnew.PCB_IO_MGR.Load(pcbnew.PCB_IO_MGR.KICAD_SEXP, filename)
+
+
+class CachedSublayout(NamedTuple):
+    """A parsed sublayout board, with its indices. Shared across users of the cache, so must not be modified."""
+    board: pcbnew.BOARD
+    index: BoardIndex
+    content_hash: bytes
+    # live item id -> saved item id, for boards rebuilt from a snapshot, for ReplicationPlan
+    stable_ids: Dict[str, str]
+
+
+class SublayoutCache():
+    """Bounded LRU cache of parsed sublayout boards, so sublayouts restored repeatedly are parsed once.
+    Entries are keyed by path and validated by file modification time and size, and if those changed, by content
+    hash, so a touched-but-unchanged file is not re-parsed while an edited file is.
+    If use_snapshots is set, boards are rebuilt from an up-to-date snapshot sidecar where one exists, instead of
+    being parsed."""
+    def __init__(self, max_entries: int = 8, loader: BoardLoaderFn = load_sublayout_board,
+                 use_snapshots: bool = True) -> None:
+        assert max_entries > 0
+        self._max_entries = max_entries
+        self._loader = loader
+        self._use_snapshots = use_snapshots
+        # path -> ((mtime_ns, size), entry), most recently used last
+        self._entries: 'collections.OrderedDict[str, Tuple[Tuple[int, int], CachedSublayout]]' = \
+            collections.OrderedDict()
+
+    def get(self, filename: str) -> CachedSublayout:
+        """Returns the parsed board and index for the file, loading it if not cached or if the file changed.
+        Raises OSError if the file cannot be read, and ValueError if it cannot be loaded as a board."""
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        file_stamp = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._entries.get(path)
+        if cached is not None:
+            cached_stamp, entry = cached
+            if cached_stamp != file_stamp:
+                if file_hash(path) == entry.content_hash:  # touched but unchanged
+                    self._entries[path] = (file_stamp, entry)
+                else:
+                    entry = self._load(path, file_stamp)
+            self._entries.move_to_end(path)
+            return entry
+        return self._load(path, file_stamp)
+
+    def _load(self, path: str, file_stamp: Tuple[int, int]) -> CachedSublayout:
+        content_hash = file_hash(path)
+        snapshot = SublayoutSnapshot.load_fresh(path, content_hash) if self._use_snapshots else None
+        board = None
+        if snapshot is not None:
+            with snapshot:
+                try:
+                    board, stable_ids = snapshot.build_board(path)
+                except (ValueError, struct.error):  # corrupt snapshot, fall back to parsing
+                    board = None
+        if board is None:
+            board = self._loader(path)
+            if not board:
+                raise ValueError(f"failed to load sublayout board {path}")
+            stable_ids = {}
+        entry = CachedSublayout(board, BoardIndex(board), content_hash, stable_ids)
+        self._entries[path] = (file_stamp, entry)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, filename: Optional[str] = None) -> None:
+        """Drops the cached entry for the file, or all entries if no file is given"""
+        if filename is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(os.path.abspath(filename), None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,540 @@
+"""Compact binary snapshot of a saved sublayout board, written as a sidecar next to the .kicad_pcb.
+Holds only what restore needs (footprint paths, refdes, FPIDs and pads, tracks, vias, zone outlines, settings, and
+fills, graphic shapes, and the group tree), so restore can rebuild a minimal source board without the KiCad board
+parser. Replicated track and zone properties are all recorded, so restoring from the snapshot gives the same result
+as restoring from the parsed board.
+
+The file is a header, a section table, and sections of fixed-size little-endian records (plus a string blob
+referenced by index), so it can be memory-mapped and each section unpacked directly from the mapping.
+A snapshot records the content hash of the .kicad_pcb it was written with, and is only used while that matches."""
+import hashlib
+import mmap
+import os
+import struct
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import pcbnew
+
+from .board_utils import BoardUtils, PcbGroupType, group_id, group_parent
+
+
+MAGIC = b'SUBSNAP\0'
+VERSION = 4
+
+_HEADER = struct.Struct('<8sI20s')  # magic, version, sha1 of the .kicad_pcb
+_SECTION_ENTRY = struct.Struct('<QQ')  # byte offset, record count
+
+# section name -> record format, in file order. Strings are stored as indices into the string table.
+_SECTIONS: List[Tuple[str, struct.Struct]] = [
+    ('strings', struct.Struct('<B')),  # UTF-8 blob, one record per byte
+    ('string_offsets', struct.Struct('<I')),  # start of each string in the blob, plus a final end offset
+    ('nets', struct.Struct('<ii')),  # netcode, name
+    ('groups', struct.Struct('<iii')),  # uuid, name, parent group index (-1 for top level), parents first
+    ('footprints', struct.Struct('<iiiiidBiiiii')),  # uuid, path, refdes, x, y, orientation (rad), flipped, group,
+                                                     # first pad, pad count, FPID library nickname, item name
+    ('pads', struct.Struct('<iiiidiiiiiiii')),  # number, netcode, x, y, orientation (rad), size x, y, shape,
+                                                # attribute, drill x, y, first layer, layer count
+    ('pad_layers', struct.Struct('<i')),
+    ('tracks', struct.Struct('<iBiiiiiiiiiiiiiiQ')),  # uuid, kind, group, netcode, layer, width, start x, y, end x, y,
+                                                      # arc mid x, y, via drill, via type, via top, bottom layers,
+                                                      # track property presence mask
+    ('track_properties', struct.Struct('<d')),  # len(_TRACK_PROPERTIES) values per track
+    ('zones', struct.Struct('<iiiiiiiiQB')),  # uuid, group, netcode, name, first layer, layer count,
+                                              # first contour, contour count, zone property presence mask, filled
+    ('zone_properties', struct.Struct('<d')),  # len(_ZONE_PROPERTIES) values per zone
+    ('zone_layers', struct.Struct('<i')),
+    ('zone_fills', struct.Struct('<iiii')),  # zone index, layer, first contour, contour count
+    ('contours', struct.Struct('<Bii')),  # is hole, first corner, corner count; holes follow their outline
+    ('corners', struct.Struct('<ii')),
+    ('shapes', struct.Struct('<iiiiiBiiiiiiiiii')),  # uuid, group, shape type, layer, width, filled, start x, y,
+                                                     # end x, y, arc mid or bezier c1 x, y, bezier c2 x, y,
+                                                     # first contour, contour count (for polygons)
+]
+_SECTION_FORMATS = dict(_SECTIONS)
+
+TRACK_KIND_TRACK, TRACK_KIND_ARC, TRACK_KIND_VIA = 0, 1, 2
+
+# kinds of property values, all stored as doubles
+_INT, _BOOL, _FLOAT, _ANGLE = 0, 1, 2, 3  # _ANGLE is an EDA_ANGLE, stored in degrees
+
+# track settings besides geometry, as (getter, setter, kind), recorded where the KiCad version and item support them,
+# covering ReplicationPlan.TRACK_PROPERTIES
+_TRACK_PROPERTIES: List[Tuple[str, str, int]] = [
+    ('IsLocked', 'SetLocked', _BOOL),
+    ('GetRemoveUnconnected', 'SetRemoveUnconnected', _BOOL),
+    ('GetKeepStartEnd', 'SetKeepStartEnd', _BOOL),
+]
+
+# zone settings as (getter, setter, kind), recorded where the KiCad version supports them,
+# covering ReplicationPlan.ZONE_PROPERTIES
+_ZONE_PROPERTIES: List[Tuple[str, str, int]] = [
+    ('GetAssignedPriority', 'SetAssignedPriority', _INT),
+    ('GetPriority', 'SetPriority', _INT),
+    ('GetLocalClearance', 'SetLocalClearance', _INT),
+    ('GetMinThickness', 'SetMinThickness', _INT),
+    ('GetPadConnection', 'SetPadConnection', _INT),
+    ('GetThermalReliefGap', 'SetThermalReliefGap', _INT),
+    ('GetThermalReliefSpokeWidth', 'SetThermalReliefSpokeWidth', _INT),
+    ('GetFillMode', 'SetFillMode', _INT),
+    ('GetHatchThickness', 'SetHatchThickness', _INT),
+    ('GetHatchGap', 'SetHatchGap', _INT),
+    ('GetHatchOrientation', 'SetHatchOrientation', _ANGLE),
+    ('GetHatchSmoothingLevel', 'SetHatchSmoothingLevel', _INT),
+    ('GetHatchSmoothingValue', 'SetHatchSmoothingValue', _FLOAT),
+    ('GetHatchBorderAlgorithm', 'SetHatchBorderAlgorithm', _INT),
+    ('GetHatchHoleMinArea', 'SetHatchHoleMinArea', _FLOAT),
+    ('GetIslandRemovalMode', 'SetIslandRemovalMode', _INT),
+    ('GetMinIslandArea', 'SetMinIslandArea', _INT),
+    ('GetCornerSmoothingType', 'SetCornerSmoothingType', _INT),
+    ('GetCornerRadius', 'SetCornerRadius', _INT),
+    ('GetHatchStyle', 'SetHatchStyle', _INT),
+    ('GetBorderHatchPitch', 'SetBorderHatchPitch', _INT),
+    ('GetIsRuleArea', 'SetIsRuleArea', _BOOL),
+    ('GetDoNotAllowTracks', 'SetDoNotAllowTracks', _BOOL),
+    ('GetDoNotAllowVias', 'SetDoNotAllowVias', _BOOL),
+    ('GetDoNotAllowPads', 'SetDoNotAllowPads', _BOOL),
+    ('GetDoNotAllowCopperPour', 'SetDoNotAllowCopperPour', _BOOL),
+    ('GetDoNotAllowFootprints', 'SetDoNotAllowFootprints', _BOOL),
+    ('IsLocked', 'SetLocked', _BOOL),
+]
+
+
+def _read_properties(item: pcbnew.BOARD_ITEM, properties: List[Tuple[str, str, int]]) -> Tuple[int, List[float]]:
+    """Returns the presence mask and values of the properties of the item, absent where not supported"""
+    mask = 0
+    values = []
+    for i, (getter, setter, kind) in enumerate(properties):
+        try:
+            value = getattr(item, getter)()
+            if value is not None:
+                value = value.AsDegrees() if kind == _ANGLE else float(value)
+        except (AttributeError, TypeError):  # not supported in this KiCad version, or by this item
+            value = None
+        if value is not None:
+            mask |= 1 << i
+        values.append(value if value is not None else 0.0)
+    return mask, values
+
+
+def _write_properties(item: pcbnew.BOARD_ITEM, properties: List[Tuple[str, str, int]], mask: int,
+                      values: List[float]) -> None:
+    """Sets the recorded properties on the item"""
+    for i, (getter, setter, kind) in enumerate(properties):
+        if not mask & (1 << i):
+            continue
+        value = values[i]
+        if kind == _BOOL:
+            converted: Any = bool(value)
+        elif kind == _ANGLE:
+            converted = pcbnew.EDA_ANGLE(value, pcbnew.DEGREES_T)
+        elif kind == _FLOAT:
+            converted = value
+        else:
+            converted = int(value)
+        try:
+            getattr(item, setter)(converted)
+        except (AttributeError, TypeError):  # recorded by a different KiCad version
+            pass
+
+
+def _pad_call(pad: pcbnew.PAD, method: str, *args: Any) -> Any:
+    """Calls a pad size or shape accessor, which takes the padstack layer first in newer KiCad versions"""
+    try:
+        return getattr(pad, method)(*args)
+    except TypeError:
+        return getattr(pad, method)(pcbnew.F_Cu, *args)
+
+
+def snapshot_path(board_filename: str) -> str:
+    """Returns the snapshot sidecar path for a sublayout board file"""
+    return os.path.splitext(board_filename)[0] + '.sublayout_snapshot'
+
+
+def file_hash(filename: str) -> bytes:
+    hasher = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+class _StringTable():
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self._indices: Dict[str, int] = {}
+
+    def add(self, string: str) -> int:
+        index = self._indices.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(string)
+            self._indices[string] = index
+        return index
+
+
+def write_snapshot(board: pcbnew.BOARD, board_filename: str) -> str:
+    """Writes the snapshot sidecar for a sublayout board, which must already be saved to board_filename
+    (the snapshot is tied to the saved file contents). Returns the snapshot path."""
+    strings = _StringTable()
+    records: Dict[str, List[Tuple[Any, ...]]] = {name: [] for name, _ in _SECTIONS}
+
+    nets_by_netcode: Dict[int, pcbnew.NETINFO_ITEM] = board.GetNetsByNetcode()
+    for netcode, net in nets_by_netcode.items():
+        if netcode != 0:  # the unconnected net always exists
+            records['nets'].append((netcode, strings.add(net.GetNetname())))
+
+    # groups are ordered parents first, so they can be rebuilt in order
+    group_index: Dict[str, int] = {}
+    pending = list(board.Groups())
+    while pending:
+        remaining = []
+        for group in pending:
+            parent = group_parent(group)
+            if parent is not None and group_id(parent) not in group_index:
+                remaining.append(group)
+                continue
+            group_index[group_id(group)] = len(records['groups'])
+            records['groups'].append((strings.add(group_id(group)), strings.add(group.GetName()),
+                                      group_index[group_id(parent)] if parent is not None else -1))
+        assert len(remaining) < len(pending), "group tree has a cycle"
+        pending = remaining
+
+    def item_group(item: pcbnew.BOARD_ITEM) -> int:
+        parent = item.GetParentGroup()
+        return group_index[group_id(parent)] if parent is not None else -1
+
+    for footprint in board.GetFootprints():  # type: pcbnew.FOOTPRINT
+        pads = footprint.Pads()
+        pos = footprint.GetPosition()
+        fpid = footprint.GetFPID()  # type: pcbnew.LIB_ID
+        records['footprints'].append((
+            strings.add(BoardUtils.item_id(footprint)), strings.add(footprint.GetPath().AsString()),
+            strings.add(footprint.GetReference()), pos[0], pos[1], footprint.GetOrientation().AsRadians(),
+            footprint.GetSide() != 0, item_group(footprint), len(records['pads']), len(pads),
+            strings.add(str(fpid.GetLibNickname())), strings.add(str(fpid.GetLibItemName()))))
+        for pad in pads:  # type: pcbnew.PAD
+            pad_pos = pad.GetPosition()
+            size = _pad_call(pad, 'GetSize')
+            drill = pad.GetDrillSize()
+            pad_layers = list(pad.GetLayerSet().Seq())
+            records['pads'].append((
+                strings.add(pad.GetNumber()), pad.GetNetCode(), pad_pos[0], pad_pos[1],
+                pad.GetOrientation().AsRadians(), size[0], size[1], int(_pad_call(pad, 'GetShape')),
+                int(pad.GetAttribute()), drill[0], drill[1], len(records['pad_layers']), len(pad_layers)))
+            records['pad_layers'].extend((layer, ) for layer in pad_layers)
+
+    for track in board.GetTracks():
+        track = track.Cast()
+        start, end = track.GetStart(), track.GetEnd()
+        mid, drill, via_type, top_layer, bottom_layer = (0, 0), 0, 0, 0, 0
+        if isinstance(track, pcbnew.PCB_VIA):
+            kind = TRACK_KIND_VIA
+            drill, via_type = track.GetDrillValue(), int(track.GetViaType())
+            top_layer, bottom_layer = track.TopLayer(), track.BottomLayer()
+        elif isinstance(track, pcbnew.PCB_ARC):
+            kind = TRACK_KIND_ARC
+            mid = track.GetMid()
+        else:
+            kind = TRACK_KIND_TRACK
+        mask, values = _read_properties(track, _TRACK_PROPERTIES)
+        records['tracks'].append((
+            strings.add(BoardUtils.item_id(track)), kind, item_group(track), track.GetNetCode(), track.GetLayer(),
+            track.GetWidth(), start[0], start[1], end[0], end[1], mid[0], mid[1], drill, via_type,
+            top_layer, bottom_layer, mask))
+        records['track_properties'].extend((value, ) for value in values)
+
+    def add_contours(poly: pcbnew.SHAPE_POLY_SET) -> Tuple[int, int]:
+        """Records the outlines and holes of a polygon set, returning the first contour and contour count"""
+        first_contour = len(records['contours'])
+        for outline_index in range(poly.OutlineCount()):
+            contours = [(False, poly.Outline(outline_index))] + \
+                [(True, poly.Hole(outline_index, hole_index))
+                 for hole_index in range(poly.HoleCount(outline_index))]
+            for is_hole, contour in contours:
+                records['contours'].append((is_hole, len(records['corners']), contour.PointCount()))
+                for point_index in range(contour.PointCount()):
+                    point = contour.CPoint(point_index)
+                    records['corners'].append((point[0], point[1]))
+        return first_contour, len(records['contours']) - first_contour
+
+    for zone_index, zone in enumerate(board.Zones()):  # type: Tuple[int, pcbnew.ZONE]
+        layers = list(zone.GetLayerSet().Seq())
+        first_contour, contour_count = add_contours(zone.Outline())
+        mask, values = _read_properties(zone, _ZONE_PROPERTIES)
+        records['zone_properties'].extend((value, ) for value in values)
+
+        records['zones'].append((
+            strings.add(BoardUtils.item_id(zone)), item_group(zone), zone.GetNetCode(),
+            strings.add(zone.GetZoneName()), len(records['zone_layers']), len(layers),
+            first_contour, contour_count, mask, zone.IsFilled()))
+        records['zone_layers'].extend((layer, ) for layer in layers)
+        if zone.IsFilled():
+            for layer in layers:
+                if hasattr(zone, 'HasFilledPolysForLayer') and not zone.HasFilledPolysForLayer(layer):
+                    continue
+                fill_contour, fill_count = add_contours(zone.GetFilledPolysList(layer))
+                records['zone_fills'].append((zone_index, layer, fill_contour, fill_count))
+
+    for drawing in board.GetDrawings():
+        if not isinstance(drawing, pcbnew.PCB_SHAPE):
+            continue
+        start, end = drawing.GetStart(), drawing.GetEnd()
+        shape_type = drawing.GetShape()
+        c1, c2, first_contour, contour_count = (0, 0), (0, 0), 0, 0
+        if shape_type == pcbnew.SHAPE_T_ARC:
+            c1 = drawing.GetArcMid()
+        elif shape_type == pcbnew.SHAPE_T_BEZIER:
+            c1, c2 = drawing.GetBezierC1(), drawing.GetBezierC2()
+        elif shape_type == pcbnew.SHAPE_T_POLY:
+            first_contour, contour_count = add_contours(drawing.GetPolyShape())
+        records['shapes'].append((
+            strings.add(BoardUtils.item_id(drawing)), item_group(drawing), int(shape_type), drawing.GetLayer(),
+            drawing.GetWidth(), drawing.IsFilled(), start[0], start[1], end[0], end[1], c1[0], c1[1], c2[0], c2[1],
+            first_contour, contour_count))
+
+    blob = bytearray()
+    for string in strings.strings:
+        records['string_offsets'].append((len(blob), ))
+        blob.extend(string.encode('utf-8'))
+    records['string_offsets'].append((len(blob), ))
+
+    # lay out sections after the header and section table
+    offset = _HEADER.size + _SECTION_ENTRY.size * len(_SECTIONS)
+    section_entries = []
+    section_data = []
+    for name, record_format in _SECTIONS:
+        if name == 'strings':
+            data = bytes(blob)
+            count = len(blob)
+        else:
+            data = b''.join(record_format.pack(*record) for record in records[name])
+            count = len(records[name])
+        section_entries.append(_SECTION_ENTRY.pack(offset, count))
+        section_data.append(data)
+        offset += len(data)
+
+    output = snapshot_path(board_filename)
+    temp_output = output + '.tmp'
+    with open(temp_output, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, file_hash(board_filename)))
+        f.write(b''.join(section_entries))
+        f.write(b''.join(section_data))
+    os.replace(temp_output, output)  # so readers never see a partial snapshot
+    return output
+
+
+class SnapshotBoard(NamedTuple):
+    """A minimal board rebuilt from a snapshot"""
+    board: pcbnew.BOARD
+    # live item id -> item id in the saved sublayout, since rebuilt items are assigned new ids
+    stable_ids: Dict[str, str]
+
+
+class SublayoutSnapshot():
+    """Memory-mapped read access to a snapshot file. Raises ValueError on open if it is not a valid snapshot."""
+    def __init__(self, filename: str) -> None:
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _HEADER.size + _SECTION_ENTRY.size * len(_SECTIONS):
+                raise ValueError(f"truncated snapshot {filename}")
+            magic, version, self.source_hash = _HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"not a version {VERSION} snapshot {filename}")
+            self._sections: Dict[str, Tuple[int, int]] = {}
+            for i, (name, record_format) in enumerate(_SECTIONS):
+                offset, count = _SECTION_ENTRY.unpack_from(self._map, _HEADER.size + _SECTION_ENTRY.size * i)
+                if offset + count * record_format.size > len(self._map):
+                    raise ValueError(f"truncated snapshot {filename}")
+                self._sections[name] = (offset, count)
+        except (ValueError, struct.error):
+            self._map.close()
+            raise
+        self._strings: Optional[List[str]] = None
+
+    @classmethod
+    def load_fresh(cls, board_filename: str, board_hash: Optional[bytes] = None) -> Optional['SublayoutSnapshot']:
+        """Returns the snapshot for the board file if one exists and is up to date with the board file contents,
+        otherwise None. The board file hash may be passed in if already known."""
+        try:
+            snapshot = cls(snapshot_path(board_filename))
+        except (OSError, ValueError):
+            return None
+        if board_hash is None:
+            board_hash = file_hash(board_filename)
+        if snapshot.source_hash != board_hash:
+            snapshot.close()
+            return None
+        return snapshot
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> 'SublayoutSnapshot':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def records(self, section: str) -> List[Tuple[Any, ...]]:
+        """Returns the records of a section, unpacked from the mapping"""
+        offset, count = self._sections[section]
+        record_format = _SECTION_FORMATS[section]
+        with memoryview(self._map) as view:  # released before returning, so the mapping can be closed
+            return list(record_format.iter_unpack(view[offset:offset + count * record_format.size]))
+
+    def strings(self) -> List[str]:
+        if self._strings is None:
+            offset, count = self._sections['strings']
+            blob = self._map[offset:offset + count]
+            offsets = [string_offset for string_offset, in self.records('string_offsets')]
+            self._strings = [blob[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._strings
+
+    def build_board(self, board_filename: str) -> SnapshotBoard:
+        """Rebuilds a minimal board (for the board file) from the snapshot, with the items and properties restore
+        uses. Footprints have only their FPID and pads (numbers, nets, and geometry), which is what correspondence,
+        net mapping, and overlap checks use."""
+        strings = self.strings()
+        board = pcbnew.NewBoard(board_filename)  # type: pcbnew.BOARD
+        stable_ids: Dict[str, str] = {}
+
+        nets: Dict[int, pcbnew.NETINFO_ITEM] = {}
+        for netcode, name in self.records('nets'):
+            net = pcbnew.NETINFO_ITEM(board, strings[name], netcode)
+            board.Add(net)
+            nets[netcode] = net
+
+        groups: List[PcbGroupType] = []
+        for uuid, name, parent in self.records('groups'):
+            group = pcbnew.PCB_GROUP(board)
+            group.SetName(strings[name])
+            board.Add(group)
+            if parent >= 0:
+                groups[parent].AddItem(group)
+            groups.append(group)
+            stable_ids[group_id(group)] = strings[uuid]
+
+        def add_item(item: pcbnew.BOARD_ITEM, uuid: int, group: int) -> None:
+            board.Add(item)
+            if group >= 0:
+                groups[group].AddItem(item)
+            stable_ids[BoardUtils.item_id(item)] = strings[uuid]
+
+        contours = self.records('contours')
+        corners = self.records('corners')
+
+        def add_contours(poly: pcbnew.SHAPE_POLY_SET, first_contour: int, contour_count: int) -> None:
+            for is_hole, first_corner, corner_count in contours[first_contour:first_contour + contour_count]:
+                if is_hole:
+                    poly.NewHole()
+                else:
+                    poly.NewOutline()
+                for x, y in corners[first_corner:first_corner + corner_count]:
+                    poly.Append(x, y)
+
+        pads = self.records('pads')
+        pad_layers = [layer for layer, in self.records('pad_layers')]
+        for uuid, path, reference, x, y, orientation, flipped, group, first_pad, pad_count, fpid_library, \
+                fpid_name in self.records('footprints'):
+            footprint = pcbnew.FOOTPRINT(board)
+            footprint.SetReference(strings[reference])
+            footprint.SetPath(pcbnew.KIID_PATH(strings[path]))
+            footprint.SetFPID(pcbnew.LIB_ID(strings[fpid_library], strings[fpid_name]))
+            footprint.SetLayer(pcbnew.B_Cu if flipped else pcbnew.F_Cu)
+            footprint.SetPosition(pcbnew.VECTOR2I(x, y))
+            footprint.SetOrientation(pcbnew.EDA_ANGLE(orientation, pcbnew.RADIANS_T))
+            for number, netcode, pad_x, pad_y, pad_orientation, size_x, size_y, shape, attribute, drill_x, drill_y, \
+                    first_layer, layer_count in pads[first_pad:first_pad + pad_count]:
+                pad = pcbnew.PAD(footprint)
+                pad.SetNumber(strings[number])
+                footprint.Add(pad)
+                pad.SetAttribute(attribute)
+                layers = pcbnew.LSET()
+                for layer in pad_layers[first_layer:first_layer + layer_count]:
+                    layers.AddLayer(layer)
+                pad.SetLayerSet(layers)
+                _pad_call(pad, 'SetShape', shape)
+                _pad_call(pad, 'SetSize', pcbnew.VECTOR2I(size_x, size_y))
+                pad.SetDrillSize(pcbnew.VECTOR2I(drill_x, drill_y))
+                pad.SetPosition(pcbnew.VECTOR2I(pad_x, pad_y))
+                pad.SetOrientation(pcbnew.EDA_ANGLE(pad_orientation, pcbnew.RADIANS_T))
+                if netcode in nets:
+                    pad.SetNet(nets[netcode])
+            add_item(footprint, uuid, group)
+
+        track_properties = [value for value, in self.records('track_properties')]
+        for track_index, (uuid, kind, group, netcode, layer, width, start_x, start_y, end_x, end_y, mid_x, mid_y,
+                          drill, via_type, top_layer, bottom_layer, mask) in enumerate(self.records('tracks')):
+            if kind == TRACK_KIND_VIA:
+                track = pcbnew.PCB_VIA(board)
+                track.SetPosition(pcbnew.VECTOR2I(start_x, start_y))
+                track.SetViaType(via_type)
+                track.SetLayerPair(top_layer, bottom_layer)
+                track.SetDrill(drill)
+            else:
+                if kind == TRACK_KIND_ARC:
+                    track = pcbnew.PCB_ARC(board)
+                    track.SetMid(pcbnew.VECTOR2I(mid_x, mid_y))
+                else:
+                    track = pcbnew.PCB_TRACK(board)
+                track.SetStart(pcbnew.VECTOR2I(start_x, start_y))
+                track.SetEnd(pcbnew.VECTOR2I(end_x, end_y))
+                track.SetLayer(layer)
+            track.SetWidth(width)
+            _write_properties(track, _TRACK_PROPERTIES, mask,
+                              track_properties[track_index * len(_TRACK_PROPERTIES):
+                                               (track_index + 1) * len(_TRACK_PROPERTIES)])
+            if netcode in nets:
+                track.SetNet(nets[netcode])
+            add_item(track, uuid, group)
+
+        zone_layers = [layer for layer, in self.records('zone_layers')]
+        zone_properties = [value for value, in self.records('zone_properties')]
+        zones: List[pcbnew.ZONE] = []
+        for zone_index, (uuid, group, netcode, name, first_layer, layer_count, first_contour, contour_count, mask,
+                         filled) in enumerate(self.records('zones')):
+            zone = pcbnew.ZONE(board)
+            layers = pcbnew.LSET()
+            for layer in zone_layers[first_layer:first_layer + layer_count]:
+                layers.AddLayer(layer)
+            zone.SetLayerSet(layers)
+            zone.SetZoneName(strings[name])
+            _write_properties(zone, _ZONE_PROPERTIES, mask,
+                              zone_properties[zone_index * len(_ZONE_PROPERTIES):
+                                              (zone_index + 1) * len(_ZONE_PROPERTIES)])
+            add_contours(zone.Outline(), first_contour, contour_count)
+            if netcode in nets:
+                zone.SetNet(nets[netcode])
+            zone.SetIsFilled(bool(filled))
+            add_item(zone, uuid, group)
+            zones.append(zone)
+
+        for zone_index, layer, first_contour, contour_count in self.records('zone_fills'):
+            fill = pcbnew.SHAPE_POLY_SET()
+            add_contours(fill, first_contour, contour_count)
+            zones[zone_index].SetFilledPolysList(layer, fill)
+
+        for uuid, group, shape_type, layer, width, filled, start_x, start_y, end_x, end_y, c1_x, c1_y, c2_x, c2_y, \
+                first_contour, contour_count in self.records('shapes'):
+            shape = pcbnew.PCB_SHAPE(board)
+            shape.SetShape(shape_type)
+            shape.SetLayer(layer)
+            shape.SetWidth(width)
+            shape.SetFilled(bool(filled))
+            if shape_type == pcbnew.SHAPE_T_ARC:
+                shape.SetArcGeometry(pcbnew.VECTOR2I(start_x, start_y), pcbnew.VECTOR2I(c1_x, c1_y),
+                                     pcbnew.VECTOR2I(end_x, end_y))
+            else:
+                shape.SetStart(pcbnew.VECTOR2I(start_x, start_y))
+                shape.SetEnd(pcbnew.VECTOR2I(end_x, end_y))
+            if shape_type == pcbnew.SHAPE_T_BEZIER:
+                shape.SetBezierC1(pcbnew.VECTOR2I(c1_x, c1_y))
+                shape.SetBezierC2(pcbnew.VECTOR2I(c2_x, c2_y))
+            elif shape_type == pcbnew.SHAPE_T_POLY:
+                poly = pcbnew.SHAPE_POLY_SET()
+                add_contours(poly, first_contour, contour_count)
+                shape.SetPolyShape(poly)
+            add_item(shape, uuid, group)
+
+        return SnapshotBoard(board, stable_ids)
@@ -0,0 +1,138 @@
+"""Opt-in timing instrumentation for sublayout operations.
+Disabled by default, in which case spans cost a flag check. When enabled, spans record per-phase durations into
+the active Timings collector, and operations append a JSONL record (board size, item counts, durations) to the
+log file, if one is set.
+
+Enable with enable(log_path), or with enable_from_env() from the SUBLAYOUT_TELEMETRY environment variable, which the
+plugin and CLI do on startup. Collectors are per thread, so spans of concurrent operations do not mix."""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Any, Callable, TypeVar, cast
+
+import pcbnew
+
+
+ENV_VAR = 'SUBLAYOUT_TELEMETRY'
+
+_enabled = False
+_log_path: Optional[str] = None
+_lock = threading.Lock()  # for enabling and disabling, and log file appends
+_local = threading.local()  # per thread, collectors: stack of active collectors, spans record into the innermost
+
+FnType = TypeVar('FnType', bound=Callable[..., Any])
+
+
+class Timings():
+    """Accumulated per-phase durations, in seconds. Repeated phases are summed."""
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def add_since(self, name: str, start: float) -> None:
+        """Adds the time since start (from time.perf_counter), if instrumentation is enabled"""
+        if _enabled:
+            self.add(name, time.perf_counter() - start)
+
+
+def enable(log_path: Optional[str] = None) -> None:
+    """Enables instrumentation, optionally appending operation records to the JSONL log file"""
+    global _enabled, _log_path
+    with _lock:
+        _enabled = True
+        _log_path = log_path
+
+
+def enable_from_env() -> None:
+    """Enables instrumentation if the SUBLAYOUT_TELEMETRY environment variable is set, logging to its path"""
+    log_path = os.environ.get(ENV_VAR)
+    if log_path:
+        enable(log_path)
+
+
+def disable() -> None:
+    global _enabled, _log_path
+    with _lock:
+        _enabled = False
+        _log_path = None
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _collectors() -> List[Timings]:
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = []
+        _local.collectors = collectors
+    return collectors
+
+
+@contextlib.contextmanager
+def collecting(timings: Timings) -> Iterator[Timings]:
+    """Makes timings the active collector for spans within this context, on this thread"""
+    collectors = _collectors()
+    collectors.append(timings)
+    try:
+        yield timings
+    finally:
+        collectors.pop()
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the enclosed phase into the active collector, if instrumentation is enabled"""
+    if not _enabled:
+        yield
+        return
+    collectors = _collectors()
+    if not collectors:
+        yield
+        return
+    collector = collectors[-1]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.add(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable[[FnType], FnType]:
+    """Decorator that times each call of the function as a span"""
+    def decorator(fn: FnType) -> FnType:
+        @functools.wraps(fn)
+        def wrapped(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return fn(*args, **kwargs)
+        return cast(FnType, wrapped)
+    return decorator
+
+
+def record(operation: str, board: pcbnew.BOARD, timings: Timings, **counts: Any) -> None:
+    """Appends a JSONL record for a completed operation to the log file, if instrumentation is enabled with one.
+    Logging failures are swallowed, since telemetry must not break the operation."""
+    log_path = _log_path
+    if not _enabled or log_path is None:
+        return
+    try:
+        entry = {
+            'time': time.time(),
+            'operation': operation,
+            'board': os.path.basename(board.GetFileName()),
+            'board_footprints': len(board.GetFootprints()),
+            'board_tracks': len(board.GetTracks()),
+            'board_zones': board.GetAreaCount(),
+            'counts': counts,
+            'durations': timings.durations,
+        }
+        line = json.dumps(entry) + '\n'
+        with _lock, open(log_path, 'a') as f:
+            f.write(line)
+    except (OSError, TypeError, ValueError):
+        pass
@@ -0,0 +1,39 @@
+import os
+import unittest
+
+import pcbnew
+
+from sublayout.board_batch import BoardBatch
+from sublayout.board_utils import BoardUtils, GroupWrapper
+
+
+class BoardBatchTestCase(unittest.TestCase):
+    def test_batch(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'McuSublayout.kicad_pcb'))  # type: pcbnew.BOARD
+        tracks = list(board.GetTracks())
+        track_count = len(tracks)
+
+        with BoardBatch(board) as batch:
+            cloned = batch.clone(tracks[0])
+            batch.clone(tracks[1])
+            batch.remove(tracks[2])
+        self.assertEqual((batch.added, batch.removed), (2, 1))
+        self.assertEqual(len(board.GetTracks()), track_count + 1)
+        self.assertIsNotNone(BoardUtils.resolve_item(board, BoardUtils.item_id(cloned)))
+        self.assertNotEqual(BoardUtils.item_id(cloned), BoardUtils.item_id(tracks[0]))
+        self.assertEqual(cloned.GetNetCode(), tracks[0].GetNetCode())
+
+    def test_remove_all(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))  # type: pcbnew.BOARD
+        group = board.FindFootprintByReference('J1').GetParentGroup()
+        self.assertIsNotNone(group)
+        group_tracks = [item for item in GroupWrapper(board, group).recursive_items()
+                        if isinstance(item, pcbnew.PCB_TRACK)]
+        track_count = len(board.GetTracks())
+
+        batch = BoardBatch(board)
+        removed = batch.remove_all(group_tracks + group_tracks[:1] + [group])  # duplicates are removed once
+        batch.finalize()
+        self.assertEqual(removed, len(group_tracks) + 1)
+        self.assertEqual(len(board.GetTracks()), track_count - len(group_tracks))
+        self.assertIsNone(board.FindFootprintByReference('J1').GetParentGroup())  # members left ungrouped
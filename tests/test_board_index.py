@@ -0,0 +1,114 @@
+import os
+import unittest
+
+import pcbnew
+
+from sublayout.board_utils import BoardUtils, GroupWrapper, group_parent
+from sublayout.board_batch import BoardBatch
+from sublayout.board_index import BoardIndex, NetIndex, PathIndex, GroupTreeIndex, SpatialIndex, item_bbox, layout_items
+
+
+class BoardIndexTestCase(unittest.TestCase):
+    def test_net_index(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
+        index = NetIndex(board)
+
+        footprint = board.FindFootprintByReference('U3')
+        self.assertEqual(index.footprint_pads(footprint),
+                         [(pad.GetNumber(), pad.GetNetCode()) for pad in footprint.Pads()])
+        for pad in footprint.Pads():
+            self.assertEqual(index.pad_netcode(footprint, pad.GetNumber()),
+                             footprint.FindPadByNumber(pad.GetNumber()).GetNetCode())
+            self.assertIn((footprint.m_Uuid.AsString(), pad.GetNumber()), index.netcode_pads(pad.GetNetCode()))
+        self.assertIsNone(index.pad_netcode(footprint, 'nonexistent'))
+
+    def test_path_index(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
+        index = PathIndex(board)
+
+        for footprint in board.GetFootprints():
+            self.assertEqual(index.path_of(footprint), BoardUtils.footprint_path(footprint))
+            self.assertEqual(index.footprint_at(BoardUtils.footprint_path(footprint)).GetReference(),
+                             footprint.GetReference())
+
+        tof_path = BoardUtils.footprint_path(board.FindFootprintByReference('U3'))[:-1]
+        self.assertEqual({footprint.GetReference() for footprint in index.footprints_under(tof_path)},
+                         {footprint.GetReference() for footprint in board.GetFootprints()
+                          if BoardUtils.footprint_path_startswith(footprint, tof_path)})
+        self.assertEqual(len(index.footprints_under(())), len(board.GetFootprints()))
+        self.assertEqual(index.footprints_under(('nonexistent', )), [])
+        self.assertIsNone(index.footprint_at(tof_path))  # sheet, not a footprint
+
+    def test_group_tree_index(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))  # type: pcbnew.BOARD
+        index = GroupTreeIndex(board)
+
+        group_j1 = index.index_group(board.FindFootprintByReference('J1').GetParentGroup())
+        group_r1 = index.index_group(board.FindFootprintByReference('R1').GetParentGroup())
+        group_r2 = index.index_group(board.FindFootprintByReference('R2').GetParentGroup())
+        group_r1r2 = index.index_group(group_parent(board.FindFootprintByReference('R2').GetParentGroup()))
+        self.assertEqual(index.parent_id(group_r2), group_r1r2)
+        self.assertIn(group_r1r2, list(index.ancestor_ids(group_r2)))
+        self.assertIn(group_r2, index.children_ids(group_r1r2))
+        self.assertEqual(index.depth(group_r2), index.depth(group_r1r2) + 1)
+        self.assertEqual(index.lowest_common_ancestor_id(group_r1, group_r2), group_r1r2)
+        self.assertEqual(index.lowest_common_ancestor_id(group_r1, group_j1), group_j1)
+        self.assertIsNone(index.lowest_common_ancestor_id(group_r1, None))
+
+        # groups are identified by KIID, so moving items does not change identity
+        group = GroupWrapper(board, board.FindFootprintByReference('J1').GetParentGroup())
+        board.FindFootprintByReference('J1').SetPosition(pcbnew.VECTOR2I(0, 0))
+        self.assertEqual(group, GroupWrapper(board, board.FindFootprintByReference('J1').GetParentGroup()))
+
+    def test_spatial_index(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray.kicad_pcb'))  # type: pcbnew.BOARD
+        items = list(layout_items(board))
+        index = SpatialIndex(items)
+        self.assertEqual(len(index), len(items))
+
+        # queries match a brute-force scan, around each footprint and over the whole board
+        query_bboxes = [item_bbox(footprint) for footprint in board.GetFootprints()]
+        query_bboxes.append(item_bbox(board))
+        for query_bbox in query_bboxes:
+            left, top, right, bottom = query_bbox
+            intersecting = [BoardUtils.item_id(item) for item in items
+                            if item_bbox(item)[0] <= right and left <= item_bbox(item)[2]
+                            and item_bbox(item)[1] <= bottom and top <= item_bbox(item)[3]]
+            contained = [BoardUtils.item_id(item) for item in items
+                         if left <= item_bbox(item)[0] and item_bbox(item)[2] <= right
+                         and top <= item_bbox(item)[1] and item_bbox(item)[3] <= bottom]
+            self.assertEqual([BoardUtils.item_id(item) for item in index.query(query_bbox)], intersecting)
+            self.assertEqual([BoardUtils.item_id(item) for item in index.query_contained(query_bbox)], contained)
+
+    def test_index_updates(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray.kicad_pcb'))  # type: pcbnew.BOARD
+        index = BoardIndex(board)
+        track = list(board.GetTracks())[0]
+        netcode = track.GetNetCode()
+        net_items = len(index.nets().netcode_items(netcode))
+        spatial_items = len(index.spatial())
+
+        # edits through a batch with the index are reflected on next use, at the items' final placement
+        batch = BoardBatch(board, index)
+        cloned = batch.clone(track)
+        cloned.Move(pcbnew.VECTOR2I(pcbnew.FromMM(100), 0))
+        self.assertEqual(len(index.nets().netcode_items(netcode)), net_items + 1)
+        self.assertEqual(len(index.spatial()), spatial_items + 1)
+        self.assertIn(BoardUtils.item_id(cloned),
+                      [BoardUtils.item_id(item) for item in index.spatial().query(item_bbox(cloned))])
+
+        cloned_id = BoardUtils.item_id(cloned)
+        batch.remove_all([cloned, track])
+        batch.finalize()
+        self.assertEqual(len(index.nets().netcode_items(netcode)), net_items - 1)
+        self.assertEqual(len(index.spatial()), spatial_items - 1)
+        self.assertNotIn(cloned_id, [BoardUtils.item_id(item) for item in index.spatial().query(item_bbox(board))])
+
+        # moved footprints re-index their pads
+        footprint = list(board.GetFootprints())[0]  # type: pcbnew.FOOTPRINT
+        pad_ids = {BoardUtils.item_id(pad) for pad in footprint.Pads()}
+        self.assertTrue(pad_ids.issubset({BoardUtils.item_id(pad) for pad in index.pads().query(item_bbox(footprint))}))
+        footprint.Move(pcbnew.VECTOR2I(pcbnew.FromMM(500), 0))
+        batch.modify(footprint)
+        self.assertTrue(pad_ids.issubset({BoardUtils.item_id(pad) for pad in index.pads().query(item_bbox(footprint))}))
+        self.assertEqual(len(index.pads()), sum(len(list(fp.Pads())) for fp in board.GetFootprints()))
@@ -0,0 +1,41 @@
+import os
+import unittest
+
+import pcbnew
+
+from sublayout.board_scan import scan_board, scan_boards
+from sublayout.board_utils import BoardUtils
+from sublayout.hierarchy_namer import HierarchyData
+
+
+class BoardScanTestCase(unittest.TestCase):
+    BOARDS = ['TestBlinkyComplete.kicad_pcb', 'TofArray.kicad_pcb', 'McuSublayout.kicad_pcb']
+
+    def test_scan_matches_board(self):
+        for name in self.BOARDS:
+            filename = os.path.join(os.path.dirname(__file__), name)
+            board = pcbnew.LoadBoard(filename)  # type: pcbnew.BOARD
+            scanned = scan_board(filename)
+
+            self.assertEqual(scanned.sheetfile_names(), HierarchyData._build_sheetfile_names(board.Footprints()))
+            self.assertEqual(sorted((footprint.reference, footprint.path) for footprint in scanned.footprints),
+                             sorted((footprint.GetReference(), BoardUtils.footprint_path(footprint))
+                                    for footprint in board.Footprints()))
+            for scanned_footprint in scanned.footprints:
+                footprint = board.FindFootprintByReference(scanned_footprint.reference)
+                self.assertEqual(scanned_footprint.pads,
+                                 [(pad.GetNumber(), pad.GetNetname()) for pad in footprint.Pads()])
+
+    def test_instances_of(self):
+        scanned = scan_board(os.path.join(os.path.dirname(__file__), 'TofArray.kicad_pcb'))
+        tof = next(footprint for footprint in scanned.footprints if footprint.reference == 'U4')
+        self.assertEqual(len(scanned.instances_of(tof.sheetfile)), 5)
+
+    def test_scan_boards(self):
+        filenames = [os.path.join(os.path.dirname(__file__), name) for name in self.BOARDS] + \
+            [os.path.join(os.path.dirname(__file__), '__init__.py')]
+        results = scan_boards(filenames, max_workers=2)
+        self.assertEqual([filename for filename, scanned, error in results], filenames)
+        self.assertTrue(all(scanned is not None for filename, scanned, error in results[:-1]))
+        self.assertIsNone(results[-1][1])
+        self.assertIsNotNone(results[-1][2])
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from sublayout.cli import CliJob, run_job, run_jobs, build_parser, scan_report
+
+
+class CliTestCase(unittest.TestCase):
+    def _job(self, command: str, board: str, output_dir: str, **kwargs) -> CliJob:
+        job = CliJob(command=command, board=os.path.join(os.path.dirname(__file__), board), output_dir=output_dir,
+                     anchor_ref=None, level=0, path=None, sublayout=None, match='tstamp', purge=False,
+                     all_instances=False)
+        return job._replace(**kwargs)
+
+    def test_replicate(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            report = run_job(self._job('replicate', 'TofArray_Unreplicated.kicad_pcb', output_dir, anchor_ref='U3'))
+            self.assertIsNone(report['error'])
+            self.assertEqual(set(instance['anchor'] for instance in report['instances']),
+                             {'U4', 'U5', 'U6', 'U7'})  # all other instances
+            for instance in report['instances']:
+                self.assertEqual(instance['errors'], [])
+            self.assertTrue(os.path.exists(report['output']))
+
+    def test_save_restore(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            report = run_job(self._job('save', 'TofArray_Unreplicated.kicad_pcb', output_dir, anchor_ref='U3'))
+            self.assertIsNone(report['error'])
+            self.assertTrue(os.path.exists(report['output']))
+
+            sublayout = report['output']
+            reports = run_jobs([self._job('restore', 'TofArray_Unreplicated.kicad_pcb', output_dir, anchor_ref='U4',
+                                          sublayout=sublayout, all_instances=True)], 1)
+            self.assertIsNone(reports[0]['error'])
+            self.assertEqual(len(reports[0]['instances']), 5)  # includes the selected instance
+
+    def test_errors_reported(self):
+        report = run_job(self._job('replicate', 'TofArray_Unreplicated.kicad_pcb', None, anchor_ref='nonexistent'))
+        self.assertIsNotNone(report['error'])
+        self.assertEqual(report['instances'], [])
+
+    def test_scan(self):
+        reports = scan_report([os.path.dirname(__file__)], 'edg.parts.Distance_Vl53l0x.Vl53l0x', max_workers=2)
+        self.assertEqual(sorted(os.path.basename(report['board']) for report in reports),
+                         ['TofArray.kicad_pcb', 'TofArray_Unreplicated.kicad_pcb'])
+        for report in reports:
+            self.assertIsNone(report['error'])
+            self.assertEqual(len(report['sheetfiles']['edg.parts.Distance_Vl53l0x.Vl53l0x']), 5)
+
+    def test_scan_inconsistent_hierarchy(self):
+        # a board with one hierarchy path in two sheetfiles fails alone, without aborting the batch
+        with tempfile.TemporaryDirectory() as board_dir:
+            with open(os.path.join(board_dir, 'inconsistent.kicad_pcb'), 'w') as f:
+                f.write('(kicad_pcb\n'
+                        '  (footprint "R" (property "Reference" "R1") (path "/a/r1") (sheetname "A") (sheetfile "a.kicad_sch"))\n'
+                        '  (footprint "R" (property "Reference" "R2") (path "/a/r2") (sheetname "B") (sheetfile "b.kicad_sch"))\n'
+                        ')\n')
+            with open(os.path.join(board_dir, 'consistent.kicad_pcb'), 'w') as f:
+                f.write('(kicad_pcb\n'
+                        '  (footprint "R" (property "Reference" "R1") (path "/a/r1") (sheetname "A") (sheetfile "a.kicad_sch"))\n'
+                        ')\n')
+            reports = {os.path.basename(report['board']): report for report in scan_report([board_dir], max_workers=2)}
+        self.assertIsNotNone(reports['inconsistent.kicad_pcb']['error'])
+        self.assertIsNone(reports['consistent.kicad_pcb']['error'])
+        self.assertEqual(len(reports['consistent.kicad_pcb']['sheetfiles']['a.kicad_sch']), 1)
+
+    def test_parser(self):
+        args = build_parser().parse_args(['restore', 'a.kicad_pcb', 'b.kicad_pcb', '--ref', 'U1',
+                                          '--sublayout', 's.kicad_pcb', '--match', 'tstamp', '--purge'])
+        self.assertEqual(args.boards, ['a.kicad_pcb', 'b.kicad_pcb'])
+        self.assertEqual(args.match, 'tstamp')
+        self.assertTrue(args.purge)
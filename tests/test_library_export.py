@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pcbnew
+
+from sublayout.library_export import MANIFEST_FILENAME, export_library, sublayout_filename, sublayout_filenames
+
+
+class LibraryExportTestCase(unittest.TestCase):
+    TOF_SHEETFILE = 'edg.parts.Distance_Vl53l0x.Vl53l0x'
+
+    def test_export_library(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray.kicad_pcb'))  # type: pcbnew.BOARD
+        with tempfile.TemporaryDirectory() as output_dir:
+            entries = {entry.sheetfile: entry for entry in export_library(board, output_dir)}
+            self.assertEqual(len(entries), 14)  # one per distinct sheetfile
+            tof_entry = entries[self.TOF_SHEETFILE]
+            self.assertEqual(tof_entry.filename, sublayout_filename(self.TOF_SHEETFILE))
+            self.assertEqual(tof_entry.instances, 5)
+            self.assertEqual(tof_entry.identical_instances, 5)  # replicated, so all copies are identical
+            self.assertTrue(all(entry.written for entry in entries.values()))
+
+            sublayout = pcbnew.LoadBoard(os.path.join(output_dir, tof_entry.filename))  # type: pcbnew.BOARD
+            self.assertEqual(len(sublayout.GetFootprints()), 3)  # U, and 2 caps
+            with open(os.path.join(output_dir, MANIFEST_FILENAME), 'r') as f:
+                manifest = json.load(f)
+            self.assertEqual(manifest[self.TOF_SHEETFILE]['geometry_hash'], tof_entry.geometry_hash)
+
+            # unchanged blocks are not re-exported
+            entries = export_library(board, output_dir)
+            self.assertFalse(any(entry.written for entry in entries))
+
+    def test_export_library_unreplicated(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
+        with tempfile.TemporaryDirectory() as output_dir:
+            entries = {entry.sheetfile: entry for entry in export_library(board, output_dir)}
+            tof_entry = entries[self.TOF_SHEETFILE]
+            self.assertLess(tof_entry.identical_instances, 5)
+            # the laid out instance is exported, not an unrouted copy
+            sublayout = pcbnew.LoadBoard(os.path.join(output_dir, tof_entry.filename))  # type: pcbnew.BOARD
+            self.assertTrue(len(sublayout.GetTracks()) > 0)
+
+    def test_sublayout_filenames(self):
+        filenames = sublayout_filenames(['sub/amp.kicad_sch', 'sub_amp.kicad_sch', 'Amp.kicad_sch', 'amp.kicad_sch',
+                                         'mcu.kicad_sch'])
+        self.assertEqual(len(set(filename.lower() for filename in filenames.values())), 5)
+        self.assertEqual(filenames['mcu.kicad_sch'], 'mcu.kicad_pcb')  # no collision, no suffix
+        self.assertTrue(filenames['sub/amp.kicad_sch'].startswith('sub_amp-'))
+        self.assertEqual(sublayout_filenames(['sub_amp.kicad_sch', 'sub/amp.kicad_sch']),
+                         {sheetfile: filenames[sheetfile] for sheetfile in ['sub_amp.kicad_sch', 'sub/amp.kicad_sch']})
@@ -1,11 +1,15 @@
+import json
 import os
+import tempfile
 import unittest
 
 import pcbnew
 
 from sublayout.board_utils import BoardUtils
-from sublayout.replicate_sublayout import ReplicateSublayout, FootprintCorrespondence, PositionTransform
+from sublayout.replicate_sublayout import ReplicateSublayout, FootprintCorrespondence, PositionTransform, ReplicationPlan
+from sublayout.replication_record import ReplicationRecord
 from sublayout.save_sublayout import HierarchySelector
+from sublayout import telemetry
 
 
 class ReplicateTestCase(unittest.TestCase):
@@ -72,6 +76,27 @@ class ReplicateTestCase(unittest.TestCase):
             else:
                 raise ValueError(f"bad src_type {src_type} in {src_footprint.GetReferenceAsString()}")
 
+    def test_correspondences_bytopology(self):
+        # the target D and R refdeses do not line up, but the netlist does
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'CharlieRgb_Unplaced.kicad_pcb'))  # type: pcbnew.BOARD
+        anchor = board.FindFootprintByReference('R4')
+
+        sublayout_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'CharlieSublayout.kicad_pcb'))  # type: pcbnew.BOARD
+        correspondence = FootprintCorrespondence.by_topology(sublayout_board, sublayout_board, board, BoardUtils.footprint_path(anchor)[:-1])
+        self.assertEqual(len(correspondence.mapped_footprints), 9)
+        self.assertEqual(len(correspondence.source_only_footprints), 0)
+        self.assertEqual(len(correspondence.target_only_footprints), 0)
+        for src_footprint, target_footprint in correspondence.mapped_footprints:
+            self.assertEqual(src_footprint.GetFPIDAsString(), target_footprint.GetFPIDAsString())
+            self.assertEqual(len(src_footprint.Pads()), len(target_footprint.Pads()))
+
+        # a partial sublayout still matches its footprints, even though their neighborhoods differ
+        sublayout_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'CharlieHalfSublayout.kicad_pcb'))
+        correspondence = FootprintCorrespondence.by_topology(sublayout_board, sublayout_board, board, BoardUtils.footprint_path(anchor)[:-1])
+        self.assertEqual(len(correspondence.mapped_footprints), 6)
+        self.assertEqual(len(correspondence.source_only_footprints), 0)
+        self.assertEqual(len(correspondence.target_only_footprints), 3)
+
     def test_correspondences_multiinstance(self):
         """Tests correspondence generation with a board with multiple instances of a hierarchy block"""
         board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
@@ -90,6 +115,36 @@ class ReplicateTestCase(unittest.TestCase):
         self.assertIn((board.FindFootprintByReference('C11'), board.FindFootprintByReference('C19')), correspondence.mapped_footprints)
         self.assertIn((board.FindFootprintByReference('C12'), board.FindFootprintByReference('C20')), correspondence.mapped_footprints)
 
+        # forward and reverse lookups, by footprint and by path
+        self.assertEqual(correspondence.get_footprint(board.FindFootprintByReference('C11')).GetReference(), 'C19')
+        self.assertEqual(correspondence.get_source_footprint(board.FindFootprintByReference('C19')).GetReference(), 'C11')
+        self.assertIsNone(correspondence.get_source_footprint(board.FindFootprintByReference('C13')))
+        self.assertEqual(correspondence.get_footprint_by_path(
+            BoardUtils.footprint_path(board.FindFootprintByReference('U3'))).GetReference(), 'U7')
+        self.assertEqual(correspondence.get_source_footprint_by_path(
+            BoardUtils.footprint_path(board.FindFootprintByReference('U7'))).GetReference(), 'U3')
+
+    def test_anchor_probes(self):
+        """Tests that anchor probes agree with the full correspondence"""
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
+        source_group = HierarchySelector(board, BoardUtils.footprint_path(board.FindFootprintByReference('U3'))[:-1]).get_elts()
+        target_paths = [BoardUtils.footprint_path(board.FindFootprintByReference(ref))[:-1] for ref in ['U3', 'U4', 'U7']]
+        for probe_fn, correspondence_fn in [(FootprintCorrespondence.probe_by_tstamp, FootprintCorrespondence.by_tstamp),
+                                            (FootprintCorrespondence.probe_by_refdes, FootprintCorrespondence.by_refdes),
+                                            (FootprintCorrespondence.probe_by_topology, FootprintCorrespondence.by_topology)]:
+            for src_ref in ['U3', 'C12']:
+                src_footprint = board.FindFootprintByReference(src_ref)
+                probed = probe_fn(board, source_group, src_footprint, board, target_paths)
+                self.assertEqual(len(probed), len(target_paths))
+                for target_path, target_footprint in zip(target_paths, probed):
+                    correspondence = correspondence_fn(board, source_group, board, target_path)
+                    self.assertEqual(target_footprint.GetReference(),
+                                     correspondence.get_footprint(src_footprint).GetReference())
+
+        probed = FootprintCorrespondence.probe_by_tstamp(board, source_group, board.FindFootprintByReference('U3'),
+                                                         board, [('nonexistent', )])
+        self.assertEqual(probed, [None])
+
     def check_transform_equality(self, src_board: pcbnew.BOARD, target_board: pcbnew.BOARD, target_anchor_ref: str):
         anchor = target_board.FindFootprintByReference(target_anchor_ref)
         correspondence = FootprintCorrespondence.by_tstamp(src_board, src_board, target_board, BoardUtils.footprint_path(anchor)[:-1])
@@ -132,6 +187,23 @@ class ReplicateTestCase(unittest.TestCase):
             pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'McuSublayout_FlipRot.kicad_pcb')),
             'U2')
 
+    def test_transforms_compose(self):
+        rot_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'McuSublayout_Rot.kicad_pcb'))
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'McuSublayout.kicad_pcb'))
+        fliprot_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'McuSublayout_FlipRot.kicad_pcb'))
+        rot_to_board = PositionTransform(rot_board.FindFootprintByReference('U2'), board.FindFootprintByReference('U2'))
+        board_to_fliprot = PositionTransform(board.FindFootprintByReference('U2'), fliprot_board.FindFootprintByReference('U2'))
+        composed = board_to_fliprot.compose(rot_to_board)
+
+        src_positions = [fp.GetPosition() for fp in rot_board.GetFootprints()]
+        for src_footprint, batch_position in zip(rot_board.GetFootprints(), composed.transform_many(
+                [(pos[0], pos[1]) for pos in src_positions])):
+            target_footprint = fliprot_board.FindFootprintByReference(src_footprint.GetReference())
+            self.assertEqual(composed.transform(src_footprint.GetPosition()), target_footprint.GetPosition())
+            self.assertEqual((batch_position[0], batch_position[1]),
+                             (target_footprint.GetPosition()[0], target_footprint.GetPosition()[1]))
+            self.assertEqual(composed.transform_flipped(src_footprint.GetSide() != 0), target_footprint.GetSide() != 0)
+
     def test_replicate(self):
         board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'BareBlinkyComplete.kicad_pcb'))  # type: pcbnew.BOARD
 
@@ -183,6 +255,193 @@ class ReplicateTestCase(unittest.TestCase):
 
         board.Save('test_output_replicate_multiinstance.kicad_pcb')
 
+    def test_replicate_plan_multiinstance(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
+        sublayout_source = HierarchySelector(board, BoardUtils.footprint_path(board.FindFootprintByReference('U3'))[:-1]).get_elts()
+        plan = ReplicationPlan(board, sublayout_source)
+        self.assertEqual(len(plan.footprints), 3)
+        targets = [(board.FindFootprintByReference(ref), BoardUtils.footprint_path(board.FindFootprintByReference(ref))[:-1])
+                   for ref in ['U4', 'U7']]
+        results = plan.replicate_many(board, targets, FootprintCorrespondence.by_tstamp)
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertFalse(result.get_error_strs())
+
+        board.Save('test_output_replicate_plan_multiinstance.kicad_pcb')
+
+    def test_replicate_telemetry(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'))  # type: pcbnew.BOARD
+        sublayout_source = HierarchySelector(board, BoardUtils.footprint_path(board.FindFootprintByReference('U3'))[:-1]).get_elts()
+        target_anchor = board.FindFootprintByReference('U4')
+
+        sublayout = ReplicateSublayout(board, sublayout_source, board, target_anchor, BoardUtils.footprint_path(target_anchor)[:-1],
+                                       FootprintCorrespondence.by_tstamp)
+        self.assertEqual(sublayout.replicate().timings, {})  # disabled by default
+
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_path = os.path.join(log_dir, 'telemetry.jsonl')
+            telemetry.enable(log_path)
+            try:
+                target_anchor = board.FindFootprintByReference('U7')
+                sublayout = ReplicateSublayout(board, sublayout_source, board, target_anchor,
+                                               BoardUtils.footprint_path(target_anchor)[:-1], FootprintCorrespondence.by_tstamp)
+                result = sublayout.replicate()
+            finally:
+                telemetry.disable()
+            for phase in ['plan', 'correspondence', 'correspondence.by_tstamp', 'replicate', 'replicate.footprints']:
+                self.assertIn(phase, result.timings)
+            with open(log_path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0]['operation'], 'replicate')
+            self.assertEqual(records[0]['counts']['mapped_footprints'], 3)
+
+    def test_replicate_incremental(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))  # type: pcbnew.BOARD
+        sublayout_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'UsbSublayout.kicad_pcb'))  # type: pcbnew.BOARD
+        anchor = board.FindFootprintByReference('J1')
+        target_path = BoardUtils.footprint_path(anchor)[:-1]
+        record = ReplicationRecord('UsbSublayout')
+
+        plan = ReplicationPlan(sublayout_board, sublayout_board)
+        plan.replicate_many(board, [(anchor, target_path)], FootprintCorrespondence.by_tstamp, purge=True, record=record)
+        first = record.instance(target_path)
+        self.assertIsNotNone(first)
+        self.assertTrue(first.items)
+        track_count = len(board.GetTracks())
+
+        # unchanged source: no items are added, and replicated items are kept
+        results = plan.replicate_many(board, [(anchor, target_path)], FootprintCorrespondence.by_tstamp,
+                                      record=record)
+        self.assertFalse(results[0].get_error_strs())
+        self.assertEqual(len(board.GetTracks()), track_count)
+        self.assertEqual(record.instance(target_path).items, first.items)
+
+        # purge replicates in full even with a record
+        plan.replicate_many(board, [(anchor, target_path)], FootprintCorrespondence.by_tstamp, purge=True,
+                            record=record)
+        self.assertEqual(len(board.GetTracks()), track_count)
+        purged = record.instance(target_path)
+        self.assertTrue(all(purged.items[src_id][1] != first.items[src_id][1] for src_id in first.items))
+        first = purged
+
+        # a target track edited by hand is replaced, even though its source is unchanged
+        edited_src_id, (edited_fingerprint, edited_target_id) = next(iter(first.items.items()))
+        BoardUtils.resolve_item(board, edited_target_id).Move(pcbnew.VECTOR2I(pcbnew.FromMM(1), 0))
+        plan.replicate_many(board, [(anchor, target_path)], FootprintCorrespondence.by_tstamp, record=record)
+        self.assertEqual(len(board.GetTracks()), track_count)
+        repaired = record.instance(target_path)
+        self.assertEqual([src_id for src_id in first.items if first.items[src_id] != repaired.items[src_id]],
+                         [edited_src_id])
+        self.assertIsNone(BoardUtils.resolve_item(board, edited_target_id))
+        first = repaired
+
+        # moving one source track replaces only its target
+        moved_track = next(track for track in sublayout_board.GetTracks() if BoardUtils.item_id(track) in first.items)
+        moved_track.Move(pcbnew.VECTOR2I(pcbnew.FromMM(1), 0))
+        plan = ReplicationPlan(sublayout_board, sublayout_board)
+        plan.replicate_many(board, [(anchor, target_path)], FootprintCorrespondence.by_tstamp, record=record)
+        second = record.instance(target_path)
+        self.assertEqual(len(board.GetTracks()), track_count)
+        changed = [src_id for src_id in first.items if first.items[src_id] != second.items[src_id]]
+        self.assertEqual(changed, [BoardUtils.item_id(moved_track)])
+        self.assertIsNone(BoardUtils.resolve_item(board, first.items[changed[0]][1]))
+
+        # changing only a track width also replaces its target
+        widened_track = next(track for track in sublayout_board.GetTracks()
+                             if BoardUtils.item_id(track) in first.items and BoardUtils.item_id(track) not in changed)
+        widened_track.SetWidth(widened_track.GetWidth() + pcbnew.FromMM(0.1))
+        plan = ReplicationPlan(sublayout_board, sublayout_board)
+        plan.replicate_many(board, [(anchor, target_path)], FootprintCorrespondence.by_tstamp, record=record)
+        third = record.instance(target_path)
+        changed = [src_id for src_id in second.items if second.items[src_id] != third.items[src_id]]
+        self.assertEqual(changed, [BoardUtils.item_id(widened_track)])
+        self.assertEqual(BoardUtils.resolve_item(board, third.items[changed[0]][1]).GetWidth(), widened_track.GetWidth())
+
+        # record round-trips through the sidecar file
+        with tempfile.TemporaryDirectory() as record_dir:
+            record_path = os.path.join(record_dir, 'board.sublayout.json')
+            record.save(record_path)
+            self.assertEqual(ReplicationRecord.load(record_path, 'UsbSublayout').instance(target_path), third)
+            self.assertIsNone(ReplicationRecord.load(record_path, 'other').instance(target_path))
+
+        # a pending record is only used if the board has its items, ie the replicated board was kept
+        with tempfile.TemporaryDirectory() as record_dir:
+            board_path = os.path.join(record_dir, 'board.kicad_pcb')
+            pending_record = ReplicationRecord('UsbSublayout')
+            pending_record.set_instance(target_path, third)
+            pending_record.save(ReplicationRecord.pending_path(board_path))
+
+            def item_exists(item_id: str) -> bool:
+                return BoardUtils.resolve_item(board, item_id) is not None
+            current = ReplicationRecord.load_current(board_path, 'UsbSublayout', item_exists)
+            self.assertEqual(current.instance(target_path), third)
+            current = ReplicationRecord.load_current(board_path, 'UsbSublayout', lambda item_id: False)
+            self.assertIsNone(current.instance(target_path))  # as if the board was reloaded without saving
+            self.assertFalse(os.path.exists(ReplicationRecord.sidecar_path(board_path)))
+
+    def test_replicate_preserve_fills(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'BareBlinkyComplete.kicad_pcb'))  # type: pcbnew.BOARD
+        sublayout_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'UsbSubLayout.kicad_pcb'))  # type: pcbnew.BOARD
+        source_zones = [zone for zone in sublayout_board.Zones() if not zone.GetIsRuleArea()]
+        self.assertTrue(source_zones)
+        pcbnew.ZONE_FILLER(sublayout_board).Fill(sublayout_board.Zones())
+
+        anchor = board.FindFootprintByReference('J1')
+        sublayout = ReplicateSublayout(sublayout_board, sublayout_board, board, anchor, BoardUtils.footprint_path(anchor)[:-1],
+                                       FootprintCorrespondence.by_tstamp)
+        result = sublayout.replicate(preserve_fills=True)
+        self.assertFalse(result.get_error_strs())
+
+        target_zones = [BoardUtils.resolve_item(board, sublayout.record().items[BoardUtils.item_id(zone)][1])
+                        for zone in source_zones]
+        unfilled_ids = {BoardUtils.item_id(zone) for zone in result.zones_unfilled}
+        for source_zone, target_zone in zip(source_zones, target_zones):
+            if BoardUtils.item_id(target_zone) in unfilled_ids:  # foreign copper nearby
+                self.assertFalse(target_zone.IsFilled())
+            else:
+                self.assertTrue(target_zone.IsFilled())
+                self.assertAlmostEqual(sum(target_zone.GetFilledPolysList(layer).Area()
+                                           for layer in target_zone.GetLayerSet().Seq()),
+                                       sum(source_zone.GetFilledPolysList(layer).Area()
+                                           for layer in source_zone.GetLayerSet().Seq()),
+                                       delta=pcbnew.FromMM(1) ** 2)
+
+    def test_replicate_copper_overlaps(self):
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'BareBlinkyComplete.kicad_pcb'))  # type: pcbnew.BOARD
+        sublayout_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'McuSublayout.kicad_pcb'))  # type: pcbnew.BOARD
+        anchor = board.FindFootprintByReference('U2')
+        target_path = BoardUtils.footprint_path(anchor)[:-1]
+        result = ReplicateSublayout(sublayout_board, sublayout_board, board, anchor, target_path,
+                                    FootprintCorrespondence.by_tstamp).replicate()
+        self.assertFalse(result.copper_overlaps)
+
+        # a track outside the instance, on another net, crossing a replicated track
+        replicated_track = [item for item in result.target_group.GetItems() if isinstance(item, pcbnew.PCB_TRACK)
+                            and not isinstance(item, pcbnew.PCB_VIA)][0]
+        other_netcode = [netcode for netcode in board.GetNetsByNetcode().keys()
+                         if netcode not in (0, replicated_track.GetNetCode())][0]
+        mid_x = (replicated_track.GetStart().x + replicated_track.GetEnd().x) // 2
+        mid_y = (replicated_track.GetStart().y + replicated_track.GetEnd().y) // 2
+        crossing_track = pcbnew.PCB_TRACK(board)
+        crossing_track.SetStart(pcbnew.VECTOR2I(mid_x + pcbnew.FromMM(0.5), mid_y + pcbnew.FromMM(0.5)))
+        crossing_track.SetEnd(pcbnew.VECTOR2I(mid_x - pcbnew.FromMM(0.5), mid_y - pcbnew.FromMM(0.5)))
+        crossing_track.SetLayer(replicated_track.GetLayer())
+        crossing_track.SetWidth(replicated_track.GetWidth())
+        crossing_track.SetNetCode(other_netcode)
+        board.Add(crossing_track)
+
+        result = ReplicateSublayout(sublayout_board, sublayout_board, board, anchor, target_path,
+                                    FootprintCorrespondence.by_tstamp).replicate()
+        self.assertIn(BoardUtils.item_id(crossing_track),
+                      [BoardUtils.item_id(other) for item, other in result.copper_overlaps])
+        self.assertFalse(result.possible_copper_overlaps)
+        self.assertEqual(len(result.get_error_strs()), 1)
+        self.assertIn('overlap', result.get_error_strs()[0])
+
+        # items without exact shapes are not known to collide, only to possibly overlap
+        self.assertIsNone(ReplicateSublayout._copper_collides(object(), crossing_track, {crossing_track.GetLayer()}))
+
     def test_replicate_grouped(self):
         # example that replicates into a target group (instead of creating a new group)
         board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))  # type: pcbnew.BOARD
@@ -198,6 +457,40 @@ class ReplicateTestCase(unittest.TestCase):
 
         board.Save('test_output_replicate_grouped.kicad_pcb')
 
+    def test_purge_shapes(self):
+        # graphic shapes in the LCA are only purged with the region included, and only those in the block area
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))  # type: pcbnew.BOARD
+        sublayout_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'UsbSublayout.kicad_pcb'))  # type: pcbnew.BOARD
+        anchor = board.FindFootprintByReference('J1')
+        target_path = BoardUtils.footprint_path(anchor)[:-1]
+        sublayout = ReplicateSublayout(sublayout_board, sublayout_board, board, anchor, target_path,
+                                       FootprintCorrespondence.by_tstamp)
+        lca = sublayout.target_lca()
+        self.assertIsNotNone(lca)
+        inside = pcbnew.PCB_SHAPE(board)  # in the block area
+        inside.SetStart(anchor.GetPosition())
+        inside.SetEnd(anchor.GetPosition() + pcbnew.VECTOR2I(pcbnew.FromMM(0.1), 0))
+        inside.SetLayer(pcbnew.F_SilkS)
+        outside = pcbnew.PCB_SHAPE(board)  # far outside the block area
+        outside.SetStart(pcbnew.VECTOR2I(pcbnew.FromMM(-1000), pcbnew.FromMM(-1000)))
+        outside.SetEnd(pcbnew.VECTOR2I(pcbnew.FromMM(-999), pcbnew.FromMM(-1000)))
+        outside.SetLayer(pcbnew.F_SilkS)
+        for shape in [inside, outside]:
+            board.Add(shape)
+            lca.AddItem(shape)
+        inside_id = BoardUtils.item_id(inside)
+        outside_id = BoardUtils.item_id(outside)
+
+        sublayout.purge_lca()
+        self.assertIsNotNone(BoardUtils.resolve_item(board, inside_id))
+        self.assertIsNotNone(BoardUtils.resolve_item(board, outside_id))
+
+        sublayout = ReplicateSublayout(sublayout_board, sublayout_board, board, anchor, target_path,
+                                       FootprintCorrespondence.by_tstamp, include_region=True)
+        sublayout.purge_lca()
+        self.assertIsNone(BoardUtils.resolve_item(board, inside_id))
+        self.assertIsNotNone(BoardUtils.resolve_item(board, outside_id))
+
     def test_replicate_footprint_error(self):
         board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))  # type: pcbnew.BOARD
 
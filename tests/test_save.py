@@ -3,8 +3,9 @@ import unittest
 
 import pcbnew
 
+from sublayout.board_index import item_bbox
 from sublayout.board_utils import BoardUtils, GroupWrapper
-from sublayout.save_sublayout import HierarchySelector
+from sublayout.save_sublayout import HierarchySelector, SelectionCache
 
 
 class SaveTestCase(unittest.TestCase):
@@ -35,6 +36,21 @@ class SaveTestCase(unittest.TestCase):
         footprint_refs = {footprint.GetReference() for footprint in board.GetFootprints()}
         self.assertEqual(footprint_refs, {'R1', 'R2'})
 
+    def test_save_nets(self):
+        src_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete.kicad_pcb'))
+        src_netcodes = {netname: net.GetNetCode() for netname, net in src_board.GetNetsByName().items()}
+        selector = HierarchySelector(src_board, BoardUtils.footprint_path(src_board.FindFootprintByReference('U2'))[:-1])
+        board = selector.create_sublayout("test.kicad_pcb")
+
+        used_netnames = {pad.GetNetname() for footprint in board.GetFootprints() for pad in footprint.Pads()}
+        used_netnames.update(track.GetNetname() for track in board.GetTracks())
+        self.assertEqual(set(selector.exported_netnames.values()), used_netnames | {''})
+        self.assertLess(len(selector.exported_netnames), len(src_board.GetNetsByNetcode()))
+        for netcode, netname in selector.exported_netnames.items():
+            self.assertEqual(board.FindNet(netname).GetNetCode(), netcode)
+        # the source board nets are untouched
+        self.assertEqual({netname: net.GetNetCode() for netname, net in src_board.GetNetsByName().items()}, src_netcodes)
+
     def test_save_group(self):
         src_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))
         selector = HierarchySelector(src_board, BoardUtils.footprint_path(src_board.FindFootprintByReference('J1'))[:-1])
@@ -49,7 +65,10 @@ class SaveTestCase(unittest.TestCase):
         src_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))
         selector = HierarchySelector(src_board, BoardUtils.footprint_path(src_board.FindFootprintByReference('J1'))[:-1])
         self.assertIsNotNone(src_board.FindFootprintByReference('J1').GetParentGroup())
-        selector.delete((pcbnew.FOOTPRINT,))
+        track_count = len(src_board.GetTracks())
+        removed = selector.delete((pcbnew.FOOTPRINT,))
+        self.assertGreater(removed, 0)
+        self.assertLessEqual(len(src_board.GetTracks()), track_count)
         self.assertIsNotNone(src_board.FindFootprintByReference('J1'))
         self.assertIsNotNone(src_board.FindFootprintByReference('R1'))
         self.assertIsNotNone(src_board.FindFootprintByReference('R2'))
@@ -62,3 +81,63 @@ class SaveTestCase(unittest.TestCase):
         result = selector.get_elts()
         self.assertEqual(len(result.ungrouped_elts), 3)  # 3 footprints
         self.assertEqual(len(result.groups), 0)  # no groups
+        self.assertFalse(result.get_error_strs())
+
+    def test_get_split_group(self):
+        # a group with a footprint of the hierarchy and one outside it
+        src_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'BareBlinkyComplete.kicad_pcb'))
+        group = pcbnew.PCB_GROUP(src_board)
+        group.SetName('mixed')
+        src_board.Add(group)
+        group.AddItem(src_board.FindFootprintByReference('J1'))
+        group.AddItem(src_board.FindFootprintByReference('U2'))
+
+        selector = HierarchySelector(src_board, BoardUtils.footprint_path(src_board.FindFootprintByReference('J1'))[:-1])
+        result = selector.get_elts()
+        self.assertEqual(len(result.groups), 0)
+        self.assertIn('J1', [elt.GetReference() for elt in result.ungrouped_elts if isinstance(elt, pcbnew.FOOTPRINT)])
+        self.assertEqual([split_group.GetName() for split_group in result.split_groups], ['mixed'])
+        self.assertEqual(len(result.get_error_strs()), 1)
+        self.assertIn('mixed', result.get_error_strs()[0])
+
+    def test_selection_cache(self):
+        src_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TestBlinkyComplete_GroupedUsb.kicad_pcb'))
+        path_prefix = BoardUtils.footprint_path(src_board.FindFootprintByReference('J1'))[:-1]
+        cache = SelectionCache()
+        result = cache.get_elts(src_board, path_prefix)
+        self.assertIs(cache.get_elts(src_board, path_prefix), result)
+        self.assertEqual(len(result.groups), 1)
+
+        cache.selector(src_board, path_prefix).delete((pcbnew.FOOTPRINT,))
+        cache.invalidate(src_board)
+        result_after = cache.get_elts(src_board, path_prefix)
+        self.assertIsNot(result_after, result)
+        self.assertIn('J1', [elt.GetReference() for elt in result_after.ungrouped_elts
+                             if isinstance(elt, pcbnew.FOOTPRINT)])  # no longer grouped
+
+    def test_include_region(self):
+        src_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'TofArray.kicad_pcb'))
+        path_prefix = BoardUtils.footprint_path(src_board.FindFootprintByReference('U3'))[:-1]
+        result = HierarchySelector(src_board, path_prefix).get_elts()
+        region_result = HierarchySelector(src_board, path_prefix, include_region=True).get_elts()
+        self.assertEqual(region_result.footprints, result.footprints)
+
+        def item_ids(result):
+            return {BoardUtils.item_id(item) for item in result.ungrouped_elts} | \
+                {BoardUtils.item_id(item) for group in result.groups
+                 for item in GroupWrapper(src_board, group).recursive_items()}
+        base_ids = item_ids(result)
+        self.assertTrue(base_ids.issubset(item_ids(region_result)))
+
+        # added items are inside the footprints' area, and are not on nets of other hierarchies
+        footprint_bboxes = [item_bbox(footprint) for footprint in result.footprints]
+        left, top = min(bbox[0] for bbox in footprint_bboxes), min(bbox[1] for bbox in footprint_bboxes)
+        right, bottom = max(bbox[2] for bbox in footprint_bboxes), max(bbox[3] for bbox in footprint_bboxes)
+        hierarchy_netcodes = {pad.GetNetCode() for footprint in result.footprints for pad in footprint.Pads()}
+        for item in region_result.ungrouped_elts:
+            if BoardUtils.item_id(item) in base_ids:
+                continue
+            item_left, item_top, item_right, item_bottom = item_bbox(item)
+            self.assertTrue(left <= item_left and item_right <= right and top <= item_top and item_bottom <= bottom)
+            if isinstance(item, pcbnew.BOARD_CONNECTED_ITEM) and item.GetNetCode() != 0:
+                self.assertIn(item.GetNetCode(), hierarchy_netcodes)
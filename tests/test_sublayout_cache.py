@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pcbnew
+
+from sublayout.sublayout_cache import SublayoutCache
+
+
+class SublayoutCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._files = []
+        for name in ['McuSublayout.kicad_pcb', 'McuSublayout_Rot.kicad_pcb']:
+            filename = os.path.join(self._dir.name, name)
+            shutil.copyfile(os.path.join(os.path.dirname(__file__), name), filename)
+            self._files.append(filename)
+
+    def test_cache_hit(self):
+        loads = []
+        def loader(filename: str) -> pcbnew.BOARD:
+            loads.append(filename)
+            return pcbnew.LoadBoard(filename)
+        cache = SublayoutCache(loader=loader)
+
+        entry = cache.get(self._files[0])
+        self.assertIsNotNone(entry.board.FindFootprintByReference('U2'))
+        self.assertIs(cache.get(self._files[0]), entry)
+        self.assertEqual(len(loads), 1)
+
+        # touched but unchanged is still a hit
+        stat = os.stat(self._files[0])
+        os.utime(self._files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertIs(cache.get(self._files[0]), entry)
+        self.assertEqual(len(loads), 1)
+
+        # changed content is reloaded
+        shutil.copyfile(os.path.join(os.path.dirname(__file__), 'McuSublayout_Rot.kicad_pcb'), self._files[0])
+        reloaded = cache.get(self._files[0])
+        self.assertIsNot(reloaded, entry)
+        self.assertNotEqual(reloaded.content_hash, entry.content_hash)
+        self.assertEqual(len(loads), 2)
+
+    def test_cache_eviction(self):
+        cache = SublayoutCache(max_entries=1, loader=pcbnew.LoadBoard)
+        first = cache.get(self._files[0])
+        cache.get(self._files[1])
+        self.assertEqual(len(cache), 1)
+        self.assertIsNot(cache.get(self._files[0]), first)  # evicted, so reloaded
+
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
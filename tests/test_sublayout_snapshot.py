@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pcbnew
+
+from sublayout.board_utils import BoardUtils
+from sublayout.replicate_sublayout import ReplicateSublayout, FootprintCorrespondence, ReplicationPlan, PlanFootprint, \
+    PlanGroup, PlanShape, PlanTrack, PlanZone
+from sublayout.sublayout_cache import SublayoutCache
+from sublayout.sublayout_snapshot import SublayoutSnapshot, snapshot_path, write_snapshot
+
+
+class SublayoutSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._file = os.path.join(self._dir.name, 'McuSublayout.kicad_pcb')
+        shutil.copyfile(os.path.join(os.path.dirname(__file__), 'McuSublayout.kicad_pcb'), self._file)
+
+    def test_snapshot_roundtrip(self):
+        board = pcbnew.LoadBoard(self._file)  # type: pcbnew.BOARD
+        write_snapshot(board, self._file)
+
+        snapshot = SublayoutSnapshot.load_fresh(self._file)
+        self.assertIsNotNone(snapshot)
+        with snapshot:
+            rebuilt, stable_ids = snapshot.build_board(self._file)
+
+        def footprint_data(board: pcbnew.BOARD):
+            return sorted((footprint.GetReference(), BoardUtils.footprint_path(footprint),
+                           tuple(footprint.GetPosition()), footprint.GetSide(), footprint.GetFPIDAsString(),
+                           tuple(sorted((pad.GetNumber(), pad.GetNetname()) for pad in footprint.Pads())))
+                          for footprint in board.GetFootprints())
+        self.assertEqual(footprint_data(rebuilt), footprint_data(board))
+
+        def track_data(board: pcbnew.BOARD):
+            return sorted((tuple(track.GetStart()), tuple(track.GetEnd()), track.GetWidth(), track.GetNetname())
+                          for track in board.GetTracks())
+        self.assertEqual(track_data(rebuilt), track_data(board))
+        self.assertEqual(sorted(zone.GetNumCorners() for zone in rebuilt.Zones()),
+                         sorted(zone.GetNumCorners() for zone in board.Zones()))
+
+        # rebuilt items map back to the saved item ids
+        self.assertEqual(sorted(stable_ids[BoardUtils.item_id(footprint)] for footprint in rebuilt.GetFootprints()),
+                         sorted(BoardUtils.item_id(footprint) for footprint in board.GetFootprints()))
+
+    def test_snapshot_stale(self):
+        board = pcbnew.LoadBoard(self._file)  # type: pcbnew.BOARD
+        write_snapshot(board, self._file)
+        with open(self._file, 'a') as f:
+            f.write('\n')
+        self.assertIsNone(SublayoutSnapshot.load_fresh(self._file))
+
+        with open(snapshot_path(self._file), 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertIsNone(SublayoutSnapshot.load_fresh(self._file))
+
+    def test_snapshot_restore(self):
+        board = pcbnew.LoadBoard(self._file)  # type: pcbnew.BOARD
+        write_snapshot(board, self._file)
+
+        loads = []
+        def loader(filename: str) -> pcbnew.BOARD:
+            loads.append(filename)
+            return pcbnew.LoadBoard(filename)
+        sublayout = SublayoutCache(loader=loader).get(self._file)
+        self.assertEqual(loads, [])  # rebuilt from the snapshot, not parsed
+
+        target_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'BareBlinkyComplete.kicad_pcb'))  # type: pcbnew.BOARD
+        anchor = target_board.FindFootprintByReference('U2')
+        plan = ReplicationPlan(sublayout.board, sublayout.board, sublayout.index, sublayout.stable_ids)
+        replicate = ReplicateSublayout(sublayout.board, plan, target_board, anchor, BoardUtils.footprint_path(anchor)[:-1],
+                                       FootprintCorrespondence.by_tstamp)
+        result = replicate.replicate()
+        self.assertFalse(result.get_error_strs())
+        self.assertTrue(set(replicate.record().footprints).issubset(
+            {BoardUtils.item_id(footprint) for footprint in board.GetFootprints()}))
+
+    def test_snapshot_by_topology(self):
+        # by_topology labels footprints by FPID, so a rebuilt source must match as the parsed one does
+        sublayout_file = os.path.join(self._dir.name, 'CharlieSublayout.kicad_pcb')
+        shutil.copyfile(os.path.join(os.path.dirname(__file__), 'CharlieSublayout.kicad_pcb'), sublayout_file)
+        sublayout_board = pcbnew.LoadBoard(sublayout_file)  # type: pcbnew.BOARD
+        write_snapshot(sublayout_board, sublayout_file)
+        with SublayoutSnapshot.load_fresh(sublayout_file) as snapshot:
+            rebuilt, stable_ids = snapshot.build_board(sublayout_file)
+
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'CharlieRgb_Unplaced.kicad_pcb'))  # type: pcbnew.BOARD
+        anchor = board.FindFootprintByReference('R4')
+        parsed = FootprintCorrespondence.by_topology(sublayout_board, sublayout_board, board, BoardUtils.footprint_path(anchor)[:-1])
+        correspondence = FootprintCorrespondence.by_topology(rebuilt, rebuilt, board, BoardUtils.footprint_path(anchor)[:-1])
+        self.assertEqual(len(correspondence.mapped_footprints), 9)
+        self.assertEqual(sorted((src.GetReference(), target.GetReference()) for src, target in correspondence.mapped_footprints),
+                         sorted((src.GetReference(), target.GetReference()) for src, target in parsed.mapped_footprints))
+        for src_footprint, target_footprint in correspondence.mapped_footprints:
+            self.assertEqual(src_footprint.GetFPIDAsString(), target_footprint.GetFPIDAsString())
+
+    def test_snapshot_parity(self):
+        # a source with settings and fills beyond the defaults, which a snapshot restore must replicate as a parse would
+        sublayout_file = os.path.join(self._dir.name, 'UsbSubLayout.kicad_pcb')
+        board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'UsbSubLayout.kicad_pcb'))  # type: pcbnew.BOARD
+        for zone in board.Zones():
+            zone.SetHatchOrientation(pcbnew.EDA_ANGLE(30, pcbnew.DEGREES_T))
+            zone.SetThermalReliefGap(pcbnew.FromMM(0.3))
+            zone.SetLocked(True)
+        pcbnew.ZONE_FILLER(board).Fill(board.Zones())
+        list(board.GetTracks())[0].SetLocked(True)
+        pcbnew.SaveBoard(sublayout_file, board)
+
+        parsed = pcbnew.LoadBoard(sublayout_file)  # type: pcbnew.BOARD
+        write_snapshot(parsed, sublayout_file)
+        with SublayoutSnapshot.load_fresh(sublayout_file) as snapshot:
+            rebuilt, stable_ids = snapshot.build_board(sublayout_file)
+        parsed_plan = ReplicationPlan(parsed, parsed)
+        rebuilt_plan = ReplicationPlan(rebuilt, rebuilt, stable_ids=stable_ids)
+
+        def plan_data(plan: ReplicationPlan, group: PlanGroup):
+            data = []
+            for item in group.items:
+                if isinstance(item, PlanGroup):
+                    data.append((item.group_id, plan_data(plan, item)))
+                elif isinstance(item, PlanFootprint):
+                    pads = sorted((pad.GetNumber(), pad.GetNetname(), tuple(pad.GetPosition()),
+                                   tuple(pad.GetLayerSet().Seq()), tuple(pad.GetBoundingBox().GetSize()))
+                                  for pad in item.footprint.Pads())
+                    data.append(item._replace(footprint=(item.footprint.GetFPIDAsString(), tuple(pads))))
+                elif isinstance(item, PlanTrack):
+                    data.append(item._replace(track=item.track.GetNetname()))
+                elif isinstance(item, PlanZone):
+                    data.append((item._replace(zone=item.zone.GetNetname()), plan.fill_signature(item)))
+                elif isinstance(item, PlanShape):
+                    data.append(item._replace(shape=None))
+            return sorted(data, key=repr)
+        self.assertEqual(plan_data(rebuilt_plan, rebuilt_plan.root), plan_data(parsed_plan, parsed_plan.root))
+
+        def restore(plan: ReplicationPlan):
+            target_board = pcbnew.LoadBoard(os.path.join(os.path.dirname(__file__), 'BareBlinkyComplete.kicad_pcb'))  # type: pcbnew.BOARD
+            anchor = target_board.FindFootprintByReference('J1')
+            replicate = ReplicateSublayout(plan.src_board, plan, target_board, anchor, BoardUtils.footprint_path(anchor)[:-1],
+                                           FootprintCorrespondence.by_tstamp)
+            result = replicate.replicate(preserve_fills=True)
+            self.assertFalse(result.get_error_strs())
+            fills = sorted((zone.IsFilled(), sum(zone.GetFilledPolysList(layer).OutlineCount()
+                                                 for layer in zone.GetLayerSet().Seq()))
+                           for zone in target_board.Zones())
+            return sorted(replicate.record().targets.values()), fills
+        self.assertEqual(restore(rebuilt_plan), restore(parsed_plan))
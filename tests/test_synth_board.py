@@ -0,0 +1,29 @@
+import os
+import unittest
+
+from sublayout.board_utils import BoardUtils
+from sublayout.hierarchy_namer import HierarchyData
+from sublayout.replicate_sublayout import FootprintCorrespondence
+from sublayout.save_sublayout import HierarchySelector
+from benchmarks.synth_board import SynthParams, generate_board
+
+
+class SynthBoardTestCase(unittest.TestCase):
+    def test_generate(self):
+        board, anchor_ref = generate_board(os.path.join(os.path.dirname(__file__), 'TofArray_Unreplicated.kicad_pcb'),
+                                           'U3', SynthParams(instances=6, footprints_per_instance=5,
+                                                             tracks_per_net=3, zone_corners=12))
+        anchor = board.FindFootprintByReference(anchor_ref)
+        path = BoardUtils.footprint_path(anchor)[:-1]
+        namer = HierarchyData(board)
+        instance_paths = namer.instances_of(namer.sheetfile_of(path))
+        self.assertEqual(len(instance_paths), 6)
+
+        source = HierarchySelector(board, path).get_elts()
+        self.assertEqual(len(source.footprints), 5)
+        self.assertEqual(len(source.ungrouped_elts), 5 + 3 * len(source.netcodes) + 1)  # footprints, tracks, zone
+
+        for instance_path in instance_paths:
+            correspondence = FootprintCorrespondence.by_tstamp(board, source, board, instance_path)
+            self.assertEqual(len(correspondence.mapped_footprints), 5)
+            self.assertEqual(len(correspondence.source_only_footprints), 0)